@@ -0,0 +1,194 @@
+"""Admission control: shed load early instead of queueing until timeout.
+
+Off unless ADMISSION_ENABLED=1. Two checks then run before a route handler:
+
+  * a per-client token bucket (ADMISSION_RATE requests/second, bursts of
+    ADMISSION_BURST), kept in a memory-mapped table shared by every worker
+    on the host so a client cannot multiply its allowance by hitting
+    different workers; over the limit -> ``429`` with ``Retry-After``.
+    ADMISSION_RATE defaults to 0, no rate limit, because it is only as good
+    as the client address: that is REMOTE_ADDR, or the first
+    X-Forwarded-For entry with ADMISSION_TRUST_PROXY=1. Behind a load
+    balancer REMOTE_ADDR is the balancer's, and every user would share one
+    bucket, so set a rate only once the address identifies real clients.
+  * a cap on in-flight requests per route in each worker
+    (ADMISSION_MAX_INFLIGHT, overridden per endpoint with
+    ADMISSION_ROUTE_LIMITS="create_secret=2,view_secret=3"). A request
+    that finds its route full waits up to ADMISSION_QUEUE_TIMEOUT seconds
+    for a slot (counted as queued), then gets ``503`` with ``Retry-After``
+    (counted as shed). The cap is per worker process, not per host: with
+    N workers a route can have N times the cap in flight. The default is
+    one below the worker's thread count (SERVER_THREADS, exported by
+    gunicorn_config.py for gthread workers and by asgi.py for its pool),
+    so one busy route cannot take every thread; without it there is no cap.
+
+Static assets, the index page and /metrics are never limited.
+"""
+import fcntl
+import hashlib
+import math
+import mmap
+import os
+import struct
+import threading
+import time
+
+# key hash, tokens, last refill
+_BUCKET = struct.Struct('<Qdd')
+# Slots probed per key; when all are taken the least recently used is evicted
+_PROBE = 8
+
+
+class SharedTokenBuckets:
+    def __init__(self, path, rate, burst, slots=65536, stripes=64):
+        self.rate = rate
+        self.burst = burst
+        self.slots = slots - slots % stripes
+        self.stripes = stripes
+        self.stripe_slots = self.slots // stripes
+        size = self.slots * _BUCKET.size
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        if os.fstat(self._fd).st_size != size:
+            os.ftruncate(self._fd, size)
+        self._map = mmap.mmap(self._fd, size)
+        self._pid = None
+
+    def _lock(self, stripe):
+        if self._pid != os.getpid():
+            self._locks = [threading.Lock() for _ in range(self.stripes)]
+            self._pid = os.getpid()
+        return self._locks[stripe]
+
+    def acquire(self, client, now=None):
+        """Take one token; returns 0 if allowed, else seconds until one is available."""
+        now = time.time() if now is None else now
+        key = int.from_bytes(hashlib.blake2b(client.encode(), digest_size=8).digest(), 'little') or 1
+        stripe = key % self.stripes
+        start = (key // self.stripes) % self.stripe_slots
+        base = stripe * self.stripe_slots
+        with self._lock(stripe):
+            fcntl.lockf(self._fd, fcntl.LOCK_EX, self.stripe_slots * _BUCKET.size, base * _BUCKET.size)
+            try:
+                victim = None
+                for i in range(_PROBE):
+                    offset = (base + (start + i) % self.stripe_slots) * _BUCKET.size
+                    slot_key, tokens, last = _BUCKET.unpack_from(self._map, offset)
+                    if slot_key == key:
+                        tokens = min(self.burst, tokens + (now - last) * self.rate)
+                        break
+                    if victim is None or slot_key == 0 or last < victim[1]:
+                        victim = (offset, 0.0 if slot_key == 0 else last)
+                else:
+                    # New (or evicted) client starts with a full bucket
+                    offset, tokens = victim[0], float(self.burst)
+                if tokens < 1:
+                    _BUCKET.pack_into(self._map, offset, key, tokens, now)
+                    return (1 - tokens) / self.rate
+                _BUCKET.pack_into(self._map, offset, key, tokens - 1, now)
+                return 0
+            finally:
+                fcntl.lockf(self._fd, fcntl.LOCK_UN, self.stripe_slots * _BUCKET.size, base * _BUCKET.size)
+
+
+class RouteLimits:
+    def __init__(self, default, overrides=None, queue_timeout=0.1):
+        self.default = default
+        self.overrides = overrides or {}
+        self.queue_timeout = queue_timeout
+        self._semaphores = {}
+        self._lock = threading.Lock()
+
+    def _semaphore(self, endpoint):
+        semaphore = self._semaphores.get(endpoint)
+        if semaphore is None:
+            limit = self.overrides.get(endpoint, self.default)
+            if limit <= 0:
+                return None
+            with self._lock:
+                semaphore = self._semaphores.setdefault(endpoint, threading.BoundedSemaphore(limit))
+        return semaphore
+
+    def acquire(self, endpoint):
+        """Returns (admitted, queued)."""
+        semaphore = self._semaphore(endpoint)
+        if semaphore is None or semaphore.acquire(blocking=False):
+            return True, False
+        return semaphore.acquire(timeout=self.queue_timeout), True
+
+    def release(self, endpoint):
+        semaphore = self._semaphore(endpoint)
+        if semaphore is not None:
+            semaphore.release()
+
+
+def parse_limits(spec):
+    limits = {}
+    for part in filter(None, (p.strip() for p in spec.split(','))):
+        endpoint, _, limit = part.partition('=')
+        limits[endpoint.strip()] = int(limit)
+    return limits
+
+
+class Admission:
+    EXEMPT = frozenset({'static_asset', 'index', 'metrics_endpoint'})
+
+    def __init__(self, buckets, routes, registry, trust_proxy=False):
+        self.buckets = buckets
+        self.routes = routes
+        self.trust_proxy = trust_proxy
+        self.shed = registry.counter(
+            'secret_share_admission_shed', 'Requests rejected by admission control', ('route', 'reason'))
+        self.queued = registry.counter(
+            'secret_share_admission_queued', 'Requests that waited for a route slot', ('route',))
+
+    def client_id(self, request):
+        if self.trust_proxy:
+            forwarded = request.headers.get('X-Forwarded-For')
+            if forwarded:
+                return forwarded.split(',')[0].strip()
+        return request.remote_addr or ''
+
+    def _exempt(self, endpoint):
+        return endpoint is None or endpoint in self.EXEMPT
+
+    def admit(self, request):
+        """Returns None to let the request in, else (status, retry_after seconds)."""
+        endpoint = request.endpoint
+        if self._exempt(endpoint):
+            return None
+        if self.buckets is not None:
+            wait = self.buckets.acquire(self.client_id(request))
+            if wait:
+                self.shed.inc(route=endpoint, reason='rate_limited')
+                return 429, max(1, math.ceil(wait))
+        admitted, queued = self.routes.acquire(endpoint)
+        if queued:
+            self.queued.inc(route=endpoint)
+        if not admitted:
+            self.shed.inc(route=endpoint, reason='overloaded')
+            return 503, 1
+        return None
+
+    def release(self, request):
+        # Only call after admit() let the request in
+        if not self._exempt(request.endpoint):
+            self.routes.release(request.endpoint)
+
+
+def from_environ(secrets_dir, registry):
+    from shm_store import default_arena_path
+    rate = float(os.environ.get('ADMISSION_RATE', 0))
+    buckets = None
+    if rate > 0:
+        buckets = SharedTokenBuckets(
+            os.environ.get('ADMISSION_STATE_PATH') or default_arena_path(secrets_dir, 'buckets'),
+            rate,
+            float(os.environ.get('ADMISSION_BURST', 20)),
+        )
+    threads = int(os.environ.get('SERVER_THREADS', 0))
+    routes = RouteLimits(
+        int(os.environ.get('ADMISSION_MAX_INFLIGHT') or max(0, threads - 1)),
+        parse_limits(os.environ.get('ADMISSION_ROUTE_LIMITS', '')),
+        float(os.environ.get('ADMISSION_QUEUE_TIMEOUT', 0.5)),
+    )
+    return Admission(buckets, routes, registry, os.environ.get('ADMISSION_TRUST_PROXY', '0') == '1')
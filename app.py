@@ -1,62 +1,216 @@
-from flask import Flask, render_template_string, request, jsonify
-import secrets
+from flask import Flask, g, request, jsonify
 import os
-import json
 import logging
+import time
 from datetime import datetime, timedelta
-import base64
-from hashlib import sha256
-from secrets import token_bytes
 from urllib.parse import unquote
 
+import admission
+import payloads
+from assets import AssetRegistry, CACHE_CONTROL
+from compression import ResponseCompressor
+from crypto_engine import AeadEngine, LEGACY_ALG, configured_engine, get_engine
+from keystore import LEGACY_KEY_ID, from_environ as keyring_from_environ, install_reload_handler
+from log_pipeline import install_reopen_handler, setup_logging
+from metrics import CONTENT_TYPE as METRICS_CONTENT_TYPE, Registry
+from pages import build_registry, is_current
+from reaper import ExpiryReaper
+from records import is_expired
+from storage import STREAMS_DIR, InstrumentedStore, TieredStore, is_valid_token, open_store
+from streaming import StreamStore, StreamTooLarge
+
 MAX_SECRET_LENGTH = 5000
+MAX_BATCH_SIZE = int(os.environ.get('MAX_BATCH_SIZE', 500))
 
-app = Flask(__name__)
+# /static is served by static_asset below, not by Flask's static route
+app = Flask(__name__, static_folder=None)
 
-# Configure logging
-logging.basicConfig(
-    filename='app.log',
-    level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s'
-)
+# Shared CSS/JS, fingerprinted and precompressed once at startup; see assets.py
+assets = AssetRegistry()
+
+# Templates are compiled (and static pages rendered) once, here; see pages.py
+pages = build_registry(app.jinja_env, assets, os.environ.get('PAGE_CACHE_CONTROL', 'no-cache'))
+
+# Responses under these endpoints carry a secret or tell whether one exists.
+# They are never stored by a browser or proxy, whatever page they render.
+NO_STORE_ENDPOINTS = frozenset({
+    'create_secret', 'create_secret_batch', 'create_secret_stream',
+    'download_secret', 'view_secret', 'claim_secret', 'consume_secret',
+})
+
+# Configure logging: request threads only enqueue, see log_pipeline.py
+log_pipeline = setup_logging('app.log')
 
 # Create secrets directory
 SECRETS_DIR = os.path.join(os.getcwd(), 'secrets')
 if not os.path.exists(SECRETS_DIR):
     os.makedirs(SECRETS_DIR)
 
+# Metrics are written to one mmap'd file per worker and summed by /metrics
+metrics = Registry(os.environ.get('METRICS_DIR', os.path.join(SECRETS_DIR, '.metrics')))
+REQUEST_SECONDS = metrics.histogram(
+    'secret_share_request_seconds', 'Request latency by route', ('route', 'method'))
+STAGE_SECONDS = metrics.histogram(
+    'secret_share_stage_seconds', 'Time spent in each processing stage', ('stage',))
+SECRETS_CREATED = metrics.counter('secret_share_secrets_created', 'Secrets created')
+SECRETS_VIEWED = metrics.counter('secret_share_secrets_viewed', 'Secrets viewed')
+SECRETS_EXPIRED = metrics.counter('secret_share_secrets_expired', 'Expired secrets requested')
+SECRETS_NOT_FOUND = metrics.counter('secret_share_secrets_not_found', 'Requests for unknown secrets')
+SECRETS_REAPED = metrics.counter('secret_share_secrets_reaped', 'Expired secrets deleted by the reaper')
+REAPER_LAG = metrics.gauge('secret_share_reaper_lag_seconds', 'Age of the oldest expired secret not yet reaped')
+REAPER_PENDING = metrics.gauge('secret_share_reaper_pending', 'Secrets tracked by the reaper')
+COLD_START_SECONDS = metrics.gauge(
+    'secret_share_cold_start_seconds', 'Time from server start to a worker\'s first response')
+
+# gunicorn_config.py sets this in the master; otherwise it is this import
+SERVER_STARTED_AT = float(os.environ.get('SERVER_STARTED_AT') or time.time())
+
+
+def stage_timer(stage):
+    return STAGE_SECONDS.time(stage=stage)
+
+
+# Where secret records live; STORAGE_BACKEND selects it (see storage.py)
+store = InstrumentedStore(open_store(SECRETS_DIR), stage_timer)
+
+# 'claim': /view/<token> only renders a button and the secret is read and
+# destroyed in one POST /claim/<token>. 'two-step': the original flow where
+# /view decrypts the secret and a second POST /consume/<token> deletes it.
+VIEW_MODE = os.environ.get('VIEW_MODE', 'claim')
+
+# Deletes expired secrets nobody opened; runs in one elected worker (see reaper.py)
+def record_reaper_cycle(removed, stats):
+    SECRETS_REAPED.inc(removed)
+    REAPER_LAG.set(stats['lag_seconds'])
+    REAPER_PENDING.set(stats['pending'])
+
+
+reaper = ExpiryReaper(
+    store.store,
+    os.path.join(SECRETS_DIR, '.reaper.lock'),
+    interval=float(os.environ.get('REAPER_INTERVAL', 5)),
+    batch_size=int(os.environ.get('REAPER_BATCH_SIZE', 500)),
+    rescan_interval=float(os.environ.get('REAPER_RESCAN_INTERVAL', 300)),
+    on_cycle=record_reaper_cycle,
+)
+
+# Large secrets are streamed to and from disk in encrypted chunks with bounded
+# memory, outside the regular store; see streaming.py. With a store other
+# nodes share, the stream files must be shared too, so uploads are refused
+# unless STREAMS_PATH names such a directory.
+streams = StreamStore(
+    os.environ.get('STREAMS_PATH') or os.path.join(SECRETS_DIR, STREAMS_DIR),
+    chunk_size=int(os.environ.get('STREAM_CHUNK_SIZE', 64 * 1024)),
+    max_bytes=int(os.environ.get('MAX_STREAM_BYTES', 64 * 1024 * 1024)),
+    orphan_seconds=float(os.environ.get('STREAM_ORPHAN_SECONDS', 3600)),
+)
+streams_enabled = not store.shared or bool(os.environ.get('STREAMS_PATH'))
+reaper.add_sweeper(streams.sweep)
+if isinstance(store.store, TieredStore) and not store.indexed_expiry:
+    # store.sweep() is never called for an unindexed cold store
+    reaper.add_sweeper(store.store.hot.sweep)
+
+
+# Per-client rate limits and per-route in-flight caps; see admission.py
+admission_control = (
+    admission.from_environ(SECRETS_DIR, metrics)
+    if os.environ.get('ADMISSION_ENABLED', '0') == '1' else None
+)
+
+# Popped by the first request this process serves; see observe_request_latency
+cold_start = {}
+
+
+def detach_for_fork():
+    """Under preload_app, drop the master's store handles before workers fork."""
+    store.detach()
+    # Write the master's import-time log records once, not from every worker
+    log_pipeline.drain()
+
+
+def start_worker():
+    """Start this process's background threads.
+
+    Run on import, or under gunicorn from post_worker_init (WORKER_HOOKS=1,
+    set by gunicorn_config.py) so nothing is started in the master.
+    """
+    log_pipeline.start()
+    if os.environ.get('REAPER_ENABLED', '1') == '1':
+        reaper.start()
+    cold_start['worker_started'] = time.time()
+
+
+if os.environ.get('WORKER_HOOKS') != '1':
+    start_worker()
+
+
+def cached(ttl, fn):
+    # Walking a large store is too slow to do on every scrape
+    state = {'at': 0.0, 'value': None}
+
+    def wrapper():
+        if time.monotonic() - state['at'] > ttl:
+            state['value'], state['at'] = fn(), time.monotonic()
+        return state['value']
+    return wrapper
+
+
+store_stats = cached(float(os.environ.get('METRICS_STATS_TTL', 30)), store.stats)
+metrics.add_collector('secret_share_live_secrets', 'Secrets currently stored', lambda: store_stats()[0])
+metrics.add_collector('secret_share_store_bytes', 'Bytes used by stored secrets', lambda: store_stats()[1])
+
+
+# Key material is loaded and derived once per worker; see keystore.py. Loaded
+# (and created on first run) here rather than by the first request, so under
+# preload_app it happens once in the gunicorn master.
+keyring = keyring_from_environ(SECRETS_DIR)
+if store.shared and not keyring.shared:
+    raise RuntimeError(
+        f'STORAGE_BACKEND={store.name} is read by every node, so they need the same keys: '
+        'set KEYS_DIR or SECRET_KEYS (see keystore.py)')
+keyring.load()
+
 
 def get_encryption_key():
-    key_file = os.path.join(SECRETS_DIR, '.encryption_key')
-    if not os.path.exists(key_file):
-        with open(key_file, 'wb') as f:
-            f.write(token_bytes(32))
-    with open(key_file, 'rb') as f:
-        return f.read()
+    return keyring.active().material
+
+
+# Engine used for new records; CRYPTO_ENGINE selects it (see crypto_engine.py)
+crypto = configured_engine()
+# Streams are always chunked AEAD, even if CRYPTO_ENGINE names the legacy XOR
+stream_crypto = crypto if isinstance(crypto, AeadEngine) else get_engine('aes-gcm')
+# Compresses larger plaintexts before encryption when PAYLOAD_COMPRESSION is set (see payloads.py)
+payload_compressor = payloads.from_environ()
 
 
 def secure_encrypt(text):
-    key = get_encryption_key()
-    text_bytes = text.encode()
-    key_bytes = sha256(key).digest()
-    # Extend key if needed
-    key_bytes = (key_bytes * (len(text_bytes) // len(key_bytes) + 1))[:len(text_bytes)]
-    # XOR with random prefix for added security
-    prefix = token_bytes(16)
-    encrypted = bytes(a ^ b for a, b in zip(text_bytes, key_bytes))
-    return base64.b64encode(prefix + encrypted).decode()
-
-def secure_decrypt(encrypted_text):
-    key = get_encryption_key()
-    key_bytes = sha256(key).digest()
-    encrypted_bytes = base64.b64decode(encrypted_text.encode())
-    # Remove prefix
-    prefix = encrypted_bytes[:16]
-    encrypted_bytes = encrypted_bytes[16:]
-    # Extend key if needed
-    key_bytes = (key_bytes * (len(encrypted_bytes) // len(key_bytes) + 1))[:len(encrypted_bytes)]
-    decrypted = bytes(a ^ b for a, b in zip(encrypted_bytes, key_bytes))
-    return decrypted.decode()
+    # Returns (blob, key_id, alg, compression)
+    with stage_timer('key_load'):
+        key = keyring.active()
+    with stage_timer('payload_compress'):
+        data, compression = payload_compressor.pack(text.encode())
+    with stage_timer('encrypt'):
+        blob = crypto.encrypt(key, data)
+    return blob, key.key_id, crypto.name, compression
+
+def secure_decrypt(blob, key_id=LEGACY_KEY_ID, alg=LEGACY_ALG, compression=None):
+    # blob is the raw nonce + ciphertext + tag, usually a memoryview into the record
+    with stage_timer('key_load'):
+        key = keyring.get(key_id)
+    with stage_timer('decrypt'):
+        data = get_engine(alg).decrypt(key, blob)
+    if compression is not None:
+        with stage_timer('payload_decompress'):
+            data = payloads.unpack(data, compression)
+    return data.decode()
+
+def render_page(name, **context):
+    with stage_timer('render'):
+        return pages.render(name, **context)
+
+def decrypt_record(data):
+    # decode_record fills in key_id / alg for records that predate them
+    return secure_decrypt(data['secret'], data['key_id'], data['alg'], data['compression'])
     
 # Generate encryption key
 # ENCRYPTION_KEY_FILE = os.path.join(SECRETS_DIR, '.encryption_key')
@@ -76,728 +230,328 @@ def secure_decrypt(encrypted_text):
 # def secure_decrypt(encrypted_text):
     # return fernet.decrypt(encrypted_text.encode()).decode()
 
-HTML_TEMPLATE = '''
-<!DOCTYPE html>
-<html lang="en">
-<head>
-    <meta charset="UTF-8">
-    <meta name="viewport" content="width=device-width, initial-scale=1.0">
-    <title>Secure Secret Sharing</title>
-    <link href="https://fonts.googleapis.com/css2?family=Inter:wght@400;500;600&display=swap" rel="stylesheet">
-    <style>
-        :root {
-            --primary-color: #2563eb;
-            --primary-hover: #1d4ed8;
-            --bg-color: #f8fafc;
-            --card-bg: #ffffff;
-            --text-color: #1e293b;
-            --border-color: #e2e8f0;
-        }
-
-        * {
-            margin: 0;
-            padding: 0;
-            box-sizing: border-box;
-        }
-
-        body {
-            font-family: 'Inter', sans-serif;
-            background-color: var(--bg-color);
-            color: var(--text-color);
-            line-height: 1.5;
-            padding: 1rem;
-        }
-
-        .container {
-            max-width: 600px;
-            margin: 2rem auto;
-        }
-
-        .card {
-            background: var(--card-bg);
-            border-radius: 12px;
-            box-shadow: 0 4px 6px -1px rgb(0 0 0 / 0.1);
-            padding: 2rem;
-        }
-
-        h1 {
-            font-size: 1.5rem;
-            font-weight: 600;
-            margin-bottom: 1.5rem;
-            color: var(--text-color);
-        }
-
-        .input-group {
-            margin-bottom: 1.5rem;
-        }
-
-        textarea {
-            width: 100%;
-            min-height: 120px;
-            padding: 0.75rem;
-            border: 2px solid var(--border-color);
-            border-radius: 8px;
-            font-family: inherit;
-            font-size: 1rem;
-            transition: border-color 0.15s ease;
-            resize: vertical;
-        }
-
-        textarea:focus {
-            outline: none;
-            border-color: var(--primary-color);
-            box-shadow: 0 0 0 3px rgba(37, 99, 235, 0.1);
-        }
-
-        .controls {
-            display: flex;
-            gap: 1rem;
-            margin-bottom: 1.5rem;
-        }
-
-        select {
-            padding: 0.5rem;
-            border: 2px solid var(--border-color);
-            border-radius: 6px;
-            font-size: 0.875rem;
-            min-width: 120px;
-            cursor: pointer;
-        }
-
-        button {
-            background-color: var(--primary-color);
-            color: white;
-            border: none;
-            padding: 0.5rem 1rem;
-            border-radius: 6px;
-            font-size: 0.875rem;
-            font-weight: 500;
-            cursor: pointer;
-            transition: background-color 0.15s ease;
-        }
-
-        button:hover {
-            background-color: var(--primary-hover);
-        }
-
-        button:disabled {
-            opacity: 0.5;
-            cursor: not-allowed;
-        }
-
-        .result {
-            display: none;
-            background-color: var(--bg-color);
-            border-radius: 8px;
-            padding: 1rem;
-            margin-top: 1.5rem;
-        }
-
-        .result.show {
-            display: block;
-            animation: fadeIn 0.3s ease;
-        }
-
-        .link {
-            margin-top: 0.5rem;
-            padding: 0.75rem;
-            background: white;
-            border: 2px solid var(--border-color);
-            border-radius: 6px;
-            word-break: break-all;
-            font-family: monospace;
-        }
-
-        .copy-btn {
-            margin-top: 1rem;
-            background-color: white;
-            color: var(--primary-color);
-            border: 2px solid var(--primary-color);
-        }
-
-        .copy-btn:hover {
-            background-color: var(--bg-color);
-        }
-
-        .loading {
-            display: none;
-            align-items: center;
-            gap: 0.5rem;
-            margin-top: 1rem;
-        }
-
-        .loading.show {
-            display: flex;
-        }
-
-        .spinner {
-            width: 20px;
-            height: 20px;
-            border: 3px solid var(--bg-color);
-            border-top: 3px solid var(--primary-color);
-            border-radius: 50%;
-            animation: spin 1s linear infinite;
-        }
-
-        @keyframes spin {
-            0% { transform: rotate(0deg); }
-            100% { transform: rotate(360deg); }
-        }
-
-        @keyframes fadeIn {
-            from { opacity: 0; transform: translateY(-10px); }
-            to { opacity: 1; transform: translateY(0); }
-        }
-
-        .error {
-            color: #dc2626;
-            font-size: 0.875rem;
-            margin-top: 0.5rem;
-        }
-
-        @media (max-width: 640px) {
-            .container {
-                margin: 1rem auto;
-            }
-            
-            .card {
-                padding: 1.5rem;
-            }
-
-            .controls {
-                flex-direction: column;
-            }
-
-            select, button {
-                width: 100%;
-            }
-        }
-    </style>
-</head>
-<body>
-    <div class="container">
-        <div class="card">
-            <h1>Share a Secret Securely</h1>
-            <div class="input-group">
-                <textarea 
-                    id="secret" 
-                    placeholder="Enter your secret message here..."
-                    maxlength="5000"
-                    aria-label="Secret message"
-                    onkeyup="updateCharCount()"
-                ></textarea>
-                <div id="charCount">0/5000 characters</div>
-                <div id="error" class="error"></div>
-            </div>
-            <div class="controls">
-                <select id="expireTime" aria-label="Expiration time">
-                    <option value="300">5 minutes</option>
-                    <option value="3600">1 hour</option>
-                    <option value="86400">24 hours</option>
-                </select>
-                <button onclick="createSecret()" id="createBtn">Create Secret Link</button>
-            </div>
-            <div id="loading" class="loading">
-                <div class="spinner"></div>
-                <span>Creating secure link...</span>
-            </div>
-            <div id="result" class="result">
-                <strong>Share this link (works only once):</strong>
-                <div id="secretLink" class="link"></div>
-                <button onclick="copyToClipboard()" class="copy-btn">
-                    Copy Link
-                </button>
-            </div>
-        </div>
-    </div>
-
-    <script>
-    
-        function updateCharCount() {
-        const textarea = document.getElementById('secret');
-        const charCount = document.getElementById('charCount');
-        const maxLength = 5000;
-        const remaining = maxLength - textarea.value.length;
-        charCount.textContent = `${textarea.value.length}/${maxLength} characters`;
-        
-            // Change color when nearing limit
-            if (textarea.value.length > maxLength * 0.9) {
-                charCount.style.color = '#dc2626'; // Red
-            } else {
-                charCount.style.color = '#1e293b'; // Normal color
-            }
-        }
-        const createBtn = document.getElementById('createBtn');
-        const loading = document.getElementById('loading');
-        const result = document.getElementById('result');
-        const error = document.getElementById('error');
-
-        async function createSecret() {
-            const secret = document.getElementById('secret').value.trim();
-            error.textContent = '';
-            
-            if (!secret) {
-                error.textContent = 'Please enter a secret message';
-                return;
-            }
-
-            if (secret.length > 5000) {
-                error.textContent = 'Secret must be less than 5000 characters';
-                return;
-            }
-
-            try {
-                createBtn.disabled = true;
-                loading.classList.add('show');
-                result.classList.remove('show');
-                
-                const expireTime = document.getElementById('expireTime').value;
-                
-                const response = await fetch('/create', {
-                    method: 'POST',
-                    headers: {
-                        'Content-Type': 'application/json',
-                    },
-                    body: JSON.stringify({
-                        secret: secret,
-                        expire_seconds: parseInt(expireTime)
-                    }),
-                });
-                
-                if (!response.ok) {
-                    throw new Error('Failed to create secret');
-                }
-
-                const data = await response.json();
-                
-                // Ensure the token is properly encoded
-                const token = encodeURIComponent(data.token);
-    
-                const link = window.location.origin + '/view/' + token;
-                
-                document.getElementById('secretLink').textContent = link;
-                result.classList.add('show');
-            } catch (err) {
-                error.textContent = 'Failed to create secret. Please try again.';
-                console.error(err);
-            } finally {
-                createBtn.disabled = false;
-                loading.classList.remove('show');
-            }
-        }
-
-        async function copyToClipboard() {
-            const link = document.getElementById('secretLink').textContent;
-            try {
-                await navigator.clipboard.writeText(link);
-                const btn = event.target;
-                const originalText = btn.textContent;
-                btn.textContent = 'Copied!';
-                setTimeout(() => {
-                    btn.textContent = originalText;
-                }, 2000);
-            } catch (err) {
-                console.error('Failed to copy:', err);
-            }
-        }
-
-        // Enable create button when user starts typing
-        document.getElementById('secret').addEventListener('input', function() {
-            createBtn.disabled = false;
-            error.textContent = '';
-        });
-        
-    </script>
-</body>
-</html>
-'''
-
-VIEW_TEMPLATE = '''
-<!DOCTYPE html>
-<html lang="en">
-<head>
-    <meta charset="UTF-8">
-    <meta name="viewport" content="width=device-width, initial-scale=1.0">
-    <title>View Secret</title>
-    <link href="https://fonts.googleapis.com/css2?family=Inter:wght@400;500;600&display=swap" rel="stylesheet">
-    <style>
-        :root {
-            --primary-color: #2563eb;
-            --primary-hover: #1d4ed8;
-            --bg-color: #f8fafc;
-            --card-bg: #ffffff;
-            --text-color: #1e293b;
-            --border-color: #e2e8f0;
-        }
-
-        * {
-            margin: 0;
-            padding: 0;
-            box-sizing: border-box;
-        }
-
-        body {
-            font-family: 'Inter', sans-serif;
-            background-color: var(--bg-color);
-            color: var(--text-color);
-            line-height: 1.5;
-            padding: 1rem;
-        }
-
-        .container {
-            max-width: 600px;
-            margin: 2rem auto;
-        }
-
-        .card {
-            background: var(--card-bg);
-            border-radius: 12px;
-            box-shadow: 0 4px 6px -1px rgb(0 0 0 / 0.1);
-            padding: 2rem;
-        }
-
-        h1 {
-            font-size: 1.5rem;
-            font-weight: 600;
-            margin-bottom: 1.5rem;
-            color: var(--text-color);
-        }
-
-        .secret-content {
-            background-color: var(--bg-color);
-            border-radius: 8px;
-            padding: 1rem;
-            margin-bottom: 1rem;
-            white-space: pre-wrap;
-            word-break: break-word;
-        }
-
-        button {
-            background-color: var(--primary-color);
-            color: white;
-            border: none;
-            padding: 0.5rem 1rem;
-            border-radius: 6px;
-            font-size: 0.875rem;
-            font-weight: 500;
-            cursor: pointer;
-            transition: background-color 0.15s ease;
-        }
-
-        button:hover {
-            background-color: var(--primary-hover);
-        }
-
-        .warning {
-            font-size: 0.875rem;
-            color: #dc2626;
-            margin-top: 1rem;
-        }
-
-        @media (max-width: 640px) {
-            .container {
-                margin: 1rem auto;
-            }
-            
-            .card {
-                padding: 1.5rem;
-            }
-        }
-    </style>
-</head>
-<body>
-    <div class="container">
-        <div class="card">
-            <h1>Secret Message</h1>
-            <div id="secretContainer" style="display: none;">
-                <div class="secret-content">{{ secret }}</div>
-                <button onclick="copyToClipboard()">Copy Message</button>
-                <div class="warning">
-                    Note: This message will be destroyed after you leave this page.
-                </div>
-            </div>
-            <div id="viewButtonContainer" class="text-center">
-                <button onclick="viewSecret('{{ token }}')">View Secret</button>
-                <p class="mt-4 text-sm text-gray-600">
-                    Click to view the secret. This can only be done once.
-                </p>
-            </div>
-        </div>
-    </div>
-
-    <script>
-
-        async function viewSecret(token) {
-            try {
-                // Make request to consume the secret
-                const response = await fetch(`/consume/${token}`, {
-                    method: 'POST'
-                });
-            
-                if (!response.ok) {
-                    throw new Error('Failed to consume secret');
-                }
-            
-                // Show the secret content
-                document.getElementById('viewButtonContainer').style.display = 'none';
-                document.getElementById('secretContainer').style.display = 'block';
-            } catch (err) {
-                console.error('Error:', err);
-                alert('Failed to view secret. It may have already been viewed.');
-            }
-        }
-        
-        async function copyToClipboard() {
-            const text = document.querySelector('.secret-content').textContent;
-            try {
-                await navigator.clipboard.writeText(text);
-                const btn = event.target;
-                btn.textContent = 'Copied!';
-                setTimeout(() => {
-                    btn.textContent = 'Copy Message';
-                }, 2000);
-            } catch (err) {
-                console.error('Failed to copy:', err);
-            }
-        }
-    </script>
-</body>
-</html>
-'''
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+
+@app.before_request
+def admit_request():
+    if admission_control is None:
+        return None
+    rejected = admission_control.admit(request)
+    if rejected is None:
+        g.admitted = True
+        return None
+    status, retry_after = rejected
+    error = 'Too many requests' if status == 429 else 'Server busy, please retry'
+    response = app.make_response((jsonify({'error': error}), status))
+    response.headers['Retry-After'] = str(retry_after)
+    response.headers['Cache-Control'] = 'no-store'
+    return response
+
+@app.teardown_request
+def observe_request_latency(error=None):
+    if g.pop('admitted', False):
+        admission_control.release(request)
+    started = g.pop('request_started', None)
+    if started is not None:
+        route = request.url_rule.rule if request.url_rule else 'unmatched'
+        REQUEST_SECONDS.observe(time.perf_counter() - started, route=route, method=request.method)
+    worker_started = cold_start.pop('worker_started', None)
+    if worker_started is not None:
+        now = time.time()
+        COLD_START_SECONDS.set(now - SERVER_STARTED_AT)
+        logging.info(
+            f'First request served {now - SERVER_STARTED_AT:.3f}s after server start '
+            f'({now - worker_started:.3f}s after worker start)'
+        )
+
+# Dynamic bodies are compressed per request above COMPRESS_MIN_BYTES; static
+# pages and assets carry precompressed variants instead (see compression.py)
+compressor = ResponseCompressor(int(os.environ.get('COMPRESS_MIN_BYTES', 1024)), stage_timer)
+
+@app.after_request
+def compress_response(response):
+    return compressor(request, response)
+
+@app.after_request
+def apply_cache_policy(response):
+    if request.endpoint in NO_STORE_ENDPOINTS:
+        response.headers['Cache-Control'] = 'no-store'
+        # ...and no validators: the error pages shown here carry them otherwise
+        response.headers.pop('ETag', None)
+        response.headers.pop('Last-Modified', None)
+    return response
+
+@app.route('/metrics')
+def metrics_endpoint():
+    expected = os.environ.get('METRICS_TOKEN')
+    if expected and request.headers.get('Authorization') != f'Bearer {expected}':
+        return pages.page('page_not_found').response()
+    response = app.response_class(metrics.render(), content_type=METRICS_CONTENT_TYPE)
+    response.headers['Cache-Control'] = 'no-store'
+    return response
 
 @app.route('/')
 def index():
-    return render_template_string(HTML_TEMPLATE)
+    return pages.page('index').response()
+
+@app.route('/static/<name>')
+def static_asset(name):
+    asset = assets.lookup(request.path)
+    if asset is None:
+        return pages.page('page_not_found').response()
+    encoding, body, etag = asset.select(request.headers.get('Accept-Encoding'))
+    if is_current(etag):
+        response = app.response_class(status=304)
+    else:
+        response = app.response_class(body, mimetype=asset.content_type)
+        if encoding:
+            response.headers['Content-Encoding'] = encoding
+    response.headers['Cache-Control'] = CACHE_CONTROL
+    response.headers['ETag'] = etag
+    response.headers['Vary'] = 'Accept-Encoding'
+    return response
+
+def validate_secret_input(data):
+    # Returns (secret, expire_seconds, error message or None)
+    if not isinstance(data, dict):
+        return None, None, 'Invalid request body'
+    secret = data.get('secret', '')
+    if not isinstance(secret, str):
+        return None, None, 'Secret must be a string'
+    secret = secret.strip()
+
+    # Check length
+    if len(secret) > MAX_SECRET_LENGTH:
+        return None, None, f'Secret must be less than {MAX_SECRET_LENGTH} characters'
+
+    if not secret:
+        return None, None, 'No secret provided'
+
+    expire_seconds = data.get('expire_seconds', 3600)
+    if isinstance(expire_seconds, bool) or not isinstance(expire_seconds, (int, float)):
+        return None, None, 'expire_seconds must be a number'
+
+    return secret, expire_seconds, None
+
+def build_record(secret, expire_seconds):
+    expires_at = (datetime.now() + timedelta(seconds=expire_seconds)).timestamp()
+    token = store.new_token(expires_at)
+    encrypted_secret, key_id, alg, compression = secure_encrypt(secret)
+    
+    secret_data = {
+        'secret': encrypted_secret,
+        'key_id': key_id,
+        'alg': alg,
+        'compression': compression,
+        'expires_at': expires_at
+    }
+    return token, secret_data
 
 @app.route('/create', methods=['POST'])
 def create_secret():
     try:
-        data = request.get_json()
-        secret = data.get('secret', '').strip()
-        
-        # Check length
-        if len(secret) > MAX_SECRET_LENGTH:
-            return jsonify({
-                'error': f'Secret must be less than {MAX_SECRET_LENGTH} characters'
-            }), 400
-            
-        if not secret:
-            return jsonify({'error': 'No secret provided'}), 400
-            
-        expire_seconds = data.get('expire_seconds', 3600)        
+        secret, expire_seconds, error = validate_secret_input(request.get_json())
+        if error:
+            return jsonify({'error': error}), 400
 
-        token = secrets.token_urlsafe(16)
-        encrypted_secret = secure_encrypt(secret)
-        
-        secret_data = {
-            'secret': encrypted_secret,
-            'expires_at': (datetime.now() + timedelta(seconds=expire_seconds)).timestamp()
-        }
-        
-        with open(os.path.join(SECRETS_DIR, f"{token}.json"), 'w') as f:
-            json.dump(secret_data, f)
+        token, secret_data = build_record(secret, expire_seconds)
+        store.put(token, secret_data)
+        reaper.track(token, secret_data['expires_at'])
         
-        logging.info(f'Secret created with token: {token}')
+        SECRETS_CREATED.inc()
+        logging.info(f'Secret created with token: {token}', extra={'event': 'secret_created'})
         return jsonify({'token': token})
 
     except Exception as e:
         logging.error(f'Error creating secret: {str(e)}')
         return jsonify({'error': 'Internal server error'}), 500
 
+@app.route('/create/batch', methods=['POST'])
+def create_secret_batch():
+    try:
+        data = request.get_json()
+        items = data.get('secrets') if isinstance(data, dict) else None
+        if not isinstance(items, list) or not items:
+            return jsonify({'error': 'Expected a non-empty "secrets" array'}), 400
+        if len(items) > MAX_BATCH_SIZE:
+            return jsonify({'error': f'At most {MAX_BATCH_SIZE} secrets per batch'}), 400
+
+        # Validate and encrypt everything first, then persist in one bulk write
+        results = []
+        pending = []
+        for item in items:
+            secret, expire_seconds, error = validate_secret_input(item)
+            if error:
+                results.append({'error': error})
+                continue
+            token, secret_data = build_record(secret, expire_seconds)
+            results.append({'token': token})
+            pending.append((len(results) - 1, token, secret_data))
+
+        try:
+            stored = store.put_many([(token, secret_data) for _, token, secret_data in pending])
+        except Exception as e:
+            # A backend that writes the batch as one unit (a SQLite transaction,
+            # a Redis pipeline) fails it as one; report that per item too
+            logging.error(f'Error storing secret batch: {str(e)}')
+            stored = [False] * len(pending)
+        for (index, token, secret_data), ok in zip(pending, stored):
+            if ok:
+                reaper.track(token, secret_data['expires_at'])
+            else:
+                results[index] = {'error': 'Failed to store secret'}
+
+        created = sum(1 for result in results if 'token' in result)
+        SECRETS_CREATED.inc(created)
+        logging.info(f'Batch created {created} of {len(items)} secret(s)', extra={'event': 'secret_created'})
+        return jsonify({'created': created, 'results': results})
+
+    except Exception as e:
+        logging.error(f'Error creating secret batch: {str(e)}')
+        return jsonify({'error': 'Internal server error'}), 500
+
+@app.route('/create/stream', methods=['POST'])
+def create_secret_stream():
+    # Raw request body, read and encrypted chunk by chunk; expiry in the query string
+    expire_seconds = request.args.get('expire_seconds', 3600, type=int)
+    too_large = jsonify({'error': f'Secret must be at most {streams.max_bytes} bytes'}), 413
+    if not streams_enabled:
+        return jsonify({'error': 'Streamed secrets are not available on this server'}), 501
+
+    try:
+        if request.content_length is not None and request.content_length > streams.max_bytes:
+            return too_large
+
+        expires_at = (datetime.now() + timedelta(seconds=expire_seconds)).timestamp()
+        token = streams.new_token()
+        size = streams.write(token, request.stream.read, keyring.active(), stream_crypto, expires_at)
+
+        SECRETS_CREATED.inc()
+        logging.info(f'Streamed secret created with token: {token} ({size} bytes)', extra={'event': 'secret_created'})
+        return jsonify({'token': token, 'size': size})
+
+    except StreamTooLarge:
+        return too_large
+    except ValueError:
+        return jsonify({'error': 'No secret provided'}), 400
+    except Exception as e:
+        logging.error(f'Error creating streamed secret: {str(e)}')
+        return jsonify({'error': 'Internal server error'}), 500
+
+@app.route('/download/<token>', methods=['POST'])
+def download_secret(token):
+    clean_token = unquote(token).strip()
+
+    try:
+        # Claimed and unlinked up front: a second download finds nothing
+        reader = streams.take(clean_token)
+        if reader is None:
+            SECRETS_NOT_FOUND.inc()
+            logging.info(f'Attempted to download non-existent secret: {token}', extra={'event': 'secret_not_found'})
+            return jsonify({'error': 'Secret not found or already viewed'}), 404
+        if is_expired({'expires_at': reader.header.expires_at}, datetime.now().timestamp()):
+            reader.close()
+            SECRETS_EXPIRED.inc()
+            logging.info(f'Expired secret downloaded: {token}', extra={'event': 'secret_expired'})
+            return jsonify({'error': 'This secret has expired'}), 410
+        key = keyring.get(reader.header.key_id)
+    except Exception as e:
+        logging.error(f'Error downloading secret: {str(e)}')
+        return jsonify({'error': 'Internal server error'}), 500
+
+    def generate():
+        try:
+            yield from reader.iter_plaintext(key)
+            SECRETS_VIEWED.inc()
+            logging.info(f'Streamed secret downloaded: {token}', extra={'event': 'secret_viewed'})
+        except Exception as e:
+            # Headers are already sent; cutting the connection short is all we can do
+            logging.error(f'Error streaming secret: {str(e)}')
+            raise
+
+    response = app.response_class(generate(), mimetype='application/octet-stream')
+    response.headers['Cache-Control'] = 'no-store'
+    response.headers['Content-Disposition'] = 'attachment; filename="secret.bin"'
+    return response
+
 @app.route('/view/<token>')
 def view_secret(token):
 
     clean_token = unquote(token).strip()
-    logging.info(f"Original token: {token}")
-    logging.info(f"Cleaned token: {clean_token}")
+    logging.debug(f"Original token: {token}")
+    logging.debug(f"Cleaned token: {clean_token}")
 
-    file_path = os.path.join(SECRETS_DIR, f"{clean_token}.json")
-    
     try:
-        # Read and delete the secret file
-        with open(file_path, 'r') as f:
-            data = json.load(f)        
+        if VIEW_MODE == 'claim':
+            # Nothing is read here, so link previews can't burn the secret;
+            # the button claims it with a single POST /claim/<token>
+            if not is_valid_token(clean_token):
+                raise FileNotFoundError(clean_token)
+            return render_page('view', token=clean_token, claim_mode=True)
+
+        data = store.get(clean_token)
+        if data is None:
+            raise FileNotFoundError(clean_token)
         
         # Check if expired
-        if datetime.now().timestamp() > data['expires_at']:
-
-            if os.path.exists(file_path):
-                os.remove(file_path)
-
-            logging.info(f'Expired secret accessed: {token}')
-            return render_template_string('''
-                <!DOCTYPE html>
-                <html lang="en">
-                <head>
-                    <meta charset="UTF-8">
-                    <meta name="viewport" content="width=device-width, initial-scale=1.0">
-                    <title>Secret Expired</title>
-                    <link href="https://fonts.googleapis.com/css2?family=Inter:wght@400;500;600&display=swap" rel="stylesheet">
-                    <style>
-                        body {
-                            font-family: 'Inter', sans-serif;
-                            background-color: #f8fafc;
-                            color: #1e293b;
-                            line-height: 1.5;
-                            padding: 1rem;
-                        }
-                        .container {
-                            max-width: 600px;
-                            margin: 2rem auto;
-                        }
-                        .card {
-                            background: white;
-                            border-radius: 12px;
-                            box-shadow: 0 4px 6px -1px rgb(0 0 0 / 0.1);
-                            padding: 2rem;
-                            text-align: center;
-                        }
-                        .error-message {
-                            color: #dc2626;
-                            font-size: 1.1rem;
-                            margin-bottom: 1rem;
-                        }
-                        .home-link {
-                            color: #2563eb;
-                            text-decoration: none;
-                        }
-                        .home-link:hover {
-                            text-decoration: underline;
-                        }
-                    </style>
-                </head>
-                <body>
-                    <div class="container">
-                        <div class="card">
-                            <div class="error-message">This secret has expired</div>
-                            <a href="/" class="home-link">Create a new secret</a>
-                        </div>
-                    </div>
-                </body>
-                </html>
-            '''), 404
+        if is_expired(data, datetime.now().timestamp()):
+
+            store.delete(clean_token)
+
+            SECRETS_EXPIRED.inc()
+            logging.info(f'Expired secret accessed: {token}', extra={'event': 'secret_expired'})
+            return pages.page('expired').response()
         
         # Decrypt secret
-        decrypted_secret = secure_decrypt(data['secret'])
-        logging.info(f'Secret viewed successfully: {token}')
-        return render_template_string(VIEW_TEMPLATE, secret=decrypted_secret, token=clean_token)
+        decrypted_secret = decrypt_record(data)
+        SECRETS_VIEWED.inc()
+        logging.info(f'Secret viewed successfully: {token}', extra={'event': 'secret_viewed'})
+        return render_page('view', secret=decrypted_secret, token=clean_token)
         
     except FileNotFoundError:
-        logging.info(f'Attempted to view non-existent secret: {token}')
-        return render_template_string('''
-            <!DOCTYPE html>
-            <html lang="en">
-            <head>
-                <meta charset="UTF-8">
-                <meta name="viewport" content="width=device-width, initial-scale=1.0">
-                <title>Secret Not Found</title>
-                <link href="https://fonts.googleapis.com/css2?family=Inter:wght@400;500;600&display=swap" rel="stylesheet">
-                <style>
-                    body {
-                        font-family: 'Inter', sans-serif;
-                        background-color: #f8fafc;
-                        color: #1e293b;
-                        line-height: 1.5;
-                        padding: 1rem;
-                    }
-                    .container {
-                        max-width: 600px;
-                        margin: 2rem auto;
-                    }
-                    .card {
-                        background: white;
-                        border-radius: 12px;
-                        box-shadow: 0 4px 6px -1px rgb(0 0 0 / 0.1);
-                        padding: 2rem;
-                        text-align: center;
-                    }
-                    .error-message {
-                        color: #dc2626;
-                        font-size: 1.1rem;
-                        margin-bottom: 1rem;
-                    }
-                    .home-link {
-                        color: #2563eb;
-                        text-decoration: none;
-                    }
-                    .home-link:hover {
-                        text-decoration: underline;
-                    }
-                </style>
-            </head>
-            <body>
-                <div class="container">
-                    <div class="card">
-                        <div class="error-message">Secret not found or already viewed</div>
-                        <a href="/" class="home-link">Create a new secret</a>
-                    </div>
-                </div>
-            </body>
-            </html>
-        '''), 404
+        SECRETS_NOT_FOUND.inc()
+        logging.info(f'Attempted to view non-existent secret: {token}', extra={'event': 'secret_not_found'})
+        return pages.page('secret_not_found').response()
         
     except Exception as e:
         logging.error(f'Error viewing secret: {str(e)}')
-        return render_template_string('''
-            <!DOCTYPE html>
-            <html lang="en">
-            <head>
-                <meta charset="UTF-8">
-                <meta name="viewport" content="width=device-width, initial-scale=1.0">
-                <title>Error</title>
-                <link href="https://fonts.googleapis.com/css2?family=Inter:wght@400;500;600&display=swap" rel="stylesheet">
-                <style>
-                    body {
-                        font-family: 'Inter', sans-serif;
-                        background-color: #f8fafc;
-                        color: #1e293b;
-                        line-height: 1.5;
-                        padding: 1rem;
-                    }
-                    .container {
-                        max-width: 600px;
-                        margin: 2rem auto;
-                    }
-                    .card {
-                        background: white;
-                        border-radius: 12px;
-                        box-shadow: 0 4px 6px -1px rgb(0 0 0 / 0.1);
-                        padding: 2rem;
-                        text-align: center;
-                    }
-                    .error-message {
-                        color: #dc2626;
-                        font-size: 1.1rem;
-                        margin-bottom: 1rem;
-                    }
-                    .home-link {
-                        color: #2563eb;
-                        text-decoration: none;
-                    }
-                    .home-link:hover {
-                        text-decoration: underline;
-                    }
-                </style>
-            </head>
-            <body>
-                <div class="container">
-                    <div class="card">
-                        <div class="error-message">An error occurred</div>
-                        <a href="/" class="home-link">Try creating a new secret</a>
-                    </div>
-                </div>
-            </body>
-            </html>
-        '''), 500
+        return pages.page('view_error').response()
+
+@app.route('/claim/<token>', methods=['POST'])
+def claim_secret(token):
+    clean_token = unquote(token).strip()
+
+    try:
+        # take() hands the record to exactly one caller and removes it
+        data = store.take(clean_token)
+        if data is None:
+            SECRETS_NOT_FOUND.inc()
+            logging.info(f'Attempted to claim non-existent secret: {token}', extra={'event': 'secret_not_found'})
+            response = jsonify({'error': 'Secret not found or already viewed'}), 404
+        elif is_expired(data, datetime.now().timestamp()):
+            SECRETS_EXPIRED.inc()
+            logging.info(f'Expired secret claimed: {token}', extra={'event': 'secret_expired'})
+            response = jsonify({'error': 'This secret has expired'}), 410
+        else:
+            response = jsonify({'secret': decrypt_record(data)})
+            SECRETS_VIEWED.inc()
+            logging.info(f'Secret claimed successfully: {token}', extra={'event': 'secret_viewed'})
+    except Exception as e:
+        logging.error(f'Error claiming secret: {str(e)}')
+        response = jsonify({'error': 'Internal server error'}), 500
+
+    response = app.make_response(response)
+    response.headers['Cache-Control'] = 'no-store'
+    return response
 
 @app.route('/consume/<token>', methods=['POST'])
 def consume_secret(token):
     clean_token = unquote(token).strip()
-    file_path = os.path.join(SECRETS_DIR, f"{clean_token}.json")
     
     try:
-        if os.path.exists(file_path):
-            os.remove(file_path)
+        if store.delete(clean_token):
             return jsonify({'success': True})
         return jsonify({'success': False, 'error': 'Secret not found'})
     except Exception as e:
@@ -807,115 +561,17 @@ def consume_secret(token):
 # Error handling for production
 @app.errorhandler(404)
 def not_found_error(error):
-    return render_template_string('''
-        <!DOCTYPE html>
-        <html lang="en">
-        <head>
-            <meta charset="UTF-8">
-            <meta name="viewport" content="width=device-width, initial-scale=1.0">
-            <title>Page Not Found</title>
-            <link href="https://fonts.googleapis.com/css2?family=Inter:wght@400;500;600&display=swap" rel="stylesheet">
-            <style>
-                body {
-                    font-family: 'Inter', sans-serif;
-                    background-color: #f8fafc;
-                    color: #1e293b;
-                    line-height: 1.5;
-                    padding: 1rem;
-                }
-                .container {
-                    max-width: 600px;
-                    margin: 2rem auto;
-                }
-                .card {
-                    background: white;
-                    border-radius: 12px;
-                    box-shadow: 0 4px 6px -1px rgb(0 0 0 / 0.1);
-                    padding: 2rem;
-                    text-align: center;
-                }
-                .error-message {
-                    color: #dc2626;
-                    font-size: 1.1rem;
-                    margin-bottom: 1rem;
-                }
-                .home-link {
-                    color: #2563eb;
-                    text-decoration: none;
-                }
-                .home-link:hover {
-                    text-decoration: underline;
-                }
-            </style>
-        </head>
-        <body>
-            <div class="container">
-                <div class="card">
-                    <div class="error-message">Page not found</div>
-                    <a href="/" class="home-link">Go to homepage</a>
-                </div>
-            </div>
-        </body>
-        </html>
-    '''), 404
+    return pages.page('page_not_found').response()
 
 @app.errorhandler(500)
 def internal_error(error):
-    return render_template_string('''
-        <!DOCTYPE html>
-        <html lang="en">
-        <head>
-            <meta charset="UTF-8">
-            <meta name="viewport" content="width=device-width, initial-scale=1.0">
-            <title>Server Error</title>
-            <link href="https://fonts.googleapis.com/css2?family=Inter:wght@400;500;600&display=swap" rel="stylesheet">
-            <style>
-                body {
-                    font-family: 'Inter', sans-serif;
-                    background-color: #f8fafc;
-                    color: #1e293b;
-                    line-height: 1.5;
-                    padding: 1rem;
-                }
-                .container {
-                    max-width: 600px;
-                    margin: 2rem auto;
-                }
-                .card {
-                    background: white;
-                    border-radius: 12px;
-                    box-shadow: 0 4px 6px -1px rgb(0 0 0 / 0.1);
-                    padding: 2rem;
-                    text-align: center;
-                }
-                .error-message {
-                    color: #dc2626;
-                    font-size: 1.1rem;
-                    margin-bottom: 1rem;
-                }
-                .home-link {
-                    color: #2563eb;
-                    text-decoration: none;
-                }
-                .home-link:hover {
-                    text-decoration: underline;
-                }
-            </style>
-        </head>
-        <body>
-            <div class="container">
-                <div class="card">
-                    <div class="error-message">An unexpected error occurred</div>
-                    <a href="/" class="home-link">Go to homepage</a>
-                </div>
-            </div>
-        </body>
-        </html>
-    '''), 500
+    return pages.page('server_error').response()
 
 # Production configuration
 if __name__ == '__main__':
     # For development
+    install_reload_handler(keyring)
+    install_reopen_handler(log_pipeline)
     port = int(os.environ.get('PORT', 5000))
     app.run(host='0.0.0.0', port=port)
 else:
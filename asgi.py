@@ -0,0 +1,258 @@
+"""ASGI serving mode: the same Flask routes behind an async server.
+
+    pip install uvicorn
+    gunicorn -c gunicorn_config.py -k uvicorn.workers.UvicornWorker asgi:app
+    python asgi.py                          # development, on $PORT
+
+Under the threaded gunicorn worker every connection owns a thread for its
+whole life, so a few clients trickling a request body in (or reading a
+response slowly) can occupy all of them. Here the event loop does all
+socket I/O: the request body is received asynchronously into memory, and
+only once it is complete is the request handed to a bounded pool of
+ASGI_THREADS threads, which runs the view, including its storage I/O and
+crypto. Bodies larger than ASGI_BUFFER_BYTES (streamed secrets) are not
+buffered, nor spilled to disk in plaintext: the view starts as soon as the
+buffer fills and reads the rest straight from the connection, so only
+those uploads hold a thread while the client sends.
+Response bodies are pulled from the view in batches on that pool and
+written back asynchronously, so a slow reader holds no thread while it
+drains. Thousands of idle or slow connections then cost a coroutine each,
+not a thread.
+"""
+import asyncio
+import logging
+import os
+import io
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+# Views run on this many threads per worker. Exported before app.py is
+# imported, overriding gunicorn_config.py's gthread count, so admission.py
+# sizes its per-route caps from the pool that actually runs the views
+THREADS = int(os.environ.get('ASGI_THREADS', 16))
+os.environ['SERVER_THREADS'] = str(THREADS)
+
+from app import app as flask_app, streams  # noqa: E402
+
+BUFFER_BYTES = int(os.environ.get('ASGI_BUFFER_BYTES', 1024 * 1024))
+# Largest accepted body: a maximal stream plus room for multipart/JSON framing
+MAX_BODY_BYTES = int(os.environ.get('ASGI_MAX_BODY_BYTES', streams.max_bytes + 64 * 1024))
+# Response bytes gathered per trip to the pool before they are sent
+RESPONSE_BATCH_BYTES = 64 * 1024
+
+
+class BodyTooLarge(Exception):
+    pass
+
+
+class ClientDisconnected(OSError):
+    pass
+
+
+class BridgedInput(io.RawIOBase):
+    # wsgi.input for a body that outgrew the buffer: what was buffered, then
+    # the remaining ASGI messages, fetched from the event loop on demand
+    def __init__(self, buffered, receive, loop, size):
+        self.pending = buffered
+        self.receive = receive
+        self.loop = loop
+        self.size = size
+        self.done = False
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        while not self.pending and not self.done:
+            message = asyncio.run_coroutine_threadsafe(self.receive(), self.loop).result()
+            if message['type'] == 'http.disconnect':
+                raise ClientDisconnected()
+            self.pending = message.get('body', b'')
+            self.size += len(self.pending)
+            if self.size > MAX_BODY_BYTES:
+                raise BodyTooLarge()
+            self.done = not message.get('more_body', False)
+        n = min(len(buffer), len(self.pending))
+        buffer[:n] = self.pending[:n]
+        self.pending = self.pending[n:]
+        return n
+
+
+def build_environ(scope, body, length=None):
+    server = scope.get('server') or ('localhost', 80)
+    client = scope.get('client') or ('', 0)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', '').encode().decode('latin-1'),
+        # WSGI carries the decoded path as latin-1-decoded bytes
+        'PATH_INFO': scope['path'].encode().decode('latin-1'),
+        'QUERY_STRING': scope.get('query_string', b'').decode('latin-1'),
+        'SERVER_NAME': server[0],
+        'SERVER_PORT': str(server[1]),
+        'SERVER_PROTOCOL': f'HTTP/{scope.get("http_version", "1.1")}',
+        'REMOTE_ADDR': client[0],
+        'REMOTE_PORT': str(client[1]),
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': body,
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False,
+    }
+    for name, value in scope['headers']:
+        name = name.decode('latin-1').upper().replace('-', '_')
+        value = value.decode('latin-1')
+        if name in ('CONTENT_TYPE', 'CONTENT_LENGTH'):
+            environ[name] = value
+        else:
+            key = f'HTTP_{name}'
+            environ[key] = f'{environ[key]},{value}' if key in environ else value
+    if length is not None:
+        # Fully buffered, so the length is known even if it was sent chunked
+        environ['CONTENT_LENGTH'] = str(length)
+    else:
+        environ['wsgi.input_terminated'] = True
+    return environ
+
+
+class AsgiApp:
+    def __init__(self, wsgi_app, threads=None):
+        self.wsgi_app = wsgi_app
+        self.executor = ThreadPoolExecutor(
+            max_workers=threads or THREADS, thread_name_prefix='asgi')
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'http':
+            await self.http(scope, receive, send)
+        elif scope['type'] == 'lifespan':
+            await self.lifespan(receive, send)
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                self.executor.shutdown(wait=False)
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    async def read_body(self, scope, receive):
+        # (wsgi.input, length); length is None when the body is not complete
+        declared = dict(scope['headers']).get(b'content-length')
+        if declared is not None and declared.isdigit() and int(declared) > MAX_BODY_BYTES:
+            raise BodyTooLarge()
+        chunks = []
+        size = 0
+        while True:
+            message = await receive()
+            if message['type'] == 'http.disconnect':
+                raise ClientDisconnected()
+            chunk = message.get('body', b'')
+            chunks.append(chunk)
+            size += len(chunk)
+            if not message.get('more_body', False):
+                return io.BytesIO(b''.join(chunks)), size
+            if size > BUFFER_BYTES:
+                bridged = BridgedInput(b''.join(chunks), receive, asyncio.get_running_loop(), size)
+                return io.BufferedReader(bridged), None
+
+    async def http(self, scope, receive, send):
+        try:
+            body, length = await self.read_body(scope, receive)
+        except ClientDisconnected:
+            return
+        except BodyTooLarge:
+            await send({'type': 'http.response.start', 'status': 413,
+                        'headers': [(b'content-type', b'text/plain'), (b'connection', b'close')]})
+            await send({'type': 'http.response.body', 'body': b'Request body too large'})
+            return
+
+        loop = asyncio.get_running_loop()
+        try:
+            status, headers, chunks, iterator = await loop.run_in_executor(
+                self.executor, self.start, build_environ(scope, body, length))
+        except Exception:
+            body.close()
+            logging.exception('Unhandled error in ASGI request')
+            await send({'type': 'http.response.start', 'status': 500, 'headers': []})
+            await send({'type': 'http.response.body', 'body': b''})
+            return
+
+        try:
+            await send({'type': 'http.response.start', 'status': status, 'headers': headers})
+            while True:
+                if chunks:
+                    await send({'type': 'http.response.body', 'body': b''.join(chunks), 'more_body': True})
+                if iterator is None:
+                    break
+                chunks, iterator = await loop.run_in_executor(self.executor, self.pull, iterator)
+            await send({'type': 'http.response.body', 'body': b''})
+        finally:
+            await loop.run_in_executor(self.executor, self.finish, iterator, body)
+
+    def start(self, environ):
+        # Runs on the pool: call the WSGI app and collect the first batch
+        response = {}
+
+        def start_response(status, headers, exc_info=None):
+            response['status'] = int(status.split(' ', 1)[0])
+            response['headers'] = [(k.lower().encode('latin-1'), v.encode('latin-1')) for k, v in headers]
+
+        result = self.wsgi_app(environ, start_response)
+        iterator = _Response(result)
+        chunks, iterator = self.pull(iterator)
+        return response['status'], response['headers'], chunks, iterator
+
+    @staticmethod
+    def pull(iterator):
+        # Runs on the pool: (chunks, iterator or None once exhausted)
+        chunks = []
+        size = 0
+        for chunk in iterator:
+            if chunk:
+                chunks.append(chunk)
+                size += len(chunk)
+            if size >= RESPONSE_BATCH_BYTES:
+                return chunks, iterator
+        iterator.close()
+        return chunks, None
+
+    @staticmethod
+    def finish(iterator, body):
+        if iterator is not None:
+            iterator.close()
+        body.close()
+
+
+class _Response:
+    # The WSGI result as an iterator that can be resumed across pool calls
+    def __init__(self, result):
+        self.result = result
+        self.iterator = iter(result)
+        self.closed = False
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        return next(self.iterator)
+
+    def close(self):
+        if not self.closed and hasattr(self.result, 'close'):
+            self.result.close()
+        self.closed = True
+
+
+app = AsgiApp(flask_app)
+
+
+if __name__ == '__main__':
+    import uvicorn
+    from app import keyring, log_pipeline
+    from keystore import install_reload_handler
+    from log_pipeline import install_reopen_handler
+    install_reload_handler(keyring)
+    install_reopen_handler(log_pipeline)
+    uvicorn.run(app, host='0.0.0.0', port=int(os.environ.get('PORT', 5000)))
@@ -0,0 +1,58 @@
+"""Fingerprinted static assets with precompressed variants.
+
+The shared stylesheet and scripts live in ``static/``. At startup each file is
+read once, fingerprinted with a hash of its contents and compressed with gzip
+(and brotli when the ``brotli`` package is installed; see compression.py).
+Pages link to ``/static/<name>.<hash><ext>``, so a deploy that changes a file
+changes its URL and the responses can be cached by browsers forever.
+"""
+import os
+from hashlib import sha256
+
+from compression import negotiate_encoding, precompress, variant_etags
+
+STATIC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static')
+CACHE_CONTROL = 'public, max-age=31536000, immutable'
+
+CONTENT_TYPES = {
+    '.css': 'text/css; charset=utf-8',
+    '.js': 'text/javascript; charset=utf-8',
+}
+
+
+class Asset:
+    __slots__ = ('name', 'url', 'content_type', 'variants', 'etags')
+
+    def __init__(self, name, data):
+        stem, ext = os.path.splitext(name)
+        digest = sha256(data).hexdigest()
+        self.name = name
+        self.url = f'/static/{stem}.{digest[:12]}{ext}'
+        self.content_type = CONTENT_TYPES.get(ext, 'application/octet-stream')
+        # encoding (None for identity) -> body, and -> strong ETag
+        self.variants = precompress(data)
+        self.etags = variant_etags(digest[:32], self.variants)
+
+    def select(self, accept_encoding):
+        """(encoding or None, body, ETag) for the client's Accept-Encoding."""
+        encoding = negotiate_encoding(accept_encoding, self.variants)
+        return encoding, self.variants[encoding], self.etags[encoding]
+
+
+class AssetRegistry:
+    def __init__(self, static_dir=STATIC_DIR):
+        self._by_name = {}
+        self._by_url = {}
+        for name in sorted(os.listdir(static_dir)):
+            if os.path.splitext(name)[1] not in CONTENT_TYPES:
+                continue
+            with open(os.path.join(static_dir, name), 'rb') as f:
+                asset = Asset(name, f.read())
+            self._by_name[name] = asset
+            self._by_url[asset.url] = asset
+
+    def url(self, name):
+        return self._by_name[name].url
+
+    def lookup(self, path):
+        return self._by_url.get(path)
@@ -0,0 +1,88 @@
+"""Encrypt/decrypt throughput of each crypto engine across payload sizes.
+
+    python benchmarks/crypto_throughput.py [--sizes 64,5000,1048576] [--json]
+
+The ``xor-per-byte`` row is the original generator-based implementation, kept
+here only as the reference point the engines are compared against.
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from hashlib import sha256
+from secrets import token_bytes
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from crypto_engine import ENGINES  # noqa: E402
+from keystore import Key  # noqa: E402
+
+DEFAULT_SIZES = [16, 256, 5000, 64 * 1024, 1024 * 1024]
+
+
+def xor_per_byte(key, data):
+    key_bytes = sha256(key.material).digest()
+    key_bytes = (key_bytes * (len(data) // len(key_bytes) + 1))[:len(data)]
+    return bytes(a ^ b for a, b in zip(data, key_bytes))
+
+
+def measure(fn, min_time):
+    # Repeat until at least min_time has elapsed so tiny payloads are measurable
+    iterations = 0
+    start = time.perf_counter()
+    while True:
+        fn()
+        iterations += 1
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_time:
+            return elapsed / iterations
+
+
+def run(sizes, min_time):
+    key = Key(1, token_bytes(32))
+    results = []
+    for size in sizes:
+        payload = token_bytes(size)
+        cases = {'xor-per-byte': (lambda: xor_per_byte(key, payload), None)}
+        for name, engine in ENGINES.items():
+            blob = engine.encrypt(key, payload)
+            assert engine.decrypt(key, blob) == payload
+            cases[name] = (
+                lambda engine=engine: engine.encrypt(key, payload),
+                lambda engine=engine, blob=blob: engine.decrypt(key, blob),
+            )
+        for name, (encrypt, decrypt) in cases.items():
+            row = {'engine': name, 'size': size}
+            row['encrypt_us'] = measure(encrypt, min_time) * 1e6
+            row['encrypt_mb_s'] = size / (row['encrypt_us'] / 1e6) / 1e6
+            if decrypt is not None:
+                row['decrypt_us'] = measure(decrypt, min_time) * 1e6
+                row['decrypt_mb_s'] = size / (row['decrypt_us'] / 1e6) / 1e6
+            results.append(row)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', default=','.join(map(str, DEFAULT_SIZES)),
+                        help='comma-separated payload sizes in bytes')
+    parser.add_argument('--min-time', type=float, default=0.2,
+                        help='seconds to spend on each measurement')
+    parser.add_argument('--json', action='store_true', help='print results as JSON')
+    args = parser.parse_args()
+
+    results = run([int(s) for s in args.sizes.split(',')], args.min_time)
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    print(f'{"engine":<20}{"size":>10}{"enc us":>12}{"enc MB/s":>12}{"dec us":>12}{"dec MB/s":>12}')
+    for row in results:
+        dec_us = f'{row["decrypt_us"]:.1f}' if 'decrypt_us' in row else '-'
+        dec_mb = f'{row["decrypt_mb_s"]:.1f}' if 'decrypt_mb_s' in row else '-'
+        print(f'{row["engine"]:<20}{row["size"]:>10}{row["encrypt_us"]:>12.1f}'
+              f'{row["encrypt_mb_s"]:>12.1f}{dec_us:>12}{dec_mb:>12}')
+
+
+if __name__ == '__main__':
+    main()
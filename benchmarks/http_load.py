@@ -0,0 +1,293 @@
+"""End-to-end HTTP load test of the app running under gunicorn.
+
+    python benchmarks/http_load.py [--concurrency 1,8,32] [--payload-sizes 64,4096]
+                                   [--duration 10] [--mix create=4,view=3,consume=2,notfound=1]
+                                   [--json] [--save results.json] [--baseline results.json]
+
+Starts gunicorn with gunicorn_config.py in a throwaway directory (or targets
+--url instead) and, for every concurrency x payload size combination, drives
+the given mix of requests for --duration seconds. ``view`` follows the
+browser flow: GET /view/<token>, then POST /claim/<token> when the page is
+in claim mode. ``notfound`` runs the same flow for a random token, where
+the 404 comes from /claim in claim mode and from /view otherwise.
+
+Reports throughput and p50/p95/p99 latency per operation. With --baseline,
+each run is compared against the matching run in a file written by --save,
+and the script exits non-zero if throughput dropped or p95/p99 latency grew
+by more than --threshold percent.
+"""
+import argparse
+import http.client
+import json
+import os
+import random
+import secrets
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from urllib.parse import urlsplit
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+OPERATIONS = ('create', 'view', 'claim', 'consume', 'notfound')
+PERCENTILES = (50, 95, 99)
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+class Server:
+    def __init__(self, workers=None, threads=None, env=None):
+        self.workers = workers
+        self.threads = threads
+        self.env = env or {}
+        self.port = _free_port()
+        self.url = f'http://127.0.0.1:{self.port}'
+        self._tmp = None
+        self._proc = None
+
+    def __enter__(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        cmd = [sys.executable, '-m', 'gunicorn', '-c', os.path.join(ROOT, 'gunicorn_config.py'),
+               '--chdir', self._tmp.name, '--pythonpath', ROOT,
+               '--bind', f'127.0.0.1:{self.port}', '--log-level', 'warning']
+        if self.workers:
+            cmd += ['--workers', str(self.workers)]
+        if self.threads:
+            cmd += ['--threads', str(self.threads)]
+        cmd.append('app:app')
+        self._proc = subprocess.Popen(cmd, cwd=self._tmp.name, env={**os.environ, **self.env})
+        deadline = time.monotonic() + 30
+        while time.monotonic() < deadline:
+            if self._proc.poll() is not None:
+                raise RuntimeError(f'gunicorn exited with status {self._proc.returncode}')
+            try:
+                with socket.create_connection(('127.0.0.1', self.port), timeout=0.5):
+                    return self
+            except OSError:
+                time.sleep(0.1)
+        self.__exit__()
+        raise RuntimeError('gunicorn did not start within 30s')
+
+    def __exit__(self, *exc):
+        if self._proc is not None and self._proc.poll() is None:
+            self._proc.send_signal(signal.SIGTERM)
+            try:
+                self._proc.wait(timeout=30)
+            except subprocess.TimeoutExpired:
+                self._proc.kill()
+        self._tmp.cleanup()
+
+
+def parse_mix(spec):
+    mix = {}
+    for part in spec.split(','):
+        name, _, weight = part.partition('=')
+        if name not in ('create', 'view', 'consume', 'notfound'):
+            raise argparse.ArgumentTypeError(f'unknown operation in mix: {name!r}')
+        mix[name] = float(weight or 1)
+    return mix
+
+
+class Worker(threading.Thread):
+    def __init__(self, url, mix, payload, tokens, deadline):
+        super().__init__(daemon=True)
+        parts = urlsplit(url)
+        self.host, self.port = parts.hostname, parts.port or 80
+        self.ops = list(mix)
+        self.weights = [mix[op] for op in self.ops]
+        self.body = json.dumps({'secret': payload, 'expire_seconds': 3600})
+        self.tokens = tokens
+        self.deadline = deadline
+        self.latencies = {op: [] for op in OPERATIONS}
+        self.errors = {op: 0 for op in OPERATIONS}
+        self._conn = None
+
+    def _request(self, op, method, path, body=None, expect=(200,)):
+        # One keep-alive connection per thread, reopened after any failure
+        if self._conn is None:
+            self._conn = http.client.HTTPConnection(self.host, self.port, timeout=30)
+        headers = {'Content-Type': 'application/json'} if body is not None else {}
+        start = time.perf_counter()
+        try:
+            self._conn.request(method, path, body=body, headers=headers)
+            response = self._conn.getresponse()
+            data = response.read()
+        except (OSError, http.client.HTTPException):
+            self._conn.close()
+            self._conn = None
+            self.errors[op] += 1
+            return None
+        self.latencies[op].append(time.perf_counter() - start)
+        if response.status not in expect:
+            self.errors[op] += 1
+            return None
+        return data
+
+    def _take_token(self):
+        try:
+            return self.tokens.pop()
+        except IndexError:
+            return None
+
+    def run(self):
+        while time.monotonic() < self.deadline:
+            op = random.choices(self.ops, self.weights)[0]
+            token = None
+            if op in ('view', 'consume'):
+                token = self._take_token()
+                if token is None:
+                    op = 'create'
+            if op == 'create':
+                data = self._request('create', 'POST', '/create', self.body)
+                if data is not None:
+                    self.tokens.append(json.loads(data)['token'])
+            elif op == 'view':
+                page = self._request('view', 'GET', f'/view/{token}')
+                if page is not None and b'data-claim-mode="true"' in page:
+                    self._request('claim', 'POST', f'/claim/{token}')
+            elif op == 'consume':
+                self._request('consume', 'POST', f'/consume/{token}')
+            else:
+                token = secrets.token_urlsafe(16)
+                page = self._request('notfound', 'GET', f'/view/{token}', expect=(200, 404))
+                if page is not None and b'data-claim-mode="true"' in page:
+                    self._request('notfound', 'POST', f'/claim/{token}', expect=(404,))
+        if self._conn is not None:
+            self._conn.close()
+
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, max(0, round(pct / 100 * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+def summarize(latencies, errors, elapsed):
+    values = sorted(latencies)
+    row = {'requests': len(values), 'errors': errors, 'throughput': len(values) / elapsed}
+    for pct in PERCENTILES:
+        value = percentile(values, pct)
+        row[f'p{pct}_ms'] = value * 1000 if value is not None else None
+    return row
+
+
+def drive(url, mix, concurrency, payload, tokens, duration):
+    deadline = time.monotonic() + duration
+    workers = [Worker(url, mix, payload, tokens, deadline) for _ in range(concurrency)]
+    start = time.perf_counter()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    return workers, time.perf_counter() - start
+
+
+def run(url, mix, concurrency, payload_size, duration, warmup):
+    payload = 'x' * payload_size
+    tokens = []  # list.append/pop are atomic, so threads can share it
+    if warmup:
+        drive(url, mix, concurrency, payload, tokens, warmup)
+    workers, elapsed = drive(url, mix, concurrency, payload, tokens, duration)
+    result = {'concurrency': concurrency, 'payload_size': payload_size, 'duration': elapsed, 'ops': {}}
+    everything = []
+    for op in OPERATIONS:
+        latencies = [value for worker in workers for value in worker.latencies[op]]
+        errors = sum(worker.errors[op] for worker in workers)
+        if latencies or errors:
+            result['ops'][op] = summarize(latencies, errors, elapsed)
+        everything.extend(latencies)
+    result['total'] = summarize(everything, sum(r['errors'] for r in result['ops'].values()), elapsed)
+    return result
+
+
+def compare(results, baseline, threshold):
+    # Returns a list of human-readable regressions, empty if none
+    previous = {(r['concurrency'], r['payload_size']): r for r in baseline['runs']}
+    regressions = []
+    for row in results['runs']:
+        old = previous.get((row['concurrency'], row['payload_size']))
+        if old is None:
+            continue
+        label = f'c={row["concurrency"]} size={row["payload_size"]}'
+        for op, current in [('total', row['total'])] + sorted(row['ops'].items()):
+            before = old['total'] if op == 'total' else old['ops'].get(op)
+            if not before:
+                continue
+            if before['throughput'] and current['throughput'] < before['throughput'] * (1 - threshold / 100):
+                regressions.append(f'{label} {op}: throughput {before["throughput"]:.0f} -> {current["throughput"]:.0f} req/s')
+            for pct in PERCENTILES[1:]:
+                key = f'p{pct}_ms'
+                if before.get(key) and current.get(key) and current[key] > before[key] * (1 + threshold / 100):
+                    regressions.append(f'{label} {op}: {key} {before[key]:.2f} -> {current[key]:.2f}')
+    return regressions
+
+
+def print_table(results):
+    print(f'{"conc":>5}{"size":>7}  {"op":<9}{"req/s":>9}{"p50 ms":>9}{"p95 ms":>9}{"p99 ms":>9}{"errors":>8}')
+    for row in results['runs']:
+        for op, stats in list(row['ops'].items()) + [('total', row['total'])]:
+            p = [f'{stats[f"p{pct}_ms"]:>9.2f}' if stats[f'p{pct}_ms'] is not None else f'{"-":>9}'
+                 for pct in PERCENTILES]
+            print(f'{row["concurrency"]:>5}{row["payload_size"]:>7}  {op:<9}{stats["throughput"]:>9.0f}'
+                  f'{"".join(p)}{stats["errors"]:>8}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--url', help='benchmark a running server instead of starting gunicorn')
+    parser.add_argument('--workers', type=int, help='override gunicorn workers')
+    parser.add_argument('--threads', type=int, help='override gunicorn threads')
+    parser.add_argument('--concurrency', default='1,8,32')
+    parser.add_argument('--payload-sizes', default='64,4096')
+    parser.add_argument('--duration', type=float, default=10.0, help='seconds per run')
+    parser.add_argument('--warmup', type=float, default=2.0, help='unrecorded seconds before each run')
+    parser.add_argument('--mix', type=parse_mix, default=parse_mix('create=4,view=3,consume=2,notfound=1'))
+    parser.add_argument('--json', action='store_true', help='print results as JSON')
+    parser.add_argument('--save', help='write results as JSON to this file')
+    parser.add_argument('--baseline', help='compare against results saved with --save')
+    parser.add_argument('--threshold', type=float, default=10.0, help='allowed regression in percent')
+    args = parser.parse_args()
+
+    concurrencies = [int(c) for c in args.concurrency.split(',')]
+    payload_sizes = [int(s) for s in args.payload_sizes.split(',')]
+
+    def run_all(url):
+        return [run(url, args.mix, c, size, args.duration, args.warmup)
+                for c in concurrencies for size in payload_sizes]
+
+    if args.url:
+        runs = run_all(args.url.rstrip('/'))
+    else:
+        # The reaper would only add background noise to a short benchmark, and
+        # admission control would rate-limit a single load-generating client
+        with Server(args.workers, args.threads, env={'REAPER_ENABLED': '0', 'ADMISSION_ENABLED': '0'}) as server:
+            runs = run_all(server.url)
+    results = {'mix': args.mix, 'runs': runs}
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(results, f, indent=2)
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        print_table(results)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.threshold)
+        for line in regressions:
+            print(f'REGRESSION {line}', file=sys.stderr)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,195 @@
+"""Micro-benchmarks of the request hot paths, with regression checks.
+
+    python benchmarks/micro.py [--sizes 8,256,5000,20000,262144] [--backends file,sqlite]
+                               [--compare REF] [--threshold 20] [--json]
+
+Times ``secure_encrypt``, ``secure_decrypt``, ``get_encryption_key`` and the
+storage put/get/delete paths of each backend, and measures their peak
+traced memory and the number of allocations they leave behind (tracemalloc).
+Everything runs offline against a throwaway directory.
+
+Results are written to benchmarks/results/<commit>.json (``-dirty`` is
+appended when the tree has uncommitted changes). --compare REF loads the
+results of another commit (or a path to a results file) and exits non-zero
+if any benchmark got slower by more than --threshold percent, or its peak
+memory grew by more than --memory-threshold percent.
+"""
+import argparse
+import gc
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULTS_DIR = os.path.join(ROOT, 'benchmarks', 'results')
+sys.path.insert(0, ROOT)
+
+DEFAULT_SIZES = [8, 256, 5000, 20000, 256 * 1024]
+
+
+def commit_id():
+    try:
+        rev = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT,
+                             capture_output=True, text=True, check=True).stdout.strip()
+        dirty = subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'], cwd=ROOT,
+                               capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+    return f'{rev}-dirty' if dirty else rev
+
+
+def measure(fn, min_time, setup=None):
+    # Median of several batches; each batch runs until min_time / 5 elapsed
+    batches = []
+    for _ in range(5):
+        iterations = 0
+        elapsed = 0.0
+        while elapsed < min_time / 5:
+            arg = setup() if setup is not None else None
+            start = time.perf_counter()
+            fn(arg)
+            elapsed += time.perf_counter() - start
+            iterations += 1
+        batches.append(elapsed / iterations)
+    return sorted(batches)[len(batches) // 2]
+
+
+def memory(fn, setup=None):
+    arg = setup() if setup is not None else None
+    fn(arg)  # warm caches so one-off allocations are not counted
+    arg = setup() if setup is not None else None
+    gc.collect()
+    tracemalloc.start()
+    try:
+        before = tracemalloc.take_snapshot()
+        base, _ = tracemalloc.get_traced_memory()
+        tracemalloc.reset_peak()
+        fn(arg)
+        _, peak = tracemalloc.get_traced_memory()
+        after = tracemalloc.take_snapshot()
+    finally:
+        tracemalloc.stop()
+    retained = sum(stat.count_diff for stat in after.compare_to(before, 'filename') if stat.count_diff > 0)
+    return peak - base, retained
+
+
+def benchmarks(app, backends, sizes, tmp):
+    # name -> (fn(arg), setup() or None)
+    from storage import open_store
+    cases = {'get_encryption_key': (lambda _: app.get_encryption_key(), None)}
+    for size in sizes:
+        text = 'x' * size
+        encrypted, key_id, alg, compression = app.secure_encrypt(text)
+        cases[f'secure_encrypt[{size}]'] = (lambda _, text=text: app.secure_encrypt(text), None)
+        cases[f'secure_decrypt[{size}]'] = (
+            lambda _, e=encrypted, k=key_id, a=alg, c=compression: app.secure_decrypt(e, k, a, c), None)
+    for backend in backends:
+        os.environ['SQLITE_PATH'] = os.path.join(tmp, f'{backend}.db')
+        store = open_store(os.path.join(tmp, backend), backend)
+        for size in sizes:
+            _, record = app.build_record('x' * size, 3600)
+
+            def fresh(store=store, record=record):
+                return store.new_token(record['expires_at'])
+
+            def stored(store=store, record=record):
+                token = store.new_token(record['expires_at'])
+                store.put(token, record)
+                return token
+
+            cases[f'{backend}.put[{size}]'] = (lambda t, s=store, r=record: s.put(t, r), fresh)
+            cases[f'{backend}.get[{size}]'] = (lambda t, s=store: s.get(t), stored)
+            cases[f'{backend}.delete[{size}]'] = (lambda t, s=store: s.delete(t), stored)
+    return cases
+
+
+def run(backends, sizes, min_time):
+    with tempfile.TemporaryDirectory() as tmp:
+        # app.py keeps its secrets, keys and log under the working directory
+        cwd = os.getcwd()
+        os.chdir(tmp)
+        os.environ['REAPER_ENABLED'] = '0'
+        os.environ['ADMISSION_ENABLED'] = '0'
+        try:
+            import app
+            results = {}
+            for name, (fn, setup) in benchmarks(app, backends, sizes, tmp).items():
+                peak, retained = memory(fn, setup)
+                results[name] = {
+                    'us': measure(fn, min_time, setup) * 1e6,
+                    'peak_bytes': peak,
+                    'retained_allocations': retained,
+                }
+            app.log_pipeline.stop()
+        finally:
+            os.chdir(cwd)
+    return results
+
+
+def load_results(ref):
+    path = ref if os.path.exists(ref) else os.path.join(RESULTS_DIR, f'{ref}.json')
+    with open(path) as f:
+        return json.load(f)
+
+
+def compare(current, baseline, threshold, memory_threshold):
+    regressions = []
+    for name, row in current['results'].items():
+        old = baseline['results'].get(name)
+        if old is None:
+            continue
+        if row['us'] > old['us'] * (1 + threshold / 100):
+            regressions.append(f'{name}: {old["us"]:.2f} -> {row["us"]:.2f} us')
+        # Small absolute changes in peak memory are noise, not regressions
+        grew = row['peak_bytes'] - old['peak_bytes']
+        if grew > 1024 and row['peak_bytes'] > old['peak_bytes'] * (1 + memory_threshold / 100):
+            regressions.append(f'{name}: peak {old["peak_bytes"]} -> {row["peak_bytes"]} bytes')
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', default=','.join(map(str, DEFAULT_SIZES)),
+                        help='comma-separated secret sizes in characters')
+    parser.add_argument('--backends', default='file,sqlite')
+    parser.add_argument('--min-time', type=float, default=0.2,
+                        help='seconds to spend timing each benchmark')
+    parser.add_argument('--compare', metavar='REF', help='commit id or results file to compare against')
+    parser.add_argument('--threshold', type=float, default=20.0, help='allowed slowdown in percent')
+    parser.add_argument('--memory-threshold', type=float, default=20.0,
+                        help='allowed peak memory growth in percent')
+    parser.add_argument('--no-save', action='store_true', help='do not write benchmarks/results/')
+    parser.add_argument('--json', action='store_true', help='print results as JSON')
+    args = parser.parse_args()
+
+    current = {
+        'commit': commit_id(),
+        'python': sys.version.split()[0],
+        'results': run(args.backends.split(','), [int(s) for s in args.sizes.split(',')], args.min_time),
+    }
+    if not args.no_save:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        with open(os.path.join(RESULTS_DIR, f'{current["commit"]}.json'), 'w') as f:
+            json.dump(current, f, indent=2)
+
+    if args.json:
+        print(json.dumps(current, indent=2))
+    else:
+        print(f'{"benchmark":<32}{"us":>12}{"peak KB":>12}{"retained":>10}')
+        for name, row in current['results'].items():
+            print(f'{name:<32}{row["us"]:>12.2f}{row["peak_bytes"] / 1024:>12.1f}{row["retained_allocations"]:>10}')
+
+    if args.compare:
+        regressions = compare(current, load_results(args.compare), args.threshold, args.memory_threshold)
+        for line in regressions:
+            print(f'REGRESSION {line}', file=sys.stderr)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,141 @@
+"""Stored size and cost of compressing secrets before encryption.
+
+    python benchmarks/payload_compression.py [--sizes 256,5000,65536] [--json]
+
+Builds deterministic payloads of the kinds people share (random tokens,
+prose, JSON, config files, PEM bundles), then compresses each with every
+codec in payloads.py and encrypts the result with AES-GCM, as secure_encrypt
+does. Reports the encoded record size, its ratio to the uncompressed record
+and the time to compress + encrypt and to decrypt + decompress.
+"""
+import argparse
+import base64
+import json
+import os
+import random
+import string
+import sys
+import time
+from secrets import token_bytes
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import payloads  # noqa: E402
+from crypto_engine import get_engine  # noqa: E402
+from keystore import Key  # noqa: E402
+from records import encode_record  # noqa: E402
+
+DEFAULT_SIZES = [256, 1024, 5000, 64 * 1024]
+WORDS = ('the', 'secret', 'server', 'password', 'deploy', 'token', 'rotate', 'access', 'database',
+         'backup', 'staging', 'please', 'share', 'before', 'friday', 'with', 'team', 'key')
+
+
+def _random(rng, size):
+    return base64.b64encode(rng.randbytes(size)).decode()
+
+
+def _prose(rng, size):
+    return ' '.join(rng.choice(WORDS) for _ in range(size // 4))
+
+
+def _json(rng, size):
+    rows = [{'id': i, 'user': rng.choice(WORDS), 'password': ''.join(rng.choices(string.ascii_letters, k=16)),
+             'enabled': rng.random() < 0.5} for i in range(size // 40 + 1)]
+    return json.dumps(rows, indent=2)
+
+
+def _config(rng, size):
+    lines = [f'{rng.choice(WORDS).upper()}_{rng.choice(WORDS).upper()}_{i}='
+             f'{"".join(rng.choices(string.ascii_lowercase + string.digits, k=24))}' for i in range(size // 30 + 1)]
+    return '\n'.join(lines)
+
+
+def _pem(rng, size):
+    blocks = []
+    while sum(map(len, blocks)) < size:
+        body = base64.encodebytes(rng.randbytes(900)).decode()
+        blocks.append(f'-----BEGIN CERTIFICATE-----\n{body}-----END CERTIFICATE-----\n')
+    return ''.join(blocks)
+
+
+PAYLOADS = {'random': _random, 'prose': _prose, 'json': _json, 'config': _config, 'pem': _pem}
+
+
+def codec_settings():
+    settings = [('none', None, None), ('zlib-1', 'zlib', 1), ('zlib-6', 'zlib', 6), ('zlib-9', 'zlib', 9)]
+    if 'zstd' in payloads.available_codecs():
+        settings += [('zstd-3', 'zstd', 3), ('zstd-19', 'zstd', 19)]
+    return settings
+
+
+def measure(fn, min_time):
+    # Repeat until at least min_time has elapsed so tiny payloads are measurable
+    iterations = 0
+    start = time.perf_counter()
+    while True:
+        fn()
+        iterations += 1
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_time:
+            return elapsed / iterations
+
+
+def record_size(blob, compression):
+    return len(encode_record({'secret': blob, 'key_id': 1, 'alg': 'aes-gcm',
+                              'compression': compression, 'expires_at': 0.0}))
+
+
+def run(sizes, min_time):
+    key = Key(1, token_bytes(32))
+    engine = get_engine('aes-gcm')
+    results = []
+    for kind, make in PAYLOADS.items():
+        for size in sizes:
+            data = make(random.Random(f'{kind}-{size}'), size).encode()[:size]
+            baseline = None
+            for name, codec, level in codec_settings():
+                # min_bytes=0: measure every size, the app's threshold is a separate choice
+                compressor = payloads.PayloadCompressor(codec, min_bytes=0, level=level)
+                packed, used = compressor.pack(data)
+                blob = engine.encrypt(key, packed)
+                assert payloads.unpack(engine.decrypt(key, blob), used) == data
+                stored = record_size(blob, used)
+                baseline = baseline or stored
+
+                def encrypt(compressor=compressor):
+                    engine.encrypt(key, compressor.pack(data)[0])
+
+                def decrypt(blob=blob, used=used):
+                    payloads.unpack(engine.decrypt(key, blob), used)
+
+                results.append({
+                    'payload': kind, 'size': len(data), 'codec': name, 'stored': used is not None,
+                    'record_bytes': stored, 'ratio': stored / baseline,
+                    'encrypt_us': measure(encrypt, min_time) * 1e6,
+                    'decrypt_us': measure(decrypt, min_time) * 1e6,
+                })
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', default=','.join(map(str, DEFAULT_SIZES)),
+                        help='comma-separated payload sizes in bytes')
+    parser.add_argument('--min-time', type=float, default=0.1,
+                        help='seconds to spend on each measurement')
+    parser.add_argument('--json', action='store_true', help='print results as JSON')
+    args = parser.parse_args()
+
+    results = run([int(s) for s in args.sizes.split(',')], args.min_time)
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    print(f'{"payload":<10}{"size":>8}{"codec":>10}{"record B":>10}{"ratio":>8}{"enc us":>10}{"dec us":>10}')
+    for row in results:
+        codec = row['codec'] if row['stored'] or row['codec'] == 'none' else f'({row["codec"]})'
+        print(f'{row["payload"]:<10}{row["size"]:>8}{codec:>10}{row["record_bytes"]:>10}'
+              f'{row["ratio"]:>8.2f}{row["encrypt_us"]:>10.1f}{row["decrypt_us"]:>10.1f}')
+
+
+if __name__ == '__main__':
+    main()
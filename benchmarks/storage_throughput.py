@@ -0,0 +1,59 @@
+"""Put/get/take throughput of each storage backend.
+
+    python benchmarks/storage_throughput.py [--count 2000] [--backends file,sqlite,segment] [--json]
+
+Runs against a throwaway directory so it never touches a real SECRETS_DIR.
+"""
+import argparse
+import json
+import os
+import secrets
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from storage import open_store  # noqa: E402
+
+
+def run(backend, count, payload_size):
+    with tempfile.TemporaryDirectory() as tmp:
+        os.environ['SQLITE_PATH'] = os.path.join(tmp, 'bench.db')
+        store = open_store(tmp, backend)
+        tokens = [secrets.token_urlsafe(16) for _ in range(count)]
+        record = {'secret': secrets.token_bytes(payload_size), 'key_id': 0, 'alg': 'aes-gcm',
+                  'expires_at': time.time() + 3600}
+        row = {'backend': backend, 'count': count, 'payload_size': payload_size}
+        for op, fn in (('put', lambda t: store.put(t, record)),
+                       ('get', store.get),
+                       ('take', store.take)):
+            start = time.perf_counter()
+            for token in tokens:
+                fn(token)
+            elapsed = time.perf_counter() - start
+            row[f'{op}_per_s'] = count / elapsed
+            row[f'{op}_us'] = elapsed / count * 1e6
+        store.close()
+        return row
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--count', type=int, default=2000)
+    parser.add_argument('--payload-size', type=int, default=256)
+    parser.add_argument('--backends', default='file,sqlite,segment')
+    parser.add_argument('--json', action='store_true', help='print results as JSON')
+    args = parser.parse_args()
+
+    results = [run(b, args.count, args.payload_size) for b in args.backends.split(',')]
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    print(f'{"backend":<10}{"put us":>10}{"get us":>10}{"take us":>10}')
+    for row in results:
+        print(f'{row["backend"]:<10}{row["put_us"]:>10.1f}{row["get_us"]:>10.1f}{row["take_us"]:>10.1f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,110 @@
+"""Response compression negotiated from Accept-Encoding.
+
+Bodies that never change (static assets, the index and error pages) are
+compressed once at startup with ``precompress`` at the highest levels, and
+served from those bytes. Everything else goes through ``ResponseCompressor``,
+an ``after_request`` hook that compresses text and JSON bodies of at least
+COMPRESS_MIN_BYTES on the fly with cheaper settings and never keeps them.
+
+brotli is used when the ``brotli`` package is installed and the client
+accepts it, gzip otherwise. Responses that are streamed, already encoded or
+too small go out as they are.
+
+Pages carrying a secret are compressed too. A BREACH-style attack needs
+attacker-chosen text reflected next to the secret; the only reflected value
+on those pages is the token, which also selects the secret, so it cannot be
+varied independently.
+"""
+import gzip
+from contextlib import nullcontext
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+COMPRESSIBLE_TYPES = ('text/', 'application/json', 'application/javascript')
+
+
+def negotiate_encoding(accept_encoding, available):
+    """Pick the best of ``available`` ('br', 'gzip') the client accepts, or None."""
+    accepted = {}
+    for part in (accept_encoding or '').split(','):
+        coding, _, params = part.strip().partition(';')
+        q = 1.0
+        params = params.strip()
+        if params.startswith('q='):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        accepted[coding.strip().lower()] = q
+    for coding in ('br', 'gzip'):
+        if coding in available and accepted.get(coding, accepted.get('*', 0.0)) > 0:
+            return coding
+    return None
+
+
+def available_encodings():
+    return ('br', 'gzip') if brotli is not None else ('gzip',)
+
+
+def precompress(data):
+    """encoding (None for identity) -> body, at maximum compression."""
+    variants = {None: data, 'gzip': gzip.compress(data, 9, mtime=0)}
+    if brotli is not None:
+        variants['br'] = brotli.compress(data)
+    return variants
+
+
+def variant_etags(digest, variants):
+    # Strong validators must differ between encodings of the same content
+    return {encoding: f'"{digest}-{encoding}"' if encoding else f'"{digest}"' for encoding in variants}
+
+
+def compress(data, encoding):
+    # Per-request settings: most of the size win for a fraction of the CPU
+    if encoding == 'br':
+        return brotli.compress(data, quality=4)
+    return gzip.compress(data, 6, mtime=0)
+
+
+def add_vary(response):
+    vary = response.headers.get('Vary')
+    if not vary:
+        response.headers['Vary'] = 'Accept-Encoding'
+    elif 'accept-encoding' not in vary.lower():
+        response.headers['Vary'] = f'{vary}, Accept-Encoding'
+
+
+class ResponseCompressor:
+    def __init__(self, min_bytes=1024, timer=None):
+        self.min_bytes = min_bytes
+        self.encodings = available_encodings()
+        # timer(stage) -> context manager, as for InstrumentedStore
+        self.timer = timer or (lambda stage: nullcontext())
+
+    def _compressible(self, response):
+        mimetype = response.mimetype or ''
+        return mimetype.startswith(COMPRESSIBLE_TYPES)
+
+    def __call__(self, request, response):
+        if (response.direct_passthrough or response.is_streamed
+                or 'Content-Encoding' in response.headers or not self._compressible(response)):
+            return response
+        add_vary(response)
+        if response.status_code < 200 or response.status_code in (204, 206, 304):
+            return response
+        data = response.get_data()
+        if len(data) < self.min_bytes:
+            return response
+        encoding = negotiate_encoding(request.headers.get('Accept-Encoding'), self.encodings)
+        if encoding is None:
+            return response
+        with self.timer('compress'):
+            body = compress(data, encoding)
+        if len(body) >= len(data):
+            return response
+        response.set_data(body)
+        response.headers['Content-Encoding'] = encoding
+        return response
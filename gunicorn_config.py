@@ -1,5 +1,59 @@
 # gunicorn_config.py
+import os
+import time
+
+# Read by app.py to report cold-start latency (secret_share_cold_start_seconds)
+os.environ['SERVER_STARTED_AT'] = str(time.time())
+# app.py leaves its background threads to post_worker_init below instead of
+# starting them on import, which under preload_app happens in the master
+os.environ['WORKER_HOOKS'] = '1'
+
+
+def _cpu_count():
+    # CPUs this process may run on, e.g. a container's cpuset, not the host's
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+# One process per CPU runs Python in parallel. Threads only help while a
+# request waits on I/O, so their number follows the storage backend: a round
+# trip to Redis leaves a thread idle far longer than a local file or SQLite
+# call. WEB_CONCURRENCY and GUNICORN_THREADS override either.
+IO_WAIT_THREADS = {'redis': 8}
+
 bind = "0.0.0.0:10000"
-workers = 2
-threads = 4
-timeout = 120
\ No newline at end of file
+workers = int(os.environ.get('WEB_CONCURRENCY') or max(2, _cpu_count()))
+threads = int(os.environ.get('GUNICORN_THREADS') or IO_WAIT_THREADS.get(os.environ.get('STORAGE_BACKEND'), 4))
+# Read by admission.py to keep each route's in-flight cap below this
+os.environ['SERVER_THREADS'] = str(threads)
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 120))
+# Import app.py once in the master: the key, compiled templates, rendered
+# pages and fingerprinted assets are then shared by every worker via fork()
+preload_app = os.environ.get('PRELOAD_APP', '1') == '1'
+
+
+def on_starting(server):
+    # Runs in the master after preload_app has imported the app, before any fork
+    from keystore import from_environ as keyring_from_environ
+    from metrics import clear_directory
+    secrets_dir = os.path.join(os.getcwd(), 'secrets')
+    # Per-worker metric files from a previous run would be summed into this one
+    clear_directory(os.environ.get('METRICS_DIR', os.path.join(secrets_dir, '.metrics')))
+    # Create the key here, once, rather than in whichever worker starts first
+    os.makedirs(secrets_dir, exist_ok=True)
+    keyring_from_environ(secrets_dir).load()
+    if server.cfg.preload_app:
+        from app import detach_for_fork
+        detach_for_fork()
+
+
+def post_worker_init(worker):
+    # `kill -USR1 <master>` reloads every worker's keyring and reopens logs
+    from app import keyring, log_pipeline, start_worker
+    from keystore import install_reload_handler
+    from log_pipeline import install_reopen_handler
+    install_reload_handler(keyring)
+    install_reopen_handler(log_pipeline)
+    start_worker()
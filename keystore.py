@@ -0,0 +1,274 @@
+"""Per-worker keyring.
+
+Key material is read from disk and derived once per process, then served
+from memory on every encrypt/decrypt. Keys are versioned: the legacy
+``secrets/.encryption_key`` is key ID 0, rotated keys live in
+``secrets/.keys/<id>.key`` and the highest ID is the active one. Each stored
+record carries the ID of the key it was written with, so older secrets stay
+readable after a rotation.
+
+Those files are local to the node, and the first start creates a random key
+there. When several nodes serve the same records (STORAGE_BACKEND=redis),
+every node must load the same keys instead, from one of:
+
+    KEYS_DIR     a directory of ``<id>.key`` files every node mounts (a
+                 shared volume, a Kubernetes secret); replaces secrets/.keys
+    SECRET_KEYS  ``<id>:<base64 key>[,<id>:<base64 key>...]``, e.g. from a
+                 secrets manager; ``python keystore.py generate`` prints one
+
+Both may be set; an ID defined in both must carry the same key. Nothing is
+generated for a shared keyring, and app.py refuses to start a shared store
+without one. The node's own ``.encryption_key``, if any, stays readable as
+key ID 0 unless a shared key claims that ID, but never becomes the active
+key; keys in a node's old ``secrets/.keys`` are not loaded once KEYS_DIR or
+SECRET_KEYS is set.
+
+A running worker picks up new keys when told to (``Keyring.reload``, wired
+to SIGUSR1 by ``install_reload_handler``); nothing is polled per request. A
+record carrying a key ID the worker does not know yet, written by a worker
+that has already reloaded, makes ``get`` rescan once before giving up.
+
+    python keystore.py rotate     # write a new active key (to KEYS_DIR if set)
+    kill -USR1 <gunicorn master>  # workers reload their keyring
+"""
+import argparse
+import base64
+import logging
+import os
+import signal
+import time
+from hashlib import sha256
+from secrets import token_bytes
+
+LEGACY_KEY_ID = 0
+LEGACY_KEY_FILE = '.encryption_key'
+KEYS_SUBDIR = '.keys'
+KEY_SIZE = 32
+
+
+class UnknownKeyError(KeyError):
+    pass
+
+
+class KeyringError(ValueError):
+    pass
+
+
+class Key:
+    __slots__ = ('key_id', 'material', 'digest')
+
+    def __init__(self, key_id, material):
+        self.key_id = key_id
+        self.material = material
+        # Derived once here instead of on every encrypt/decrypt
+        self.digest = sha256(material).digest()
+
+
+def _write_key_file(path, material):
+    # Write to a private temp file and hard-link it into place: link() fails
+    # if the target exists, so two workers racing to create the same key can
+    # never observe a half-written file.
+    tmp_path = f'{path}.{os.getpid()}.{token_bytes(4).hex()}.tmp'
+    fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(material)
+            f.flush()
+            os.fsync(f.fileno())
+        try:
+            os.link(tmp_path, path)
+        except FileExistsError:
+            return False
+        except OSError:
+            # Some FUSE, SMB and object-store mounts have no hard links
+            return _create_key_file(path, material)
+        return True
+    finally:
+        os.remove(tmp_path)
+
+
+def _create_key_file(path, material):
+    # O_EXCL still lets only one creator win; a reader racing the write can
+    # see a short file, which _read_key_file waits out
+    try:
+        fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+    except FileExistsError:
+        return False
+    with os.fdopen(fd, 'wb') as f:
+        f.write(material)
+        f.flush()
+        os.fsync(f.fileno())
+    return True
+
+
+def _read_key_file(path, attempts=50):
+    for _ in range(attempts):
+        with open(path, 'rb') as f:
+            material = f.read()
+        # Only _create_key_file can expose a key mid-write
+        if len(material) >= KEY_SIZE:
+            break
+        time.sleep(0.01)
+    return material
+
+
+def parse_secret_keys(value):
+    """SECRET_KEYS value -> {key id: key material}."""
+    keys = {}
+    for entry in filter(None, (part.strip() for part in value.split(','))):
+        key_id, sep, encoded = entry.partition(':')
+        if not sep or not key_id.strip().isdigit():
+            raise KeyringError(f'SECRET_KEYS entries look like <id>:<base64 key>, got {entry[:8]!r}...')
+        try:
+            material = base64.b64decode(encoded, validate=True)
+        except ValueError:
+            raise KeyringError(f'SECRET_KEYS key {key_id} is not valid base64') from None
+        if len(material) != KEY_SIZE:
+            raise KeyringError(f'SECRET_KEYS key {key_id} must be {KEY_SIZE} bytes, not {len(material)}')
+        keys[int(key_id)] = material
+    return keys
+
+
+class Keyring:
+    def __init__(self, secrets_dir, keys_dir=None, secret_keys=None):
+        self.secrets_dir = secrets_dir
+        self.legacy_path = os.path.join(secrets_dir, LEGACY_KEY_FILE)
+        # Keys every node shares (see the module docstring), if configured
+        self.secret_keys = secret_keys or {}
+        self.shared = keys_dir is not None or bool(self.secret_keys)
+        if keys_dir is not None:
+            self.keys_dir = keys_dir
+        else:
+            self.keys_dir = None if self.secret_keys else os.path.join(secrets_dir, KEYS_SUBDIR)
+        # (keys by id, active key); replaced as a whole so readers never need a lock
+        self._state = None
+
+    def _scan(self):
+        # Every key except the local legacy one
+        keys = {key_id: Key(key_id, material) for key_id, material in self.secret_keys.items()}
+        if self.keys_dir is not None and os.path.isdir(self.keys_dir):
+            for name in os.listdir(self.keys_dir):
+                stem, ext = os.path.splitext(name)
+                if ext != '.key' or not stem.isdigit():
+                    continue
+                key_id = int(stem)
+                material = _read_key_file(os.path.join(self.keys_dir, name))
+                if key_id in keys and keys[key_id].material != material:
+                    raise KeyringError(f'Key id {key_id} differs between SECRET_KEYS and {self.keys_dir}')
+                keys[key_id] = Key(key_id, material)
+        return keys
+
+    def _read_legacy(self):
+        try:
+            return Key(LEGACY_KEY_ID, _read_key_file(self.legacy_path))
+        except FileNotFoundError:
+            return None
+
+    def load(self):
+        keys = self._scan()
+        if self.shared and not keys:
+            raise KeyringError(
+                'KEYS_DIR/SECRET_KEYS configured but no key found; '
+                'create one with `python keystore.py rotate` or `python keystore.py generate`')
+        if LEGACY_KEY_ID not in keys:
+            legacy = self._read_legacy()
+            if legacy is None and not keys:
+                # First start of a single node: nothing to share, make a key here
+                _write_key_file(self.legacy_path, token_bytes(KEY_SIZE))
+                legacy = self._read_legacy()
+            if legacy is not None:
+                keys[LEGACY_KEY_ID] = legacy
+        # A shared keyring always has an ID above the local legacy key's 0
+        self._state = (keys, keys[max(keys)])
+        return self._state
+
+    def reload(self):
+        keys, active = self.load()
+        logging.info(f'Keyring reloaded: {len(keys)} key(s), active key id {active.key_id}')
+
+    def _current(self):
+        state = self._state
+        if state is None:
+            state = self.load()
+        return state
+
+    def active(self):
+        return self._current()[1]
+
+    def get(self, key_id):
+        keys = self._current()[0]
+        if key_id not in keys:
+            # Written by a worker that already saw a rotation this one has not
+            # been told about yet: rescan once rather than fail the read
+            keys = self.load()[0]
+            if key_id not in keys:
+                raise UnknownKeyError(key_id)
+        return keys[key_id]
+
+    def key_ids(self):
+        return sorted(self._current()[0])
+
+    def next_key_id(self):
+        return max(self._scan(), default=LEGACY_KEY_ID) + 1
+
+    def rotate(self):
+        if self.keys_dir is None:
+            raise KeyringError('Keys come from SECRET_KEYS only; add one from `python keystore.py generate` there')
+        os.makedirs(self.keys_dir, mode=0o700, exist_ok=True)
+        while True:
+            key_id = self.next_key_id()
+            path = os.path.join(self.keys_dir, f'{key_id}.key')
+            if _write_key_file(path, token_bytes(KEY_SIZE)):
+                break
+        self.load()
+        return self.active()
+
+
+def from_environ(secrets_dir):
+    return Keyring(
+        secrets_dir,
+        os.environ.get('KEYS_DIR') or None,
+        parse_secret_keys(os.environ.get('SECRET_KEYS', '')),
+    )
+
+
+def install_reload_handler(keyring, signum=signal.SIGUSR1):
+    # Chain to whatever was installed before us: gunicorn workers use SIGUSR1
+    # to reopen their log files, and the master forwards it to every worker.
+    previous = signal.getsignal(signum)
+
+    def handler(sig, frame):
+        try:
+            keyring.reload()
+        except Exception as e:
+            logging.error(f'Keyring reload failed: {str(e)}')
+        if callable(previous):
+            previous(sig, frame)
+
+    signal.signal(signum, handler)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Manage secret-share encryption keys')
+    parser.add_argument('--secrets-dir', default=os.path.join(os.getcwd(), 'secrets'))
+    sub = parser.add_subparsers(dest='command', required=True)
+    sub.add_parser('list', help='list known key ids')
+    sub.add_parser('rotate', help='create a new active key')
+    sub.add_parser('generate', help='print a new SECRET_KEYS entry without storing it')
+    args = parser.parse_args(argv)
+
+    os.makedirs(args.secrets_dir, exist_ok=True)
+    keyring = from_environ(args.secrets_dir)
+    if args.command == 'rotate':
+        key = keyring.rotate()
+        print(f'Active key id is now {key.key_id}; send SIGUSR1 to the gunicorn master to reload workers')
+    elif args.command == 'generate':
+        print(f'{keyring.next_key_id()}:{base64.b64encode(token_bytes(KEY_SIZE)).decode()}')
+    else:
+        active = keyring.active().key_id
+        for key_id in keyring.key_ids():
+            print(f'{key_id}{" (active)" if key_id == active else ""}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,259 @@
+"""Non-blocking structured logging.
+
+Request threads never touch the log file: the root logger gets a
+``QueueHandler`` that only enqueues, and one listener thread per serving
+process drains the queue and writes whole batches of JSON lines with a
+single write and flush. ``install()`` only attaches the handler; the
+thread is started by ``start()``, from the worker hooks under gunicorn.
+
+Request-path events are logged with ``extra={'event': ...}``; INFO records
+carrying an event are kept with probability LOG_SAMPLE_RATE, everything else
+(warnings, errors, lifecycle messages) is always kept. If the queue is full
+records are dropped rather than blocking the request, and the number dropped
+is reported by the listener.
+
+LOG_ROTATE selects rotation. The default, ``none``, leaves it to an external
+tool such as logrotate, which then sends SIGUSR1 to the gunicorn master so
+every worker reopens the file:
+
+    /srv/secret-share/app.log {
+        daily
+        rotate 7
+        compress
+        delaycompress
+        postrotate
+            kill -USR1 <gunicorn master pid>
+        endscript
+    }
+
+``size`` (LOG_MAX_BYTES, LOG_BACKUP_COUNT) and ``time`` (LOG_ROTATE_WHEN,
+LOG_BACKUP_COUNT) rotate in-process. Each worker then rotates on its own and
+renames files the others are still writing, so only use them with a single
+process, e.g. the development server.
+"""
+import atexit
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import signal
+import threading
+import time
+from datetime import datetime, timezone
+
+# Attributes every LogRecord has; anything else came from extra={...}
+_RECORD_ATTRS = set(vars(logging.makeLogRecord({}))) | {'message', 'asctime'}
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            'ts': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'msg': record.getMessage(),
+            'pid': record.process,
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRS:
+                entry[key] = value
+        if record.exc_text:
+            entry['exc'] = record.exc_text
+        return json.dumps(entry, default=str)
+
+
+class SamplingFilter(logging.Filter):
+    def __init__(self, rate):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record):
+        if self.rate >= 1.0 or record.levelno > logging.INFO or not hasattr(record, 'event'):
+            return True
+        return random.random() < self.rate
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class BatchingListener:
+    def __init__(self, log_queue, handler, batch_size=256, dropped=lambda: 0):
+        self.queue = log_queue
+        self.handler = handler
+        self.batch_size = batch_size
+        self._dropped = dropped
+        self._reported_drops = 0
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name='log-listener', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        if self._thread is not None and self._thread.is_alive():
+            self.queue.put(None)
+            self._thread.join()
+        self._thread = None
+
+    def _run(self):
+        while True:
+            record = self.queue.get()
+            batch = []
+            stop = record is None
+            if not stop:
+                batch.append(record)
+            while not stop and len(batch) < self.batch_size:
+                try:
+                    record = self.queue.get_nowait()
+                except queue.Empty:
+                    break
+                if record is None:
+                    stop = True
+                else:
+                    batch.append(record)
+            self._report_drops(batch)
+            if batch:
+                try:
+                    write_batch(self.handler, batch)
+                except Exception:
+                    self.handler.handleError(batch[-1])
+            if stop:
+                return
+
+    def _report_drops(self, batch):
+        dropped = self._dropped()
+        if dropped > self._reported_drops:
+            batch.append(logging.makeLogRecord({
+                'levelno': logging.WARNING,
+                'levelname': 'WARNING',
+                'msg': f'Log queue full, dropped {dropped - self._reported_drops} record(s)',
+            }))
+            self._reported_drops = dropped
+
+
+def write_batch(handler, records):
+    data = ''.join(handler.format(record) + '\n' for record in records)
+    with handler.lock:
+        if handler.stream is None:
+            handler.stream = handler._open()
+        if isinstance(handler, logging.handlers.TimedRotatingFileHandler):
+            if time.time() >= handler.rolloverAt:
+                handler.doRollover()
+        elif isinstance(handler, logging.handlers.RotatingFileHandler):
+            if handler.maxBytes and handler.stream.tell() + len(data) >= handler.maxBytes:
+                handler.doRollover()
+        handler.stream.write(data)
+        handler.stream.flush()
+
+
+def _file_handler(filename, rotate, max_bytes, backup_count, when):
+    if rotate == 'size':
+        return logging.handlers.RotatingFileHandler(
+            filename, maxBytes=max_bytes, backupCount=backup_count)
+    if rotate == 'time':
+        return logging.handlers.TimedRotatingFileHandler(
+            filename, when=when, backupCount=backup_count)
+    if rotate == 'none':
+        return logging.FileHandler(filename)
+    raise ValueError(f'Unknown LOG_ROTATE mode: {rotate!r}')
+
+
+class LogPipeline:
+    def __init__(self, filename='app.log', level=logging.INFO, rotate='none',
+                 max_bytes=10 * 1024 * 1024, backup_count=5, when='midnight',
+                 sample_rate=1.0, queue_size=10000):
+        self.level = level
+        self.file_handler = _file_handler(filename, rotate, max_bytes, backup_count, when)
+        self.file_handler.setFormatter(JsonFormatter())
+        self.queue = queue.Queue(queue_size)
+        self.queue_handler = DroppingQueueHandler(self.queue)
+        self.queue_handler.addFilter(SamplingFilter(sample_rate))
+        self.listener = None
+
+    def install(self):
+        root = logging.getLogger()
+        for handler in list(root.handlers):
+            root.removeHandler(handler)
+        root.addHandler(self.queue_handler)
+        root.setLevel(self.level)
+        # No listener yet: records queue up until start() runs in the process
+        # that serves requests (app.start_worker), so a preloading master
+        # never owns the thread. Flush whatever is queued when it exits.
+        atexit.register(self.stop)
+        return self
+
+    def start(self):
+        # Also called after fork() of a started process: the parent's listener
+        # thread does not exist in the child, so a fresh one (and a fresh
+        # queue) is needed there.
+        if self.listener is not None and self.listener._thread is not None:
+            if self.listener._thread.is_alive():
+                return
+            self.queue = queue.Queue(self.queue.maxsize)
+            self.queue_handler.queue = self.queue
+        self.listener = BatchingListener(
+            self.queue, self.file_handler, dropped=lambda: self.queue_handler.dropped)
+        self.listener.start()
+
+    def stop(self):
+        if self.listener is not None:
+            self.listener.stop()
+        else:
+            self.drain()
+        self.file_handler.close()
+
+    def drain(self):
+        # Write what was queued without a listener, e.g. in the master before
+        # fork(), so the records are not copied into every worker's queue
+        batch = []
+        while True:
+            try:
+                record = self.queue.get_nowait()
+            except queue.Empty:
+                break
+            if record is not None:
+                batch.append(record)
+        if batch:
+            write_batch(self.file_handler, batch)
+
+    def reopen(self):
+        # After an external rotation: the next batch opens the new file
+        with self.file_handler.lock:
+            if self.file_handler.stream is not None:
+                self.file_handler.stream.close()
+                self.file_handler.stream = None
+
+
+def setup_logging(filename='app.log'):
+    return LogPipeline(
+        filename,
+        level=getattr(logging, os.environ.get('LOG_LEVEL', 'INFO').upper()),
+        rotate=os.environ.get('LOG_ROTATE', 'none'),
+        max_bytes=int(os.environ.get('LOG_MAX_BYTES', 10 * 1024 * 1024)),
+        backup_count=int(os.environ.get('LOG_BACKUP_COUNT', 5)),
+        when=os.environ.get('LOG_ROTATE_WHEN', 'midnight'),
+        sample_rate=float(os.environ.get('LOG_SAMPLE_RATE', 1.0)),
+    ).install()
+
+
+def install_reopen_handler(pipeline, signum=signal.SIGUSR1):
+    # Chained like keystore.install_reload_handler, so one SIGUSR1 to the
+    # gunicorn master reopens every worker's log file and reloads its keys.
+    previous = signal.getsignal(signum)
+
+    def handler(sig, frame):
+        pipeline.reopen()
+        if callable(previous):
+            previous(sig, frame)
+
+    signal.signal(signum, handler)
@@ -0,0 +1,315 @@
+"""Prometheus-style metrics shared across gunicorn workers.
+
+Each process keeps its values in its own memory-mapped file under
+METRICS_DIR (``<pid>.db``); an update is a struct write into the mapping,
+with no syscall. ``/metrics`` reads every process's file, sums counters and
+histograms (gauges take the maximum over live processes) and renders the
+Prometheus text format. Clear METRICS_DIR when the server starts
+(gunicorn_config.py does this in ``on_starting``) so values from a previous
+run are not carried over.
+"""
+import json
+import mmap
+import os
+import struct
+import threading
+import time
+from contextlib import contextmanager
+
+DEFAULT_BUCKETS = (
+    0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0,
+)
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+_USED = struct.Struct('<I')
+_LENGTH = struct.Struct('<I')
+_VALUE = struct.Struct('<d')
+_INITIAL_SIZE = 64 * 1024
+
+
+class ValueFile:
+    """Append-only (key -> float) table in a memory-mapped file.
+
+    Layout: 4-byte used size, then entries of 4-byte key length, the UTF-8
+    key padded to 8 bytes, and an 8-byte double updated in place.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._positions = {}
+        self._file = open(path, 'a+b')
+        if os.fstat(self._file.fileno()).st_size == 0:
+            self._file.truncate(_INITIAL_SIZE)
+        self._capacity = os.fstat(self._file.fileno()).st_size
+        self._map = mmap.mmap(self._file.fileno(), self._capacity)
+        self._used = _USED.unpack_from(self._map, 0)[0] or _USED.size
+        for key, _, position in _iter_entries(self._map, self._used):
+            self._positions[key] = position
+
+    def _position(self, key):
+        position = self._positions.get(key)
+        if position is not None:
+            return position
+        encoded = key.encode()
+        padded = len(encoded) + (-(_LENGTH.size + len(encoded)) % 8)
+        entry_size = _LENGTH.size + padded + _VALUE.size
+        if self._used + entry_size > self._capacity:
+            self._grow(self._used + entry_size)
+        _LENGTH.pack_into(self._map, self._used, len(encoded))
+        self._map[self._used + _LENGTH.size:self._used + _LENGTH.size + len(encoded)] = encoded
+        position = self._used + _LENGTH.size + padded
+        _VALUE.pack_into(self._map, position, 0.0)
+        self._used += entry_size
+        _USED.pack_into(self._map, 0, self._used)
+        self._positions[key] = position
+        return position
+
+    def _grow(self, needed):
+        capacity = self._capacity
+        while capacity < needed:
+            capacity *= 2
+        self._map.close()
+        self._file.truncate(capacity)
+        self._capacity = capacity
+        self._map = mmap.mmap(self._file.fileno(), capacity)
+
+    def inc(self, key, amount=1.0):
+        with self._lock:
+            position = self._position(key)
+            value = _VALUE.unpack_from(self._map, position)[0]
+            _VALUE.pack_into(self._map, position, value + amount)
+
+    def set(self, key, value):
+        with self._lock:
+            _VALUE.pack_into(self._map, self._position(key), value)
+
+
+def _iter_entries(buf, used):
+    offset = _USED.size
+    while offset < used:
+        length = _LENGTH.unpack_from(buf, offset)[0]
+        key_start = offset + _LENGTH.size
+        key = bytes(buf[key_start:key_start + length]).decode()
+        position = key_start + length + (-(_LENGTH.size + length) % 8)
+        yield key, _VALUE.unpack_from(buf, position)[0], position
+        offset = position + _VALUE.size
+
+
+def read_value_file(path):
+    with open(path, 'rb') as f:
+        data = f.read()
+    if len(data) < _USED.size:
+        return []
+    return [(key, value) for key, value, _ in _iter_entries(data, _USED.unpack_from(data, 0)[0])]
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    inner = ','.join(f'{name}="{_escape(value)}"' for name, value in labels)
+    return '{' + inner + '}'
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_float(value):
+    if value == float('inf'):
+        return '+Inf'
+    if value == int(value):
+        return str(int(value))
+    return repr(value)
+
+
+class _Metric:
+    type = None
+
+    def __init__(self, registry, name, documentation, labelnames=()):
+        self.registry = registry
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._keys = {}
+
+    def _labels(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f'{self.name} expects labels {self.labelnames}, got {tuple(labels)}')
+        return [(name, labels[name]) for name in self.labelnames]
+
+    def _key(self, sample, labels):
+        cache_key = (sample, tuple(labels))
+        key = self._keys.get(cache_key)
+        if key is None:
+            key = self._keys[cache_key] = json.dumps([sample, labels])
+        return key
+
+
+class Counter(_Metric):
+    type = 'counter'
+
+    def inc(self, amount=1.0, **labels):
+        self.registry.values().inc(self._key(f'{self.name}_total', self._labels(labels)), amount)
+
+
+class Gauge(_Metric):
+    type = 'gauge'
+
+    def set(self, value, **labels):
+        self.registry.values().set(self._key(self.name, self._labels(labels)), value)
+
+
+class Histogram(_Metric):
+    type = 'histogram'
+
+    def __init__(self, registry, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(registry, name, documentation, labelnames)
+        self.buckets = tuple(buckets) + (float('inf'),)
+
+    def observe(self, value, **labels):
+        labels = self._labels(labels)
+        values = self.registry.values()
+        # Non-cumulative per-bucket counts; made cumulative when rendered
+        for bound in self.buckets:
+            if value <= bound:
+                values.inc(self._key(f'{self.name}_bucket', labels + [('le', _format_float(bound))]))
+                break
+        values.inc(self._key(f'{self.name}_sum', labels), value)
+        values.inc(self._key(f'{self.name}_count', labels))
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+
+class Registry:
+    def __init__(self, directory):
+        self.directory = directory
+        self._metrics = []
+        self._collectors = []
+        self._values = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def values(self):
+        # One file per process, opened lazily so a fork gets its own
+        if self._pid != os.getpid():
+            with self._lock:
+                if self._pid != os.getpid():
+                    os.makedirs(self.directory, exist_ok=True)
+                    self._values = ValueFile(os.path.join(self.directory, f'{os.getpid()}.db'))
+                    self._pid = os.getpid()
+        return self._values
+
+    def _register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self._register(Counter(self, name, documentation, labelnames))
+
+    def gauge(self, name, documentation, labelnames=()):
+        return self._register(Gauge(self, name, documentation, labelnames))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._register(Histogram(self, name, documentation, labelnames, buckets))
+
+    def add_collector(self, name, documentation, collect):
+        # Gauge computed at scrape time by this process: collect() -> float
+        self._collectors.append((name, documentation, collect))
+
+    def _aggregate(self):
+        gauges = {m.name for m in self._metrics if m.type == 'gauge'}
+        totals = {}
+        try:
+            names = os.listdir(self.directory)
+        except FileNotFoundError:
+            names = []
+        for filename in names:
+            stem, ext = os.path.splitext(filename)
+            if ext != '.db' or not stem.isdigit():
+                continue
+            live = None
+            for key, value in read_value_file(os.path.join(self.directory, filename)):
+                sample, labels = json.loads(key)
+                index = (sample, tuple(map(tuple, labels)))
+                if sample in gauges:
+                    # Gauges from exited workers are stale; keep the max of the live ones
+                    if live is None:
+                        live = _pid_alive(int(stem))
+                    if live:
+                        totals[index] = max(totals.get(index, value), value)
+                else:
+                    totals[index] = totals.get(index, 0.0) + value
+        return totals
+
+    def render(self):
+        totals = self._aggregate()
+        lines = []
+        for metric in self._metrics:
+            lines.append(f'# HELP {metric.name} {metric.documentation}')
+            lines.append(f'# TYPE {metric.name} {metric.type}')
+            if metric.type == 'histogram':
+                lines.extend(self._render_histogram(metric, totals))
+                continue
+            sample_name = f'{metric.name}_total' if metric.type == 'counter' else metric.name
+            for (sample, labels), value in sorted(totals.items()):
+                if sample == sample_name:
+                    lines.append(f'{sample}{_format_labels(labels)} {_format_float(value)}')
+        for name, documentation, collect in self._collectors:
+            try:
+                value = collect()
+            except Exception:
+                continue
+            if value is None:
+                continue
+            lines.append(f'# HELP {name} {documentation}')
+            lines.append(f'# TYPE {name} gauge')
+            lines.append(f'{name} {_format_float(value)}')
+        return '\n'.join(lines) + '\n'
+
+    def _render_histogram(self, metric, totals):
+        series = {}
+        for (sample, labels), value in totals.items():
+            if sample == f'{metric.name}_bucket':
+                base = tuple(label for label in labels if label[0] != 'le')
+                le = dict(labels)['le']
+                series.setdefault(base, {}).setdefault('buckets', {})[le] = value
+            elif sample in (f'{metric.name}_sum', f'{metric.name}_count'):
+                series.setdefault(labels, {})[sample] = value
+        lines = []
+        for labels in sorted(series):
+            data = series[labels]
+            cumulative = 0.0
+            for bound in metric.buckets:
+                le = _format_float(bound)
+                cumulative += data.get('buckets', {}).get(le, 0.0)
+                lines.append(f'{metric.name}_bucket{_format_labels(labels + (("le", le),))} {_format_float(cumulative)}')
+            lines.append(f'{metric.name}_sum{_format_labels(labels)} {_format_float(data.get(f"{metric.name}_sum", 0.0))}')
+            lines.append(f'{metric.name}_count{_format_labels(labels)} {_format_float(data.get(f"{metric.name}_count", 0.0))}')
+        return lines
+
+
+def clear_directory(directory):
+    try:
+        names = os.listdir(directory)
+    except FileNotFoundError:
+        return
+    for name in names:
+        if name.endswith('.db'):
+            os.remove(os.path.join(directory, name))
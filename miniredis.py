@@ -0,0 +1,205 @@
+"""In-process stand-in for redis-server, for local testing of RedisStore.
+
+    python miniredis.py [--port 6379]      # then STORAGE_BACKEND=redis
+
+Speaks enough RESP for redis_store.py: PING, AUTH, SELECT, GET, SET (with
+EX/PX/NX/XX), GETDEL, DEL, EXISTS, PTTL, STRLEN, SCAN, DBSIZE and FLUSHDB.
+Keys expire lazily on access, like in Redis. Everything is kept in memory
+in one process and is lost on exit; it is not meant for production.
+
+    server = MiniRedis(port=0).start()   # port 0 picks a free one
+    ... redis://127.0.0.1:{server.port} ...
+    server.stop()
+"""
+import argparse
+import fnmatch
+import socketserver
+import threading
+import time
+
+
+class _Handler(socketserver.StreamRequestHandler):
+    def handle(self):
+        while True:
+            try:
+                args = self._read_command()
+            except (ConnectionError, ValueError):
+                return
+            if args is None:
+                return
+            self.wfile.write(self.server.db.dispatch(args))
+
+    def _read_command(self):
+        line = self.rfile.readline()
+        if not line:
+            return None
+        if not line.startswith(b'*'):
+            # Inline command, as sent by e.g. `printf 'PING\r\n' | nc`
+            return line.split()
+        args = []
+        for _ in range(int(line[1:])):
+            header = self.rfile.readline()
+            length = int(header[1:])
+            args.append(self.rfile.read(length + 2)[:-2])
+        return args
+
+
+def _bulk(value):
+    return b'$-1\r\n' if value is None else b'$%d\r\n%b\r\n' % (len(value), value)
+
+
+def _int(value):
+    return b':%d\r\n' % value
+
+
+def _error(message):
+    return f'-ERR {message}\r\n'.encode()
+
+
+OK = b'+OK\r\n'
+
+
+class Database:
+    def __init__(self):
+        self._data = {}  # key -> (value, expires at in ms or None)
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _now_ms():
+        return int(time.time() * 1000)
+
+    def _live(self, key):
+        entry = self._data.get(key)
+        if entry is not None and entry[1] is not None and entry[1] <= self._now_ms():
+            del self._data[key]
+            return None
+        return entry
+
+    def dispatch(self, args):
+        if not args:
+            return _error('empty command')
+        command = args[0].decode().upper()
+        handler = getattr(self, f'cmd_{command.lower()}', None)
+        if handler is None:
+            return _error(f"unknown command '{command}'")
+        try:
+            with self._lock:
+                return handler(*args[1:])
+        except (TypeError, ValueError, IndexError):
+            return _error(f"wrong arguments for '{command}' command")
+
+    def cmd_ping(self, *args):
+        return _bulk(args[0]) if args else b'+PONG\r\n'
+
+    def cmd_auth(self, *args):
+        return OK
+
+    def cmd_select(self, db):
+        return OK
+
+    def cmd_get(self, key):
+        entry = self._live(key)
+        return _bulk(entry[0] if entry else None)
+
+    def cmd_set(self, key, value, *options):
+        expires = None
+        options = [o.upper() for o in options]
+        if b'NX' in options and self._live(key) is not None:
+            return _bulk(None)
+        if b'XX' in options and self._live(key) is None:
+            return _bulk(None)
+        for unit, scale in ((b'EX', 1000), (b'PX', 1)):
+            if unit in options:
+                expires = self._now_ms() + int(options[options.index(unit) + 1]) * scale
+        self._data[key] = (value, expires)
+        return OK
+
+    def cmd_getdel(self, key):
+        entry = self._live(key)
+        if entry is None:
+            return _bulk(None)
+        del self._data[key]
+        return _bulk(entry[0])
+
+    def cmd_del(self, *keys):
+        removed = 0
+        for key in keys:
+            if self._live(key) is not None:
+                del self._data[key]
+                removed += 1
+        return _int(removed)
+
+    def cmd_exists(self, *keys):
+        return _int(sum(1 for key in keys if self._live(key) is not None))
+
+    def cmd_pttl(self, key):
+        entry = self._live(key)
+        if entry is None:
+            return _int(-2)
+        return _int(-1 if entry[1] is None else entry[1] - self._now_ms())
+
+    def cmd_strlen(self, key):
+        entry = self._live(key)
+        return _int(len(entry[0]) if entry else 0)
+
+    def cmd_scan(self, cursor, *options):
+        # Returns every match in one page, which the SCAN contract allows
+        options = list(options)
+        pattern = b'*'
+        for i, option in enumerate(options):
+            if option.upper() == b'MATCH':
+                pattern = options[i + 1]
+        pattern = pattern.decode()
+        keys = [k for k in list(self._data)
+                if self._live(k) is not None and fnmatch.fnmatchcase(k.decode(), pattern)]
+        return b'*2\r\n' + _bulk(b'0') + b'*%d\r\n' % len(keys) + b''.join(_bulk(k) for k in keys)
+
+    def cmd_dbsize(self):
+        return _int(sum(1 for k in list(self._data) if self._live(k) is not None))
+
+    def cmd_flushdb(self, *args):
+        self._data.clear()
+        return OK
+
+
+class _Server(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class MiniRedis:
+    def __init__(self, host='127.0.0.1', port=6379):
+        self.server = _Server((host, port), _Handler)
+        self.server.db = Database()
+        self.host, self.port = self.server.server_address[:2]
+        self._thread = None
+
+    @property
+    def url(self):
+        return f'redis://{self.host}:{self.port}'
+
+    def start(self):
+        self._thread = threading.Thread(target=self.server.serve_forever, name='miniredis', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Minimal in-memory Redis stand-in for local testing')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=6379)
+    args = parser.parse_args(argv)
+    server = MiniRedis(args.host, args.port)
+    print(f'Listening on {server.url}')
+    try:
+        server.server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,225 @@
+"""Page templates, compiled once at import.
+
+``TemplateRegistry`` compiles each template a single time instead of on every
+request, and pages with no per-request variables are rendered up front into
+``StaticPage`` objects: immutable bytes with a precomputed ETag and
+Content-Length, compressed once with gzip and brotli, so serving them is only
+a matter of picking the variant the client accepts and building the response.
+Styles and scripts are not inlined; templates link to the fingerprinted files
+from assets.py through ``asset_url``.
+
+Static pages carry a strong ETag per encoding and a Last-Modified set to the
+build time (BUILD_TIMESTAMP, or the newest source file), and a matching
+If-None-Match or If-Modified-Since gets a bodiless ``304``. Their
+Cache-Control is PAGE_CACHE_CONTROL, ``no-cache`` by default: browsers keep
+the page but revalidate it, so a deploy shows up immediately.
+"""
+import os
+from datetime import datetime, timezone
+from hashlib import sha256
+
+from flask import Response, request
+from werkzeug.http import http_date, is_resource_modified
+
+from assets import STATIC_DIR
+from compression import add_vary, negotiate_encoding, precompress, variant_etags
+
+HTML_TEMPLATE = '''
+<!DOCTYPE html>
+<html lang="en">
+<head>
+    <meta charset="UTF-8">
+    <meta name="viewport" content="width=device-width, initial-scale=1.0">
+    <title>Secure Secret Sharing</title>
+    <link href="https://fonts.googleapis.com/css2?family=Inter:wght@400;500;600&display=swap" rel="stylesheet">
+    <link rel="stylesheet" href="{{ asset_url('app.css') }}">
+</head>
+<body>
+    <div class="container">
+        <div class="card">
+            <h1>Share a Secret Securely</h1>
+            <div class="input-group">
+                <textarea 
+                    id="secret" 
+                    placeholder="Enter your secret message here..."
+                    maxlength="5000"
+                    aria-label="Secret message"
+                    onkeyup="updateCharCount()"
+                ></textarea>
+                <div id="charCount">0/5000 characters</div>
+                <div id="error" class="error"></div>
+            </div>
+            <div class="controls">
+                <select id="expireTime" aria-label="Expiration time">
+                    <option value="300">5 minutes</option>
+                    <option value="3600">1 hour</option>
+                    <option value="86400">24 hours</option>
+                </select>
+                <button onclick="createSecret()" id="createBtn">Create Secret Link</button>
+            </div>
+            <div id="loading" class="loading">
+                <div class="spinner"></div>
+                <span>Creating secure link...</span>
+            </div>
+            <div id="result" class="result">
+                <strong>Share this link (works only once):</strong>
+                <div id="secretLink" class="link"></div>
+                <button onclick="copyToClipboard()" class="copy-btn">
+                    Copy Link
+                </button>
+            </div>
+        </div>
+    </div>
+
+    <script src="{{ asset_url('index.js') }}"></script>
+</body>
+</html>
+'''
+
+VIEW_TEMPLATE = '''
+<!DOCTYPE html>
+<html lang="en">
+<head>
+    <meta charset="UTF-8">
+    <meta name="viewport" content="width=device-width, initial-scale=1.0">
+    <title>View Secret</title>
+    <link href="https://fonts.googleapis.com/css2?family=Inter:wght@400;500;600&display=swap" rel="stylesheet">
+    <link rel="stylesheet" href="{{ asset_url('app.css') }}">
+</head>
+<body data-claim-mode="{{ 'true' if claim_mode else 'false' }}">
+    <div class="container">
+        <div class="card">
+            <h1>Secret Message</h1>
+            <div id="secretContainer" style="display: none;">
+                <div class="secret-content">{{ secret }}</div>
+                <button onclick="copyToClipboard()">Copy Message</button>
+                <div class="warning">
+                    Note: This message will be destroyed after you leave this page.
+                </div>
+            </div>
+            <div id="viewButtonContainer" class="text-center">
+                <button onclick="viewSecret('{{ token }}')">View Secret</button>
+                <p class="mt-4 text-sm text-gray-600">
+                    Click to view the secret. This can only be done once.
+                </p>
+            </div>
+        </div>
+    </div>
+
+    <script src="{{ asset_url('view.js') }}"></script>
+</body>
+</html>
+'''
+
+# Shared by the expired / not found / error pages, which differ only in text
+ERROR_TEMPLATE = '''
+<!DOCTYPE html>
+<html lang="en">
+<head>
+    <meta charset="UTF-8">
+    <meta name="viewport" content="width=device-width, initial-scale=1.0">
+    <title>{{ title }}</title>
+    <link href="https://fonts.googleapis.com/css2?family=Inter:wght@400;500;600&display=swap" rel="stylesheet">
+    <link rel="stylesheet" href="{{ asset_url('app.css') }}">
+</head>
+<body>
+    <div class="container">
+        <div class="card centered">
+            <div class="error-message">{{ message }}</div>
+            <a href="/" class="home-link">{{ link_text }}</a>
+        </div>
+    </div>
+</body>
+</html>
+'''
+
+# name: (status, title, message, link text)
+ERROR_PAGES = {
+    'expired': (404, 'Secret Expired', 'This secret has expired', 'Create a new secret'),
+    'secret_not_found': (404, 'Secret Not Found', 'Secret not found or already viewed', 'Create a new secret'),
+    'view_error': (500, 'Error', 'An error occurred', 'Try creating a new secret'),
+    'page_not_found': (404, 'Page Not Found', 'Page not found', 'Go to homepage'),
+    'server_error': (500, 'Server Error', 'An unexpected error occurred', 'Go to homepage'),
+}
+
+
+def build_time():
+    """When the pages were built: BUILD_TIMESTAMP (Unix seconds), or the newest source file."""
+    stamp = os.environ.get('BUILD_TIMESTAMP')
+    if not stamp:
+        paths = [__file__] + [os.path.join(STATIC_DIR, name) for name in os.listdir(STATIC_DIR)]
+        stamp = max(os.path.getmtime(path) for path in paths)
+    # HTTP dates have one-second resolution
+    return datetime.fromtimestamp(int(float(stamp)), timezone.utc)
+
+
+def is_current(etag, last_modified=None):
+    """True when the client's cached copy (If-None-Match / If-Modified-Since) is still valid."""
+    return (request.method in ('GET', 'HEAD')
+            and not is_resource_modified(request.environ, etag=etag, last_modified=last_modified))
+
+
+class StaticPage:
+    __slots__ = ('body', 'status', 'variants', 'etags', 'last_modified', 'headers')
+
+    def __init__(self, body, status=200, last_modified=None, cache_control='no-cache'):
+        self.body = body
+        self.status = status
+        # encoding (None for identity) -> body
+        self.variants = precompress(body)
+        self.etags = variant_etags(sha256(body).hexdigest()[:32], self.variants)
+        self.last_modified = last_modified or build_time()
+        self.headers = {'Last-Modified': http_date(self.last_modified), 'Cache-Control': cache_control}
+
+    def response(self):
+        encoding = negotiate_encoding(request.headers.get('Accept-Encoding'), self.variants)
+        etag = self.etags[encoding]
+        # Conditional requests only make sense for the 200 pages
+        if self.status == 200 and is_current(etag, self.last_modified):
+            response = Response(status=304, headers={'ETag': etag, **self.headers})
+        else:
+            body = self.variants[encoding]
+            response = Response(
+                body,
+                status=self.status,
+                headers={'ETag': etag, 'Content-Length': str(len(body)), **self.headers},
+                mimetype='text/html',
+            )
+            if encoding:
+                response.headers['Content-Encoding'] = encoding
+        add_vary(response)
+        return response
+
+
+class TemplateRegistry:
+    def __init__(self, jinja_env, cache_control='no-cache'):
+        self.jinja_env = jinja_env
+        self.cache_control = cache_control
+        self.built_at = build_time()
+        self._templates = {}
+        self._pages = {}
+
+    def register(self, name, source):
+        self._templates[name] = self.jinja_env.from_string(source)
+
+    def render(self, name, **context):
+        return self._templates[name].render(**context)
+
+    def prerender(self, name, template=None, status=200, **context):
+        body = self.render(template or name, **context).encode()
+        self._pages[name] = StaticPage(body, status, self.built_at, self.cache_control)
+
+    def page(self, name):
+        return self._pages[name]
+
+
+def build_registry(jinja_env, assets, cache_control='no-cache'):
+    jinja_env.globals['asset_url'] = assets.url
+    registry = TemplateRegistry(jinja_env, cache_control)
+    registry.register('index', HTML_TEMPLATE)
+    registry.register('view', VIEW_TEMPLATE)
+    registry.register('error', ERROR_TEMPLATE)
+    registry.prerender('index')
+    for name, (status, title, message, link_text) in ERROR_PAGES.items():
+        registry.prerender(name, 'error', status, title=title, message=message, link_text=link_text)
+    return registry
@@ -0,0 +1,90 @@
+"""Optional compression of secret plaintext before it is encrypted.
+
+Config files, JSON blobs and PEM bundles often shrink 3-5x, and ciphertext
+does not compress at all, so this is the only point where it can be done.
+PAYLOAD_COMPRESSION selects the codec:
+
+    none    store plaintext as is (default)
+    zlib    zlib (PAYLOAD_COMPRESSION_LEVEL, default 6)
+    zstd    Zstandard, needs the ``zstandard`` package (level default 3)
+    auto    zstd when ``zstandard`` is installed, zlib otherwise
+
+Only payloads of at least PAYLOAD_COMPRESSION_MIN_BYTES are tried, and the
+compressed form is kept only when it is actually smaller; the record header
+says which codec was used (see records.py), so records written with any
+setting stay readable under any other.
+
+Compression makes the stored size depend on the content, so a ciphertext's
+length says how compressible the secret was. Nothing attacker-controlled is
+ever mixed into a secret before it is compressed, which is what CRIME-style
+attacks need, but leave this off if even that much must not leak.
+"""
+import os
+import zlib
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+CODECS = ('zlib', 'zstd')
+DEFAULT_LEVELS = {'zlib': 6, 'zstd': 3}
+# Far above any secret the app accepts; stops a corrupt record from inflating without bound
+MAX_UNPACKED_BYTES = 16 * 1024 * 1024
+
+
+def available_codecs():
+    return CODECS if zstandard is not None else ('zlib',)
+
+
+class PayloadCompressor:
+    def __init__(self, codec=None, min_bytes=512, level=None):
+        if codec == 'zstd' and zstandard is None:
+            raise ValueError('PAYLOAD_COMPRESSION=zstd needs the zstandard package')
+        if codec not in (None,) + CODECS:
+            raise ValueError(f'Unknown payload compression: {codec!r}')
+        self.codec = codec
+        self.min_bytes = min_bytes
+        self.level = level if level is not None else DEFAULT_LEVELS.get(codec)
+
+    def pack(self, data):
+        """Returns (payload, codec), codec None when data is stored as is."""
+        if self.codec is None or len(data) < self.min_bytes:
+            return data, None
+        packed = compress(data, self.codec, self.level)
+        if len(packed) >= len(data):
+            return data, None
+        return packed, self.codec
+
+
+def compress(data, codec, level=None):
+    level = level if level is not None else DEFAULT_LEVELS[codec]
+    if codec == 'zstd':
+        return zstandard.ZstdCompressor(level=level).compress(data)
+    return zlib.compress(data, level)
+
+
+def unpack(data, codec, max_bytes=MAX_UNPACKED_BYTES):
+    if codec is None:
+        return data
+    if codec == 'zstd':
+        if zstandard is None:
+            raise ValueError('Record is zstd-compressed but the zstandard package is not installed')
+        return zstandard.ZstdDecompressor().decompress(data, max_output_size=max_bytes)
+    decompressor = zlib.decompressobj()
+    out = decompressor.decompress(data, max_bytes)
+    if decompressor.unconsumed_tail:
+        raise ValueError(f'Compressed payload inflates past {max_bytes} bytes')
+    return out
+
+
+def from_environ():
+    codec = os.environ.get('PAYLOAD_COMPRESSION', 'none')
+    if codec == 'auto':
+        codec = available_codecs()[-1]
+    level = os.environ.get('PAYLOAD_COMPRESSION_LEVEL')
+    return PayloadCompressor(
+        None if codec == 'none' else codec,
+        int(os.environ.get('PAYLOAD_COMPRESSION_MIN_BYTES', 512)),
+        int(level) if level else None,
+    )
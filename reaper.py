@@ -0,0 +1,176 @@
+"""Background deletion of expired secrets.
+
+Without this, an expired secret is only removed when someone requests it. The
+reaper keeps a min-heap of ``(expires_at, token)`` built from the store and
+deletes entries as they come due, in throttled batches.
+
+Every worker starts a reaper thread, but only the one holding an exclusive
+lock on ``lock_path`` does any work; the others keep retrying the lock so a
+new worker takes over if the elected one exits. Secrets created in other
+workers are picked up by the periodic rescan of the store, so they are
+reclaimed at most ``rescan_interval`` seconds late.
+
+Stores that can find expired records through an index (SQLite, the bucketed
+file layout) mostly skip the heap: the reaper calls ``store.sweep`` every
+``interval`` seconds, and only tracks the records the index cannot see
+(``iter_unindexed_expiries``, e.g. sharded files left from before a switch to
+the bucketed layout), scanned once when the reaper starts. Other stores (e.g. the large-secret streams) are
+cleaned through ``add_sweeper`` callbacks run on the same schedule.
+
+``stats()['lag_seconds']`` is how late the oldest expired record was when a
+pass reached it: the oldest due heap entry, or the oldest expiry a sweep
+removed, measured before anything is deleted. Secrets from other workers only
+enter the heap at a rescan, so for heap stores this includes the wait for it,
+and entries a stopped pass left behind keep counting until they are reaped.
+"""
+import fcntl
+import heapq
+import logging
+import os
+import threading
+import time
+
+from storage import merge_sweeps
+
+
+class ExpiryReaper:
+    def __init__(self, store, lock_path, interval=5.0, batch_size=500,
+                 batch_pause=0.05, rescan_interval=300.0, on_cycle=None):
+        self.store = store
+        self.lock_path = lock_path
+        self.interval = interval
+        self.batch_size = batch_size
+        self.batch_pause = batch_pause
+        self.rescan_interval = rescan_interval
+        # on_cycle(removed, stats) after every pass, e.g. to export metrics
+        self.on_cycle = on_cycle
+        self.elected = False
+        self.reclaimed = 0
+        self.last_rescan = None
+        # Age of the oldest expired record when the last pass started on it
+        self.last_lag = 0.0
+        self._heap = []
+        self._sweepers = []
+        self._lock = threading.Lock()
+        self._lock_file = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='expiry-reaper', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        self._release()
+
+    def add_sweeper(self, sweep):
+        # sweep(now) -> number of records removed
+        self._sweepers.append(sweep)
+
+    def track(self, token, expires_at):
+        # Called for secrets created in this process so they don't wait for a rescan
+        if self.elected and not self.store.indexed_expiry:
+            with self._lock:
+                heapq.heappush(self._heap, (expires_at, token))
+
+    def stats(self, now=None):
+        now = time.time() if now is None else now
+        with self._lock:
+            oldest = self._heap[0][0] if self._heap else None
+            pending = len(self._heap)
+        # Expired entries still in the heap (a pass cut short) keep ageing
+        waiting = now - oldest if oldest is not None and oldest < now else 0.0
+        return {
+            'elected': self.elected,
+            'pending': pending,
+            'reclaimed': self.reclaimed,
+            'lag_seconds': max(self.last_lag, waiting),
+            'last_rescan': self.last_rescan,
+        }
+
+    def _try_elect(self):
+        lock_file = open(self.lock_path, 'a')
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            lock_file.close()
+            return False
+        self._lock_file = lock_file
+        self.elected = True
+        logging.info(f'Expiry reaper elected in worker {os.getpid()}')
+        return True
+
+    def _release(self):
+        if self._lock_file is not None:
+            self._lock_file.close()
+            self._lock_file = None
+        self.elected = False
+
+    def rescan(self):
+        # Indexed stores only need tracking for what sweep() cannot reach;
+        # that set does not grow, so it is scanned just once
+        if self.store.indexed_expiry:
+            heap = list(self.store.iter_unindexed_expiries())
+        else:
+            heap = list(self.store.iter_expiries())
+        heapq.heapify(heap)
+        with self._lock:
+            self._heap = heap
+        self.last_rescan = time.time()
+
+    def reap(self, now=None):
+        """Delete every entry due by now; returns how many records were removed."""
+        now = time.time() if now is None else now
+        sweeps = [sweep(now) for sweep in self._sweepers]
+        if self.store.indexed_expiry:
+            sweeps.append(self.store.sweep(now))
+        with self._lock:
+            if self._heap and self._heap[0][0] < now:
+                sweeps.append((0, self._heap[0][0]))
+        removed, oldest = merge_sweeps(sweeps)
+        self.last_lag = now - oldest if oldest is not None else 0.0
+        while not self._stop.is_set():
+            with self._lock:
+                batch = []
+                while self._heap and self._heap[0][0] < now and len(batch) < self.batch_size:
+                    batch.append(heapq.heappop(self._heap)[1])
+            if not batch:
+                break
+            for token in batch:
+                if self.store.delete(token):
+                    removed += 1
+            # Leave the disk to request traffic between batches
+            if len(batch) == self.batch_size:
+                time.sleep(self.batch_pause)
+        self.reclaimed += removed
+        return removed
+
+    def _run(self):
+        while not self._stop.is_set():
+            if not self.elected and not self._try_elect():
+                self._stop.wait(self.interval)
+                continue
+            try:
+                if self.last_rescan is None:
+                    self.rescan()
+                elif not self.store.indexed_expiry and time.time() - self.last_rescan >= self.rescan_interval:
+                    self.rescan()
+                removed = self.reap()
+                stats = self.stats()
+                if self.on_cycle is not None:
+                    self.on_cycle(removed, stats)
+                if removed:
+                    logging.info(
+                        f'Expiry reaper reclaimed {removed} secret(s) '
+                        f'(total {stats["reclaimed"]}, pending {stats["pending"]}, '
+                        f'lag {stats["lag_seconds"]:.1f}s)'
+                    )
+            except Exception as e:
+                logging.error(f'Expiry reaper failed: {str(e)}')
+            self._stop.wait(self.interval)
@@ -0,0 +1,98 @@
+"""Serialization of stored secret records.
+
+A record is a dict with ``secret`` (the encrypted payload: nonce, ciphertext
+and tag as raw bytes), ``expires_at`` (a POSIX timestamp), ``key_id`` and
+``alg`` (how it was encrypted) and ``compression`` (the codec the plaintext
+was compressed with before encryption, or None; see payloads.py). Storage
+backends persist records as the bytes returned by ``encode_record``, a fixed
+little-endian header followed by the payload:
+
+    magic    4s  b'SSRB'
+    version  B   1
+    alg      B   index into ALGORITHMS
+    flags    H   bits 0-1: compression (0 none, 1 zlib, 2 zstd); others 0
+    key_id   I
+    expires  d
+    length   I   payload bytes that follow
+
+so a record is read with one ``read`` and ``decode_record`` hands the payload
+out as a memoryview slice of that buffer, without copying or base64.
+
+Records written before this format are JSON objects with a base64 ``secret``
+(and, older still, no ``key_id``/``alg``). ``decode_record`` tells the two
+apart by the magic and returns the same shape for both; ``python storage.py
+convert-records`` rewrites the old ones offline.
+"""
+import base64
+import json
+import os
+import struct
+
+from crypto_engine import LEGACY_ALG
+from keystore import LEGACY_KEY_ID
+
+MAGIC = b'SSRB'
+VERSION = 1
+HEADER = struct.Struct('<4sBBHIdI')
+# Record alg byte -> crypto engine name; only ever append to this
+ALGORITHMS = ('xor', 'aes-gcm', 'chacha20-poly1305')
+_ALGORITHM_IDS = {name: i for i, name in enumerate(ALGORITHMS)}
+# Flag bits -> payload compression codec
+COMPRESSIONS = (None, 'zlib', 'zstd')
+_COMPRESSION_FLAGS = {name: i for i, name in enumerate(COMPRESSIONS)}
+_COMPRESSION_MASK = 0x3
+
+
+def encode_record(record):
+    secret = record['secret']
+    header = HEADER.pack(
+        MAGIC, VERSION, _ALGORITHM_IDS[record['alg']], _COMPRESSION_FLAGS[record.get('compression')],
+        record['key_id'], record['expires_at'], len(secret),
+    )
+    return header + secret
+
+
+def is_legacy(data):
+    return bytes(data[:len(MAGIC)]) != MAGIC
+
+
+def decode_record(data):
+    if is_legacy(data):
+        return _decode_json(data)
+    if len(data) < HEADER.size:
+        raise ValueError('Truncated record header')
+    magic, version, alg, flags, key_id, expires_at, length = HEADER.unpack_from(data)
+    if version != VERSION:
+        raise ValueError(f'Unsupported record version {version}')
+    compression = flags & _COMPRESSION_MASK
+    if flags & ~_COMPRESSION_MASK or compression >= len(COMPRESSIONS):
+        raise ValueError(f'Unsupported record flags {flags:#x}')
+    end = HEADER.size + length
+    if len(data) < end:
+        raise ValueError('Truncated record')
+    return {
+        'secret': memoryview(data)[HEADER.size:end],
+        'key_id': key_id,
+        'alg': ALGORITHMS[alg],
+        'compression': COMPRESSIONS[compression],
+        'expires_at': expires_at,
+    }
+
+
+def _decode_json(data):
+    record = json.loads(data)
+    record['secret'] = base64.b64decode(record['secret'])
+    record.setdefault('key_id', LEGACY_KEY_ID)
+    record.setdefault('alg', LEGACY_ALG)
+    record.setdefault('compression', None)
+    return record
+
+
+def read_record(f):
+    """Read a whole encoded record from an unbuffered binary file with one read()."""
+    # Sized up front: readall() would issue a second read() just to see EOF
+    return f.read(os.fstat(f.fileno()).st_size)
+
+
+def is_expired(record, now):
+    return now > record['expires_at']
@@ -0,0 +1,267 @@
+"""Redis storage backend (STORAGE_BACKEND=redis).
+
+Lets several nodes behind a load balancer share secrets without a shared
+disk. Records are stored under ``REDIS_KEY_PREFIX + token`` with a native
+key TTL taken from ``expires_at``, so Redis expires them itself and the
+reaper has nothing to sweep; ``take`` is a single GETDEL (Redis 6.2+), so
+of several nodes racing for a secret exactly one gets it.
+
+REDIS_URL is ``redis://[[user]:password@]host[:port][/db]``; with a user
+(Redis 6 ACLs) connections send ``AUTH user password``. Each worker process
+keeps a small pool (REDIS_POOL_SIZE) of persistent connections speaking
+RESP directly; there is no client library dependency. For local testing
+without a redis-server, ``python miniredis.py`` runs a compatible stand-in.
+
+Every node has to decrypt what any other node encrypted, so the keys must be
+shared too: set KEYS_DIR or SECRET_KEYS (see keystore.py) to the same keys on
+every node. With only the per-node key in ``secrets/.encryption_key``, a
+secret created on one node could not be opened on another, and would already
+be gone from Redis by then; app.py refuses to start that way.
+
+For the same reason HOT_STORE (a per-host memory tier) cannot be combined
+with this backend. Large secrets uploaded through /create/stream are files,
+not Redis keys: they are only accepted when STREAMS_PATH points at a
+directory every node mounts.
+"""
+import os
+import queue
+import socket
+import threading
+import time
+from contextlib import contextmanager
+from urllib.parse import unquote, urlsplit
+
+from records import decode_record, encode_record
+from storage import SecretStore, encode_items
+
+
+class RedisError(Exception):
+    pass
+
+
+class RedisConnection:
+    def __init__(self, host, port, timeout=5.0, password=None, db=0, username=None):
+        self.sock = socket.create_connection((host, port), timeout=timeout)
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.reader = self.sock.makefile('rb')
+        if password and username:
+            # Redis 6 ACL user; the one-argument form only authenticates 'default'
+            self.execute('AUTH', username, password)
+        elif password:
+            self.execute('AUTH', password)
+        if db:
+            self.execute('SELECT', db)
+
+    @staticmethod
+    def _encode(args):
+        parts = [b'*%d\r\n' % len(args)]
+        for arg in args:
+            if not isinstance(arg, bytes):
+                arg = str(arg).encode()
+            parts.append(b'$%d\r\n%b\r\n' % (len(arg), arg))
+        return b''.join(parts)
+
+    def _read_reply(self):
+        line = self.reader.readline()
+        if not line.endswith(b'\r\n'):
+            raise ConnectionError('Connection closed by Redis')
+        kind, rest = line[:1], line[1:-2]
+        if kind == b'+':
+            return rest
+        if kind == b'-':
+            return RedisError(rest.decode(errors='replace'))
+        if kind == b':':
+            return int(rest)
+        if kind == b'$':
+            length = int(rest)
+            if length < 0:
+                return None
+            data = self.reader.read(length + 2)
+            if len(data) != length + 2:
+                raise ConnectionError('Connection closed by Redis')
+            return data[:-2]
+        if kind == b'*':
+            length = int(rest)
+            return None if length < 0 else [self._read_reply() for _ in range(length)]
+        raise ConnectionError(f'Unexpected reply from Redis: {line[:32]!r}')
+
+    def execute(self, *args):
+        self.sock.sendall(self._encode(args))
+        reply = self._read_reply()
+        if isinstance(reply, RedisError):
+            raise reply
+        return reply
+
+    def pipeline(self, commands):
+        # One write for every command, then one reply each; errors are returned, not raised
+        self.sock.sendall(b''.join(self._encode(args) for args in commands))
+        return [self._read_reply() for _ in commands]
+
+    def close(self):
+        try:
+            self.reader.close()
+        finally:
+            self.sock.close()
+
+
+class ConnectionPool:
+    def __init__(self, host, port, size=8, timeout=5.0, password=None, db=0, username=None):
+        self.host = host
+        self.port = port
+        self.size = size
+        self.timeout = timeout
+        self.password = password
+        self.db = db
+        self.username = username
+        self._pid = None
+
+    def _process_state(self):
+        # Sockets inherited across fork() would be shared with the parent
+        if self._pid != os.getpid():
+            self._idle = queue.LifoQueue()
+            self._slots = threading.BoundedSemaphore(self.size)
+            self._pid = os.getpid()
+
+    @contextmanager
+    def connection(self):
+        self._process_state()
+        idle, slots = self._idle, self._slots
+        if not slots.acquire(timeout=self.timeout):
+            raise ConnectionError('Timed out waiting for a Redis connection')
+        try:
+            try:
+                conn = idle.get_nowait()
+            except queue.Empty:
+                conn = RedisConnection(self.host, self.port, self.timeout, self.password, self.db, self.username)
+            try:
+                yield conn
+            except RedisError:
+                idle.put(conn)
+                raise
+            except BaseException:
+                # The connection may be mid-reply; never hand it out again
+                conn.close()
+                raise
+            idle.put(conn)
+        finally:
+            slots.release()
+
+    def close(self):
+        if self._pid == os.getpid():
+            while True:
+                try:
+                    self._idle.get_nowait().close()
+                except queue.Empty:
+                    break
+        self._pid = None
+
+
+def pool_from_url(url, size=8, timeout=5.0):
+    parts = urlsplit(url)
+    if parts.scheme != 'redis':
+        raise ValueError(f'Unsupported REDIS_URL scheme: {parts.scheme!r}')
+    db = int(parts.path.lstrip('/') or 0)
+    password = unquote(parts.password) if parts.password else None
+    username = unquote(parts.username) if parts.username else None
+    return ConnectionPool(parts.hostname or 'localhost', parts.port or 6379, size, timeout, password, db, username)
+
+
+class RedisStore(SecretStore):
+    name = 'redis'
+    # Redis expires keys on its own; sweep() has nothing to do
+    indexed_expiry = True
+    shared = True
+
+    def __init__(self, pool, prefix='secret:'):
+        self.pool = pool
+        self.prefix = prefix
+
+    def _key(self, token):
+        return f'{self.prefix}{token}'
+
+    @staticmethod
+    def _ttl_ms(record):
+        # Already expired records still get stored, briefly, like on disk
+        return max(1, int((record['expires_at'] - time.time()) * 1000))
+
+    def _call(self, *args, retry=True):
+        try:
+            with self.pool.connection() as conn:
+                return conn.execute(*args)
+        except OSError:
+            # Most likely a pooled connection the server has since closed
+            if not retry:
+                raise
+        with self.pool.connection() as conn:
+            return conn.execute(*args)
+
+    def put(self, token, record):
+        self._call('SET', self._key(token), encode_record(record), 'PX', self._ttl_ms(record))
+
+    def put_many(self, items):
+        flags, encoded = encode_items(items)
+        if not encoded:
+            return flags
+        try:
+            with self.pool.connection() as conn:
+                replies = conn.pipeline([
+                    ('SET', self._key(token), data, 'PX', self._ttl_ms(record))
+                    for _, token, record, data in encoded
+                ])
+        except OSError:
+            # Some SETs may have landed; they expire with their TTL, unreferenced
+            return [False] * len(items)
+        for (i, *_), reply in zip(encoded, replies):
+            flags[i] = not isinstance(reply, RedisError)
+        return flags
+
+    def get(self, token):
+        data = self._call('GET', self._key(token))
+        return decode_record(data) if data is not None else None
+
+    def take(self, token):
+        # Not retried: the first GETDEL may have taken the record before the
+        # connection dropped, and a retry would then report it missing
+        data = self._call('GETDEL', self._key(token), retry=False)
+        return decode_record(data) if data is not None else None
+
+    def delete(self, token):
+        # Not retried, like take: a DEL that landed before the connection
+        # dropped would make the retry report the record missing
+        return self._call('DEL', self._key(token), retry=False) > 0
+
+    def sweep(self, now=None):
+        return 0, None
+
+    def _scan(self):
+        cursor = b'0'
+        while True:
+            cursor, keys = self._call('SCAN', cursor, 'MATCH', f'{self.prefix}*', 'COUNT', 1000)
+            if keys:
+                yield keys
+            if cursor == b'0':
+                return
+
+    def iter_expiries(self):
+        now = time.time()
+        for keys in self._scan():
+            with self.pool.connection() as conn:
+                ttls = conn.pipeline([('PTTL', key) for key in keys])
+            for key, ttl in zip(keys, ttls):
+                if isinstance(ttl, int) and ttl >= 0:
+                    yield now + ttl / 1000, key.decode()[len(self.prefix):]
+
+    def stats(self):
+        count = size = 0
+        for keys in self._scan():
+            with self.pool.connection() as conn:
+                lengths = conn.pipeline([('STRLEN', key) for key in keys])
+            count += len(keys)
+            size += sum(n for n in lengths if isinstance(n, int))
+        return count, size
+
+    def close(self):
+        self.pool.close()
+
+    def detach(self):
+        self.close()
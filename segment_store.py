@@ -0,0 +1,420 @@
+"""Append-only segment log storage backend (STORAGE_BACKEND=segment).
+
+Instead of one file per secret, records are appended to segment files under
+``SECRETS_DIR/segments/`` and found through an in-memory index of
+token -> (segment, offset, length, expires_at). A create is one sequential
+append, a read is one ``pread``, and a consume or expiry appends a small
+tombstone, so no request creates or unlinks a file.
+
+Each entry is
+
+    header   kind (put/tombstone), token length, data length, expires_at, crc32
+    token
+    data     the encoded record (empty for tombstones)
+
+Only the newest segment is appended to; it is sealed and a new one started
+once it passes SEGMENT_BYTES. The ``MANIFEST`` file names the current file
+of every segment and is replaced atomically whenever that set changes.
+
+Every worker keeps its own index. Appends are serialized across processes
+by an flock on ``segments/.lock``, and before each operation a worker
+replays whatever other workers appended since it last looked (one fstat
+when nothing changed), so a secret consumed in one worker is gone in all.
+
+An append that only partly reaches the file (ENOSPC) is truncated away and
+reported as failed. A writer killed mid-append leaves a torn tail that
+replay stops at; the next worker to take the lock cuts it off before
+appending, so later entries never land behind it where replay cannot reach.
+
+The compactor runs from ``sweep()``, i.e. in the elected reaper. It rewrites
+a sealed segment whose live bytes have dropped below SEGMENT_COMPACT_RATIO
+into a new file holding only its live records, at the same position in the
+log, then swaps it in through the manifest. Tombstones are kept only until
+the record they delete expires; replay never indexes an expired put, so a
+put left in an older segment stays dead once its tombstone is gone.
+"""
+import fcntl
+import json
+import os
+import struct
+import threading
+import time
+import zlib
+
+from records import decode_record, encode_record
+from storage import SecretStore, encode_items
+
+MANIFEST = 'MANIFEST'
+LOCK_FILE = '.lock'
+# kind, token length, data length, expires_at, crc32(token + data)
+ENTRY = struct.Struct('>BBIdI')
+PUT, TOMBSTONE = 1, 2
+READ_SIZE = 1024 * 1024
+
+
+def _segment_name(number, generation=0):
+    return f'{number:08d}.seg' if not generation else f'{number:08d}.{generation}.seg'
+
+
+class SegmentStore(SecretStore):
+    name = 'segment'
+    # sweep() walks the in-memory index, never the segment files
+    indexed_expiry = True
+
+    def __init__(self, root, segment_bytes=64 * 1024 * 1024, compact_ratio=0.5):
+        self.root = root
+        self.segment_bytes = segment_bytes
+        self.compact_ratio = compact_ratio
+        self.manifest_path = os.path.join(root, MANIFEST)
+        os.makedirs(root, exist_ok=True)
+        self._pid = None
+        self._reset()
+        with self._locked():
+            if not os.path.exists(self.manifest_path):
+                self._write_manifest(0, {1: _segment_name(1)})
+                open(os.path.join(root, _segment_name(1)), 'ab').close()
+            self._sync(repair=True)
+
+    def _reset(self):
+        self._index = {}
+        self._files = {}     # segment number -> file name
+        self._fds = {}       # segment number -> read/append fd
+        self._positions = {}  # segment number -> bytes replayed
+        self._live = {}      # segment number -> bytes of live entries
+        self._sealed = set()  # segments replayed to the end and no longer appended to
+        self._generation = None
+        self._manifest_stamp = None
+
+    def _process_state(self):
+        # flock belongs to the open file description, which fork() shares,
+        # so every process opens its own lock file (and builds its own lock)
+        if self._pid != os.getpid():
+            self._mutex = threading.RLock()
+            self._lock_fd = os.open(os.path.join(self.root, LOCK_FILE), os.O_RDWR | os.O_CREAT, 0o600)
+            self._pid = os.getpid()
+
+    def _locked(self):
+        self._process_state()
+        return _FileLock(self._mutex, self._lock_fd)
+
+    # Manifest
+
+    def _write_manifest(self, generation, files):
+        data = json.dumps({'generation': generation, 'segments': {str(n): f for n, f in files.items()}})
+        tmp = f'{self.manifest_path}.{os.getpid()}.tmp'
+        with open(tmp, 'w') as f:
+            f.write(data)
+        os.replace(tmp, self.manifest_path)
+
+    def _load_manifest(self):
+        st = os.stat(self.manifest_path)
+        stamp = (st.st_ino, st.st_mtime_ns, st.st_size)
+        if stamp == self._manifest_stamp:
+            return
+        with open(self.manifest_path) as f:
+            manifest = json.load(f)
+        files = {int(n): name for n, name in manifest['segments'].items()}
+        if any(files.get(n) != name for n, name in self._files.items()):
+            # A segment was compacted or dropped. Its entries must be replayed
+            # in log order relative to the later segments' tombstones, so the
+            # index is rebuilt from scratch; compaction is rare enough.
+            for fd in self._fds.values():
+                os.close(fd)
+            self._reset()
+        for number, name in files.items():
+            if number not in self._fds:
+                self._fds[number] = os.open(os.path.join(self.root, name), os.O_RDWR | os.O_APPEND)
+                self._positions[number] = 0
+                self._live[number] = 0
+        self._files = files
+        self._generation = manifest['generation']
+        self._manifest_stamp = stamp
+
+    # Replay
+
+    def _sync(self, repair=False):
+        """Catch up with the manifest and with entries other workers appended.
+
+        ``repair`` cuts off a torn tail of the active segment; only callers
+        holding the lock may pass it.
+        """
+        self._load_manifest()
+        active = max(self._files)
+        for number in sorted(self._files):
+            if number in self._sealed:
+                continue
+            position = self._positions[number]
+            end = os.fstat(self._fds[number]).st_size
+            if end > position:
+                good = self._replay(number, position, end)
+                if good < end and repair and number == active:
+                    # A torn append from a crashed writer; we hold the lock
+                    os.ftruncate(self._fds[number], good)
+            if number != active:
+                self._sealed.add(number)
+
+    def _replay(self, number, position, end):
+        fd = self._fds[number]
+        buffer = b''
+        base = position
+        now = time.time()
+        while position < end or buffer:
+            if position < end:
+                buffer += os.pread(fd, min(READ_SIZE, end - position), position)
+                position = min(end, position + READ_SIZE)
+            offset = 0
+            while len(buffer) - offset >= ENTRY.size:
+                kind, token_len, data_len, expires_at, crc = ENTRY.unpack_from(buffer, offset)
+                size = ENTRY.size + token_len + data_len
+                if len(buffer) - offset < size:
+                    break
+                body = buffer[offset + ENTRY.size:offset + size]
+                if kind not in (PUT, TOMBSTONE) or zlib.crc32(body) != crc:
+                    # Torn or corrupt tail: stop here and keep this position
+                    self._positions[number] = base + offset
+                    return base + offset
+                token = body[:token_len].decode()
+                self._apply(number, base + offset, kind, token, data_len, expires_at, size, now)
+                offset += size
+            buffer = buffer[offset:]
+            base += offset
+            if position >= end:
+                break
+        self._positions[number] = base
+        return base
+
+    def _apply(self, number, offset, kind, token, data_len, expires_at, size, now):
+        previous = self._index.pop(token, None)
+        if previous is not None:
+            self._live[previous[0]] -= previous[4]
+        # A put that has already expired counts as swept. Compaction drops
+        # expired tombstones even while an older segment still holds the put
+        # they shadow, so replaying it would bring a consumed secret back.
+        if kind == PUT and expires_at >= now:
+            self._index[token] = (number, offset + size - data_len, data_len, expires_at, size)
+            self._live[number] += size
+
+    # Writing
+
+    def _append(self, entries):
+        # entries: [(kind, token, data, expires_at)]; caller holds the lock
+        chunks = []
+        for kind, token, data, expires_at in entries:
+            body = token.encode() + data
+            chunks.append(ENTRY.pack(kind, len(body) - len(data), len(data), expires_at, zlib.crc32(body)) + body)
+        payload = b''.join(chunks)
+        active = max(self._files)
+        if self._positions[active] and self._positions[active] + len(payload) > self.segment_bytes:
+            active = self._roll()
+        position = self._positions[active]
+        try:
+            written = os.write(self._fds[active], payload)
+            if written != len(payload):
+                raise OSError(f'Short write to segment {active}: {written} of {len(payload)} bytes')
+        except BaseException:
+            # Never leave a partial entry behind for the next append to follow
+            os.ftruncate(self._fds[active], position)
+            raise
+        self._replay(active, position, position + len(payload))
+
+    def _roll(self):
+        number = max(self._files) + 1
+        open(os.path.join(self.root, _segment_name(number)), 'ab').close()
+        self._write_manifest(self._generation + 1, {**self._files, number: _segment_name(number)})
+        self._load_manifest()
+        return number
+
+    def _read(self, entry):
+        number, offset, length = entry[:3]
+        return os.pread(self._fds[number], length, offset)
+
+    def put(self, token, record):
+        self._put_entries([(PUT, token, encode_record(record), record['expires_at'])])
+
+    def put_many(self, items):
+        flags, encoded = encode_items(items)
+        entries = [(PUT, token, data, record['expires_at']) for _, token, record, data in encoded]
+        if not entries:
+            return flags
+        try:
+            self._put_entries(entries)
+        except OSError:
+            # One append: none of them were stored
+            return [False] * len(items)
+        return flags
+
+    def _put_entries(self, entries):
+        with self._locked():
+            self._sync(repair=True)
+            self._append(entries)
+
+    def get(self, token):
+        with self._mutex_synced():
+            entry = self._index.get(token)
+            if entry is None:
+                return None
+            data = self._read(entry)
+        return decode_record(data)
+
+    def _mutex_synced(self):
+        # Reads need no flock: they only ever replay what is already written
+        self._process_state()
+        return _Synced(self)
+
+    def take(self, token):
+        with self._locked():
+            self._sync(repair=True)
+            entry = self._index.get(token)
+            if entry is None:
+                return None
+            data = self._read(entry)
+            self._append([(TOMBSTONE, token, b'', entry[3])])
+        return decode_record(data)
+
+    def delete(self, token):
+        with self._locked():
+            self._sync(repair=True)
+            entry = self._index.get(token)
+            if entry is None:
+                return False
+            self._append([(TOMBSTONE, token, b'', entry[3])])
+        return True
+
+    def sweep(self, now=None):
+        now = time.time() if now is None else now
+        with self._locked():
+            self._sync(repair=True)
+            expired = [(TOMBSTONE, token, b'', entry[3])
+                       for token, entry in self._index.items() if entry[3] < now]
+            if expired:
+                self._append(expired)
+            self._compact(now)
+        return len(expired), min((expires_at for *_, expires_at in expired), default=None)
+
+    def compact(self, now=None):
+        """Rewrite the sealed segment with the least live data, if it is mostly dead."""
+        now = time.time() if now is None else now
+        with self._locked():
+            self._sync(repair=True)
+            return self._compact(now)
+
+    def _compact(self, now):
+        active = max(self._files)
+        candidates = [
+            (self._live[n] / self._positions[n], n) for n in self._files
+            if n != active and self._positions[n]
+            and self._live[n] / self._positions[n] < self.compact_ratio
+        ]
+        if not candidates:
+            return None
+        _, number = min(candidates)
+        return self._rewrite(number, now)
+
+    def _rewrite(self, number, now):
+        keep = []
+        fd = self._fds[number]
+        end = self._positions[number]
+        data = os.pread(fd, end, 0)
+        # Replay drops expired puts by the clock, so a tombstone must outlive
+        # its record by the clock too, whatever now the caller passed
+        shadow_until = min(now, time.time())
+        offset = 0
+        while offset < end:
+            kind, token_len, data_len, expires_at, _ = ENTRY.unpack_from(data, offset)
+            size = ENTRY.size + token_len + data_len
+            token = data[offset + ENTRY.size:offset + ENTRY.size + token_len].decode()
+            entry = self._index.get(token)
+            if kind == PUT:
+                live = (entry is not None and entry[0] == number and entry[1] == offset + size - data_len
+                        and expires_at >= now)
+            else:
+                # Still shadows a put in an older segment until the record expires
+                live = entry is None and expires_at >= shadow_until
+            if live:
+                keep.append(data[offset:offset + size])
+            offset += size
+        files = dict(self._files)
+        old_name = files[number]
+        if keep:
+            generation = self._generation + 1
+            name = _segment_name(number, generation)
+            tmp = os.path.join(self.root, f'{name}.tmp')
+            with open(tmp, 'wb') as f:
+                f.write(b''.join(keep))
+            os.replace(tmp, os.path.join(self.root, name))
+            files[number] = name
+        else:
+            del files[number]
+        self._write_manifest(self._generation + 1, files)
+        # Workers still reading the old file keep it open until they resync
+        os.remove(os.path.join(self.root, old_name))
+        self._load_manifest()
+        self._sync(repair=True)
+        return number
+
+    def iter_expiries(self):
+        with self._mutex_synced():
+            entries = [(entry[3], token) for token, entry in self._index.items()]
+        yield from entries
+
+    def stats(self):
+        with self._mutex_synced():
+            return len(self._index), sum(entry[2] for entry in self._index.values())
+
+    def close(self):
+        for fd in self._fds.values():
+            os.close(fd)
+        if self._pid == os.getpid():
+            os.close(self._lock_fd)
+        self._pid = None
+        self._reset()
+
+    def detach(self):
+        # The index is rebuilt from the segments on next use
+        self.close()
+
+
+class _FileLock:
+    __slots__ = ('mutex', 'fd')
+
+    def __init__(self, mutex, fd):
+        self.mutex = mutex
+        self.fd = fd
+
+    def __enter__(self):
+        self.mutex.acquire()
+        try:
+            fcntl.flock(self.fd, fcntl.LOCK_EX)
+        except BaseException:
+            self.mutex.release()
+            raise
+
+    def __exit__(self, *exc):
+        try:
+            fcntl.flock(self.fd, fcntl.LOCK_UN)
+        finally:
+            self.mutex.release()
+
+
+class _Synced:
+    __slots__ = ('store',)
+
+    def __init__(self, store):
+        self.store = store
+
+    def __enter__(self):
+        self.store._mutex.acquire()
+        try:
+            try:
+                self.store._sync()
+            except FileNotFoundError:
+                # A compaction removed a file between reading the manifest and
+                # opening it; none can run while we hold the lock
+                with self.store._locked():
+                    self.store._sync()
+        except BaseException:
+            self.store._mutex.release()
+            raise
+
+    def __exit__(self, *exc):
+        self.store._mutex.release()
@@ -0,0 +1,262 @@
+"""Shared-memory hot tier for short-lived secrets.
+
+Most secrets expire within minutes and are opened within seconds of being
+created. For those, a round trip through the filesystem (create, read back,
+unlink) is the most expensive part of the request. ``SharedMemoryStore``
+keeps them in one memory-mapped file shared by every worker on the host,
+by default on /dev/shm, so put/get/take/delete are memory copies with no
+open/read/write/unlink.
+
+The arena is a fixed-size open-addressing hash table: HOT_STORE_SLOTS slots
+of HOT_STORE_SLOT_SIZE bytes each, split into stripes. A token hashes to one
+stripe and probes only inside it, so an operation takes a single stripe lock:
+a thread lock within the process and an fcntl byte-range lock across
+processes (that fcntl is the one syscall left on the path). Records too big
+for a slot, or arriving when their stripe is full, raise ``HotStoreFull``;
+``TieredStore`` (see storage.py) then writes them to the disk backend.
+
+The arena lives as long as the host does. Everything in it is already
+encrypted, like the records on disk, but it does not survive a reboot, which
+is why only short TTLs are sent here.
+"""
+import fcntl
+import hashlib
+import mmap
+import os
+import struct
+import threading
+import time
+
+from records import decode_record, encode_record
+from storage import SecretStore
+
+MAGIC = b'SSHOT\x00\x01\x00'
+_HEADER = struct.Struct('<8sIII')  # magic, slots, slot size, stripes
+_HEADER_SIZE = 4096  # page aligned; the stripe lock bytes live in here
+_LOCK_OFFSET = 64
+# state, token length, data length, expires_at
+_SLOT = struct.Struct('<BBxxId')
+TOKEN_SIZE = 64
+
+EMPTY, USED, DELETED = 0, 1, 2
+
+
+class HotStoreFull(OSError):
+    pass
+
+
+class SharedMemoryStore(SecretStore):
+    name = 'shm'
+    # sweep() scans memory only, so the reaper can call it directly
+    indexed_expiry = True
+
+    def __init__(self, path, slots=16384, slot_size=4096, stripes=64):
+        self.path = path
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        # The first process to get here lays out the arena; later ones (and
+        # later restarts) adopt whatever geometry is already on disk.
+        fcntl.lockf(self._fd, fcntl.LOCK_EX)
+        try:
+            if os.fstat(self._fd).st_size < _HEADER_SIZE:
+                stripes = max(1, min(stripes, slots))
+                slots -= slots % stripes
+                os.ftruncate(self._fd, _HEADER_SIZE + slots * slot_size)
+                os.pwrite(self._fd, _HEADER.pack(MAGIC, slots, slot_size, stripes), 0)
+            magic, slots, slot_size, stripes = _HEADER.unpack(os.pread(self._fd, _HEADER.size, 0))
+        finally:
+            fcntl.lockf(self._fd, fcntl.LOCK_UN)
+        if magic != MAGIC:
+            raise ValueError(f'{path} is not a hot store arena')
+        self.slots = slots
+        self.slot_size = slot_size
+        self.stripes = stripes
+        self.stripe_slots = slots // stripes
+        self.capacity = slot_size - _SLOT.size - TOKEN_SIZE
+        self._map = mmap.mmap(self._fd, _HEADER_SIZE + slots * slot_size)
+        self._pid = None
+        self._locks = None
+
+    def _thread_locks(self):
+        # Thread locks do not survive fork(); every process gets its own set
+        if self._pid != os.getpid():
+            self._locks = [threading.Lock() for _ in range(self.stripes)]
+            self._pid = os.getpid()
+        return self._locks
+
+    def _locked(self, stripe):
+        return _StripeLock(self._thread_locks()[stripe], self._fd, _LOCK_OFFSET + stripe)
+
+    def _home(self, token):
+        h = int.from_bytes(hashlib.blake2b(token.encode(), digest_size=8).digest(), 'little')
+        stripe = h % self.stripes
+        return stripe, (h // self.stripes) % self.stripe_slots
+
+    def _offset(self, stripe, index):
+        return _HEADER_SIZE + (stripe * self.stripe_slots + index) * self.slot_size
+
+    def _find(self, stripe, start, key):
+        # (offset of the slot holding key or None, first reusable offset or None)
+        free = None
+        for i in range(self.stripe_slots):
+            index = (start + i) % self.stripe_slots
+            offset = self._offset(stripe, index)
+            state, token_len, _, _ = _SLOT.unpack_from(self._map, offset)
+            if state == EMPTY:
+                return None, free if free is not None else offset
+            if state == DELETED:
+                if free is None:
+                    free = offset
+                continue
+            token_start = offset + _SLOT.size
+            if token_len == len(key) and self._map[token_start:token_start + token_len] == key:
+                return offset, free
+        return None, free
+
+    def _read(self, offset):
+        _, _, data_len, _ = _SLOT.unpack_from(self._map, offset)
+        start = offset + _SLOT.size + TOKEN_SIZE
+        return self._map[start:start + data_len]
+
+    def _clear(self, stripe, offset):
+        # Wipe the ciphertext rather than leave it behind in a free slot
+        _, _, data_len, _ = _SLOT.unpack_from(self._map, offset)
+        data_start = offset + _SLOT.size + TOKEN_SIZE
+        self._map[data_start:data_start + data_len] = bytes(data_len)
+        # A tombstone is only needed if a later probe could pass through here
+        index = (offset - _HEADER_SIZE) // self.slot_size - stripe * self.stripe_slots
+        following = self._offset(stripe, (index + 1) % self.stripe_slots)
+        if self._map[following] != EMPTY:
+            self._map[offset] = DELETED
+            return
+        self._map[offset] = EMPTY
+        # ...and tombstones right before a now-empty slot can go too
+        while True:
+            index = (index - 1) % self.stripe_slots
+            previous = self._offset(stripe, index)
+            if self._map[previous] != DELETED:
+                return
+            self._map[previous] = EMPTY
+
+    def put(self, token, record):
+        self.put_encoded(token, record['expires_at'], encode_record(record))
+
+    def put_encoded(self, token, expires_at, data):
+        key = token.encode()
+        if len(key) > TOKEN_SIZE or len(data) > self.capacity:
+            raise HotStoreFull(f'record for {token} does not fit a hot store slot')
+        stripe, start = self._home(token)
+        with self._locked(stripe):
+            existing, free = self._find(stripe, start, key)
+            offset = existing if existing is not None else free
+            if offset is None:
+                raise HotStoreFull(f'hot store stripe {stripe} is full')
+            token_start = offset + _SLOT.size
+            data_start = token_start + TOKEN_SIZE
+            self._map[token_start:token_start + len(key)] = key
+            self._map[data_start:data_start + len(data)] = data
+            # Header last: the slot only becomes visible once it is complete
+            _SLOT.pack_into(self._map, offset, USED, len(key), len(data), expires_at)
+
+    def get(self, token):
+        key = token.encode()
+        stripe, start = self._home(token)
+        with self._locked(stripe):
+            offset, _ = self._find(stripe, start, key)
+            if offset is None:
+                return None
+            data = self._read(offset)
+        return decode_record(data)
+
+    def take(self, token):
+        key = token.encode()
+        stripe, start = self._home(token)
+        with self._locked(stripe):
+            offset, _ = self._find(stripe, start, key)
+            if offset is None:
+                return None
+            data = self._read(offset)
+            self._clear(stripe, offset)
+        return decode_record(data)
+
+    def delete(self, token):
+        key = token.encode()
+        stripe, start = self._home(token)
+        with self._locked(stripe):
+            offset, _ = self._find(stripe, start, key)
+            if offset is None:
+                return False
+            self._clear(stripe, offset)
+        return True
+
+    def _used_slots(self, stripe):
+        for index in range(self.stripe_slots):
+            offset = self._offset(stripe, index)
+            state, token_len, data_len, expires_at = _SLOT.unpack_from(self._map, offset)
+            if state == USED:
+                yield offset, token_len, data_len, expires_at
+
+    def sweep(self, now=None):
+        now = time.time() if now is None else now
+        removed, oldest = 0, None
+        for stripe in range(self.stripes):
+            with self._locked(stripe):
+                for offset, _, _, expires_at in list(self._used_slots(stripe)):
+                    if expires_at < now:
+                        self._clear(stripe, offset)
+                        removed += 1
+                        oldest = expires_at if oldest is None else min(oldest, expires_at)
+        return removed, oldest
+
+    def iter_expiries(self):
+        for stripe in range(self.stripes):
+            with self._locked(stripe):
+                entries = []
+                for offset, token_len, _, expires_at in self._used_slots(stripe):
+                    token_start = offset + _SLOT.size
+                    entries.append((expires_at, self._map[token_start:token_start + token_len].decode()))
+            yield from entries
+
+    def stats(self):
+        count = size = 0
+        for stripe in range(self.stripes):
+            with self._locked(stripe):
+                for _, _, data_len, _ in self._used_slots(stripe):
+                    count += 1
+                    size += data_len
+        return count, size
+
+    def close(self):
+        self._map.close()
+        os.close(self._fd)
+
+
+class _StripeLock:
+    __slots__ = ('lock', 'fd', 'offset')
+
+    def __init__(self, lock, fd, offset):
+        self.lock = lock
+        self.fd = fd
+        self.offset = offset
+
+    def __enter__(self):
+        self.lock.acquire()
+        try:
+            fcntl.lockf(self.fd, fcntl.LOCK_EX, 1, self.offset)
+        except BaseException:
+            self.lock.release()
+            raise
+
+    def __exit__(self, *exc):
+        try:
+            fcntl.lockf(self.fd, fcntl.LOCK_UN, 1, self.offset)
+        finally:
+            self.lock.release()
+
+
+def default_arena_path(secrets_dir, kind='hot'):
+    # One file per SECRETS_DIR and kind, in RAM when the host has /dev/shm
+    if os.path.isdir('/dev/shm'):
+        digest = hashlib.sha256(os.path.abspath(secrets_dir).encode()).hexdigest()[:12]
+        suffix = 'arena' if kind == 'hot' else kind
+        return f'/dev/shm/secret-share-{digest}.{suffix}'
+    return os.path.join(secrets_dir, f'.{kind}.arena')
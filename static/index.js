@@ -0,0 +1,94 @@
+function updateCharCount() {
+    const textarea = document.getElementById('secret');
+    const charCount = document.getElementById('charCount');
+    const maxLength = 5000;
+    const remaining = maxLength - textarea.value.length;
+    charCount.textContent = `${textarea.value.length}/${maxLength} characters`;
+
+    // Change color when nearing limit
+    if (textarea.value.length > maxLength * 0.9) {
+        charCount.style.color = '#dc2626'; // Red
+    } else {
+        charCount.style.color = '#1e293b'; // Normal color
+    }
+}
+
+const createBtn = document.getElementById('createBtn');
+const loading = document.getElementById('loading');
+const result = document.getElementById('result');
+const error = document.getElementById('error');
+
+async function createSecret() {
+    const secret = document.getElementById('secret').value.trim();
+    error.textContent = '';
+
+    if (!secret) {
+        error.textContent = 'Please enter a secret message';
+        return;
+    }
+
+    if (secret.length > 5000) {
+        error.textContent = 'Secret must be less than 5000 characters';
+        return;
+    }
+
+    try {
+        createBtn.disabled = true;
+        loading.classList.add('show');
+        result.classList.remove('show');
+
+        const expireTime = document.getElementById('expireTime').value;
+
+        const response = await fetch('/create', {
+            method: 'POST',
+            headers: {
+                'Content-Type': 'application/json',
+            },
+            body: JSON.stringify({
+                secret: secret,
+                expire_seconds: parseInt(expireTime)
+            }),
+        });
+
+        if (!response.ok) {
+            throw new Error('Failed to create secret');
+        }
+
+        const data = await response.json();
+
+        // Ensure the token is properly encoded
+        const token = encodeURIComponent(data.token);
+
+        const link = window.location.origin + '/view/' + token;
+
+        document.getElementById('secretLink').textContent = link;
+        result.classList.add('show');
+    } catch (err) {
+        error.textContent = 'Failed to create secret. Please try again.';
+        console.error(err);
+    } finally {
+        createBtn.disabled = false;
+        loading.classList.remove('show');
+    }
+}
+
+async function copyToClipboard() {
+    const link = document.getElementById('secretLink').textContent;
+    try {
+        await navigator.clipboard.writeText(link);
+        const btn = event.target;
+        const originalText = btn.textContent;
+        btn.textContent = 'Copied!';
+        setTimeout(() => {
+            btn.textContent = originalText;
+        }, 2000);
+    } catch (err) {
+        console.error('Failed to copy:', err);
+    }
+}
+
+// Enable create button when user starts typing
+document.getElementById('secret').addEventListener('input', function() {
+    createBtn.disabled = false;
+    error.textContent = '';
+});
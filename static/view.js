@@ -0,0 +1,50 @@
+const claimMode = document.body.dataset.claimMode === 'true';
+
+async function viewSecret(token) {
+    try {
+        if (claimMode) {
+            // One request fetches the secret and destroys it
+            const response = await fetch(`/claim/${token}`, {
+                method: 'POST'
+            });
+            const data = await response.json();
+
+            if (!response.ok) {
+                alert(data.error || 'Failed to view secret. It may have already been viewed.');
+                return;
+            }
+
+            document.querySelector('.secret-content').textContent = data.secret;
+        } else {
+            // Make request to consume the secret
+            const response = await fetch(`/consume/${token}`, {
+                method: 'POST'
+            });
+
+            if (!response.ok) {
+                throw new Error('Failed to consume secret');
+            }
+        }
+
+        // Show the secret content
+        document.getElementById('viewButtonContainer').style.display = 'none';
+        document.getElementById('secretContainer').style.display = 'block';
+    } catch (err) {
+        console.error('Error:', err);
+        alert('Failed to view secret. It may have already been viewed.');
+    }
+}
+
+async function copyToClipboard() {
+    const text = document.querySelector('.secret-content').textContent;
+    try {
+        await navigator.clipboard.writeText(text);
+        const btn = event.target;
+        btn.textContent = 'Copied!';
+        setTimeout(() => {
+            btn.textContent = 'Copy Message';
+        }, 2000);
+    } catch (err) {
+        console.error('Failed to copy:', err);
+    }
+}
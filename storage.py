@@ -0,0 +1,817 @@
+"""Secret storage backends.
+
+Routes only talk to a ``SecretStore``; the backend is picked with the
+STORAGE_BACKEND environment variable:
+
+    file    one file per secret under SECRETS_DIR (default), fanned out
+            into two levels of hashed subdirectories (FILE_STORE_LAYOUT=sharded),
+            kept in the top-level directory (FILE_STORE_LAYOUT=flat), or
+            grouped into one directory per expiry window
+            (FILE_STORE_LAYOUT=bucketed, window set by FILE_STORE_BUCKET_SECONDS)
+    sqlite  a single SQLite database in WAL mode (SQLITE_PATH)
+    segment records appended to segment files under SECRETS_DIR/segments with
+            an in-memory index (SEGMENT_BYTES per segment, compacted once less
+            than SEGMENT_COMPACT_RATIO of a segment is live); see segment_store.py
+    redis   a Redis server shared by every node (REDIS_URL), with native key
+            TTLs; every node needs the same KEYS_DIR or SECRET_KEYS. See
+            redis_store.py
+
+With HOT_STORE=1, records expiring within HOT_STORE_MAX_TTL seconds are kept
+in a memory-mapped arena shared by all workers on the host instead (see
+shm_store.py), and the backend above only takes longer-lived records and
+overflow. Other nodes cannot see that arena, so HOT_STORE is refused for
+the redis backend.
+
+Every backend implements the same operations:
+
+    new_token(expires_at) return a fresh token for a record expiring then
+    put(token, record)   store a new record
+    put_many(items)      store (token, record) pairs, returning a success flag
+                         per item; a failed item never fails the others. SQLite
+                         (one transaction), Redis (one pipeline) and the
+                         segment store (one append) write the batch in bulk;
+                         the file store and the hot tier store item by item
+    get(token)           return the record, or None
+    take(token)          atomically remove and return the record, or None;
+                         of several concurrent callers at most one gets it
+    delete(token)        remove the record, True if it existed
+    sweep(now)           remove every expired record, return (how many, oldest
+                         expires_at among them or None)
+    iter_expiries()      yield (expires_at, token) for every stored record
+    iter_unindexed_expiries()
+                         for stores with indexed expiry: the same for records
+                         sweep() does not reach (e.g. left from another layout)
+    stats()              return (record count, bytes stored)
+
+An existing flat SECRETS_DIR is moved into the sharded layout online with
+
+    python storage.py migrate-shards [--secrets-dir DIR]
+
+While flat records remain, the sharded file store keeps resolving both layouts.
+
+Records are stored in the binary format of records.py (``<token>.rec`` in
+the file store). JSON records written by earlier versions (``<token>.json``)
+are still read by every backend, and rewritten with the app stopped by
+
+    python storage.py convert-records [--secrets-dir DIR]
+
+In the bucketed layout a token looks like ``<bucket>.<random>``, where bucket
+is the end of its expiry window in base 36. Lookups go straight to that
+bucket's directory, and sweeping deletes whole expired buckets without
+reading any record. The prefix does reveal the expiry window to anyone
+holding the link, which is no more than the link's own lifetime.
+Tokens without a prefix resolve through the sharded/flat paths, so secrets
+created before switching to this layout stay reachable.
+"""
+import argparse
+import hashlib
+import itertools
+import math
+import os
+import re
+import secrets
+import shutil
+import sqlite3
+import threading
+import time
+from secrets import token_hex
+
+from records import decode_record, encode_record, is_expired, is_legacy, read_record
+
+# Tokens come from secrets.token_urlsafe, optionally prefixed with an expiry
+# bucket; anything else cannot name a record and must never become a path.
+TOKEN_RE = re.compile(r'^(?:[0-9a-z]{1,13}\.)?[A-Za-z0-9_-]{1,128}$')
+BUCKETS_DIR = 'buckets'
+# Large secrets written by streaming.py; not part of any SecretStore
+STREAMS_DIR = 'streams'
+SEGMENTS_DIR = 'segments'
+RESERVED_DIRS = (BUCKETS_DIR, STREAMS_DIR, SEGMENTS_DIR)
+
+
+def is_valid_token(token):
+    return bool(TOKEN_RE.match(token))
+
+
+def _base36(n):
+    digits = '0123456789abcdefghijklmnopqrstuvwxyz'
+    out = ''
+    while True:
+        n, r = divmod(n, 36)
+        out = digits[r] + out
+        if not n:
+            return out
+
+
+def bucket_of(token):
+    prefix, sep, _ = token.partition('.')
+    return prefix if sep else None
+
+
+def encode_items(items):
+    """Encode (token, record) pairs for a bulk put, each on its own.
+
+    Returns (flags, encoded): flags has False for every item that could not
+    be encoded, and True (to be confirmed by the write) for the rest, which
+    are in encoded as (index, token, record, data).
+    """
+    flags = [True] * len(items)
+    encoded = []
+    for i, (token, record) in enumerate(items):
+        try:
+            encoded.append((i, token, record, encode_record(record)))
+        except Exception:
+            flags[i] = False
+    return flags, encoded
+
+
+def merge_sweeps(results):
+    """Combine sweep() results into one (removed, oldest expires_at or None)."""
+    removed, oldest = 0, None
+    for count, expired_at in results:
+        removed += count
+        if expired_at is not None and (oldest is None or expired_at < oldest):
+            oldest = expired_at
+    return removed, oldest
+
+
+class SecretStore:
+    name = None
+    # True when sweep() finds expired records without visiting live ones, so
+    # the reaper can call it directly instead of tracking every token
+    indexed_expiry = False
+    # True when other nodes read the same records, so they need the same keys
+    shared = False
+
+    def new_token(self, expires_at):
+        return secrets.token_urlsafe(16)
+
+    def put(self, token, record):
+        raise NotImplementedError
+
+    def put_many(self, items):
+        # No bulk write here; stores with one override this
+        results = []
+        for token, record in items:
+            try:
+                self.put(token, record)
+                results.append(True)
+            except Exception:
+                results.append(False)
+        return results
+
+    def get(self, token):
+        raise NotImplementedError
+
+    def take(self, token):
+        raise NotImplementedError
+
+    def delete(self, token):
+        raise NotImplementedError
+
+    def sweep(self, now=None):
+        raise NotImplementedError
+
+    def iter_expiries(self):
+        raise NotImplementedError
+
+    def iter_unindexed_expiries(self):
+        return iter(())
+
+    def stats(self):
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+    def detach(self):
+        # Before fork(): release handles a child must not share (connections,
+        # lock files). The store reopens them, per process, on next use.
+        pass
+
+    def convert_records(self):
+        """Rewrite stored records in the current format; returns how many.
+
+        Offline only: a record consumed while it is rewritten would come back.
+        This generic version rewrites every record, as it cannot see which
+        ones are still JSON.
+        """
+        converted = 0
+        for _, token in list(self.iter_expiries()):
+            record = self.get(token)
+            if record is not None and self.delete(token):
+                self.put(token, record)
+                converted += 1
+        return converted
+
+
+class InstrumentedStore:
+    """Wraps a store and reports how long each operation takes.
+
+    ``timer(stage)`` must return a context manager; stages are
+    ``storage_read``, ``storage_write`` and ``storage_delete``.
+    """
+
+    def __init__(self, store, timer):
+        self.store = store
+        self.timer = timer
+
+    def __getattr__(self, name):
+        return getattr(self.store, name)
+
+    def new_token(self, expires_at):
+        return self.store.new_token(expires_at)
+
+    def put(self, token, record):
+        with self.timer('storage_write'):
+            return self.store.put(token, record)
+
+    def put_many(self, items):
+        with self.timer('storage_write'):
+            return self.store.put_many(items)
+
+    def get(self, token):
+        with self.timer('storage_read'):
+            return self.store.get(token)
+
+    def take(self, token):
+        with self.timer('storage_read'):
+            return self.store.take(token)
+
+    def delete(self, token):
+        with self.timer('storage_delete'):
+            return self.store.delete(token)
+
+    def sweep(self, now=None):
+        return self.store.sweep(now)
+
+    def iter_expiries(self):
+        return self.store.iter_expiries()
+
+    def stats(self):
+        return self.store.stats()
+
+    def close(self):
+        self.store.close()
+
+    def detach(self):
+        self.store.detach()
+
+
+class FileStore(SecretStore):
+    name = 'file'
+    suffix = '.rec'
+    # JSON records from before the binary format (see records.py)
+    legacy_suffix = '.json'
+    suffixes = (suffix, legacy_suffix)
+
+    def __init__(self, root, layout='sharded', bucket_seconds=60):
+        if layout not in ('flat', 'sharded', 'bucketed'):
+            raise ValueError(f'Unknown file store layout: {layout!r}')
+        self.root = root
+        self.layout = layout
+        self.bucket_seconds = bucket_seconds
+        self.buckets_root = os.path.join(root, BUCKETS_DIR)
+        self.indexed_expiry = layout == 'bucketed'
+        os.makedirs(root, exist_ok=True)
+        # Only look for flat-layout records while some are left to migrate
+        self.flat_fallback = layout != 'flat' and has_flat_records(root, self.suffixes)
+
+    def new_token(self, expires_at):
+        token = secrets.token_urlsafe(16)
+        if self.layout != 'bucketed':
+            return token
+        bucket_end = math.ceil(expires_at / self.bucket_seconds) * self.bucket_seconds
+        return f'{_base36(int(bucket_end))}.{token}'
+
+    def _flat_path(self, token):
+        return os.path.join(self.root, f'{token}{self.suffix}')
+
+    def _sharded_path(self, token):
+        digest = hashlib.sha256(token.encode()).hexdigest()
+        return os.path.join(self.root, digest[:2], digest[2:4], f'{token}{self.suffix}')
+
+    def _bucket_path(self, bucket, token):
+        return os.path.join(self.buckets_root, bucket, f'{token}{self.suffix}')
+
+    def _path(self, token):
+        bucket = bucket_of(token)
+        if bucket is not None:
+            return self._bucket_path(bucket, token)
+        if self.layout == 'flat':
+            return self._flat_path(token)
+        return self._sharded_path(token)
+
+    def _candidates(self, token):
+        if bucket_of(token) is not None or not self.flat_fallback:
+            paths = (self._path(token),)
+        else:
+            # The migrator only ever moves flat -> sharded, so checking the sharded
+            # path again after the flat one cannot miss a record moved in between.
+            sharded = self._sharded_path(token)
+            paths = (sharded, self._flat_path(token), sharded)
+        # Each followed by its JSON twin; only a miss gets that far
+        return [p for path in paths for p in (path, path[:-len(self.suffix)] + self.legacy_suffix)]
+
+    def _token_of(self, name):
+        for suffix in self.suffixes:
+            if name.endswith(suffix):
+                return name[:-len(suffix)]
+        return None
+
+    def put(self, token, record):
+        path = self._path(token)
+        data = encode_record(record)
+        # Written aside and renamed into place, so a crash or a full disk never
+        # leaves a truncated record under the token's name
+        tmp = f'{path}.{token_hex(4)}.tmp'
+        try:
+            f = open(tmp, 'wb')
+        except FileNotFoundError:
+            # First record in this shard or bucket; directories are created on demand
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            f = open(tmp, 'wb')
+        try:
+            with f:
+                f.write(data)
+            os.replace(tmp, path)
+        except BaseException:
+            try:
+                os.remove(tmp)
+            except FileNotFoundError:
+                pass
+            raise
+
+    def get(self, token):
+        if not is_valid_token(token):
+            return None
+        for path in self._candidates(token):
+            try:
+                with open(path, 'rb', buffering=0) as f:
+                    return decode_record(read_record(f))
+            except FileNotFoundError:
+                continue
+        return None
+
+    def take(self, token):
+        if not is_valid_token(token):
+            return None
+        for path in self._candidates(token):
+            # rename() is atomic: only one caller can move the file out of the
+            # way, everyone else sees FileNotFoundError.
+            claimed = f'{path}.claimed-{token_hex(4)}'
+            try:
+                os.rename(path, claimed)
+            except FileNotFoundError:
+                continue
+            try:
+                with open(claimed, 'rb', buffering=0) as f:
+                    return decode_record(read_record(f))
+            except FileNotFoundError:
+                # Its whole bucket expired and was dropped under us
+                return None
+            finally:
+                try:
+                    os.remove(claimed)
+                except FileNotFoundError:
+                    pass
+        return None
+
+    def delete(self, token):
+        if not is_valid_token(token):
+            return False
+        for path in self._candidates(token):
+            try:
+                os.remove(path)
+                return True
+            except FileNotFoundError:
+                continue
+        return False
+
+    def convert_records(self):
+        converted = 0
+        paths = itertools.chain(
+            (os.path.join(bucket_path, name)
+             for _, bucket_path in self._buckets() for name in _listdir(bucket_path)),
+            self._record_paths(),
+        )
+        for path in list(paths):
+            if not path.endswith(self.legacy_suffix):
+                continue
+            try:
+                with open(path, 'rb') as f:
+                    data = encode_record(decode_record(f.read()))
+            except FileNotFoundError:
+                continue
+            target = path[:-len(self.legacy_suffix)] + self.suffix
+            tmp = f'{target}.{token_hex(4)}.tmp'
+            with open(tmp, 'wb') as f:
+                f.write(data)
+            os.replace(tmp, target)
+            os.remove(path)
+            converted += 1
+        return converted
+
+    def _record_paths(self):
+        # Records outside the bucket tree: the sharded and flat layouts
+        for dirpath, dirnames, filenames in os.walk(self.root):
+            # Skip .keys and any other private directories
+            dirnames[:] = [
+                d for d in dirnames
+                if not d.startswith('.') and not (dirpath == self.root and d in RESERVED_DIRS)
+            ]
+            for name in filenames:
+                if name.endswith(self.suffixes) and not name.startswith('.'):
+                    yield os.path.join(dirpath, name)
+
+    def _buckets(self):
+        try:
+            entries = list(os.scandir(self.buckets_root))
+        except FileNotFoundError:
+            return
+        for entry in entries:
+            try:
+                yield int(entry.name, 36), entry.path
+            except ValueError:
+                continue
+
+    def _drop_expired_buckets(self, now):
+        removed, oldest = 0, None
+        for bucket_end, path in self._buckets():
+            # Every record in the bucket expires at or before bucket_end
+            if now <= bucket_end:
+                continue
+            try:
+                count = sum(1 for name in os.listdir(path) if name.endswith(self.suffixes))
+            except FileNotFoundError:
+                continue
+            shutil.rmtree(path, ignore_errors=True)
+            if count:
+                removed += count
+                # Records are not opened here, so the bucket's end stands in
+                # for their expiry: a lower bound on how late they were
+                oldest = bucket_end if oldest is None else min(oldest, bucket_end)
+        return removed, oldest
+
+    def sweep(self, now=None):
+        now = time.time() if now is None else now
+        removed, oldest = self._drop_expired_buckets(now)
+        if self.indexed_expiry:
+            # Only whole buckets: records from before the switch to the bucketed
+            # layout are scanned once and scheduled by the reaper instead
+            return removed, oldest
+        for path in self._record_paths():
+            try:
+                with open(path, 'rb', buffering=0) as f:
+                    record = decode_record(read_record(f))
+                if is_expired(record, now):
+                    os.remove(path)
+                    removed += 1
+                    if oldest is None or record['expires_at'] < oldest:
+                        oldest = record['expires_at']
+            except (FileNotFoundError, ValueError, KeyError):
+                continue
+        return removed, oldest
+
+    def stats(self):
+        count = size = 0
+        paths = [
+            os.path.join(bucket_path, name)
+            for _, bucket_path in self._buckets()
+            for name in _listdir(bucket_path) if name.endswith(self.suffixes)
+        ]
+        for path in itertools.chain(paths, self._record_paths()):
+            try:
+                size += os.stat(path).st_size
+                count += 1
+            except FileNotFoundError:
+                continue
+        return count, size
+
+    def iter_expiries(self):
+        for bucket_end, path in self._buckets():
+            try:
+                names = os.listdir(path)
+            except FileNotFoundError:
+                continue
+            # The bucket end is an upper bound for each record; good enough to schedule on
+            for name in names:
+                token = self._token_of(name)
+                if token is not None:
+                    yield bucket_end, token
+        yield from self._iter_record_expiries()
+
+    def iter_unindexed_expiries(self):
+        return self._iter_record_expiries() if self.indexed_expiry else iter(())
+
+    def _iter_record_expiries(self):
+        for path in self._record_paths():
+            try:
+                with open(path, 'rb', buffering=0) as f:
+                    record = decode_record(read_record(f))
+                yield record['expires_at'], self._token_of(os.path.basename(path))
+            except (FileNotFoundError, ValueError, KeyError):
+                continue
+
+
+def _listdir(path):
+    try:
+        return os.listdir(path)
+    except FileNotFoundError:
+        return []
+
+
+def has_flat_records(root, suffixes=('.rec', '.json')):
+    with os.scandir(root) as entries:
+        return any(entry.name.endswith(suffixes) and entry.is_file() for entry in entries)
+
+
+def migrate_to_sharded(root, pause=0.0, batch_size=1000):
+    """Move every flat-layout record under root into the sharded layout.
+
+    Safe to run while the app is serving: each move is a single rename(), and
+    a record that is consumed concurrently is simply skipped.
+    """
+    store = FileStore(root, layout='sharded')
+    moved = 0
+    with os.scandir(root) as entries:
+        for entry in entries:
+            token = store._token_of(entry.name)
+            if token is None or not is_valid_token(token):
+                continue
+            # Keeps its suffix: JSON records stay JSON until convert-records
+            target = store._sharded_path(token)[:-len(store.suffix)] + entry.name[len(token):]
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            try:
+                os.rename(entry.path, target)
+            except FileNotFoundError:
+                continue
+            moved += 1
+            if pause and moved % batch_size == 0:
+                time.sleep(pause)
+    return moved
+
+
+class SQLiteStore(SecretStore):
+    name = 'sqlite'
+    indexed_expiry = True
+
+    SCHEMA = (
+        'CREATE TABLE IF NOT EXISTS secrets ('
+        ' token TEXT PRIMARY KEY,'
+        ' expires_at REAL NOT NULL,'
+        ' data BLOB NOT NULL'
+        ') WITHOUT ROWID',
+        'CREATE INDEX IF NOT EXISTS secrets_expires_at ON secrets (expires_at)',
+    )
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        self._conn().executescript(';'.join(self.SCHEMA))
+
+    def _conn(self):
+        # One connection per thread, and never one inherited across fork()
+        local = self._local
+        if getattr(local, 'pid', None) != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            local.conn, local.pid = conn, os.getpid()
+        return local.conn
+
+    def put(self, token, record):
+        self._conn().execute(
+            'INSERT INTO secrets (token, expires_at, data) VALUES (?, ?, ?)',
+            (token, record['expires_at'], encode_record(record)),
+        )
+
+    def put_many(self, items):
+        # One transaction, so one WAL commit for the whole batch
+        flags, encoded = encode_items(items)
+        conn = self._conn()
+        try:
+            with conn:
+                conn.execute('BEGIN')
+                conn.executemany(
+                    'INSERT INTO secrets (token, expires_at, data) VALUES (?, ?, ?)',
+                    [(token, record['expires_at'], data) for _, token, record, data in encoded],
+                )
+        except sqlite3.Error:
+            # Rolled back: none of them were stored
+            return [False] * len(items)
+        return flags
+
+    def get(self, token):
+        row = self._conn().execute(
+            'SELECT data FROM secrets WHERE token = ?', (token,)
+        ).fetchone()
+        return decode_record(row[0]) if row else None
+
+    def take(self, token):
+        # Single statement: the row is deleted and returned atomically
+        row = self._conn().execute(
+            'DELETE FROM secrets WHERE token = ? RETURNING data', (token,)
+        ).fetchone()
+        return decode_record(row[0]) if row else None
+
+    def delete(self, token):
+        cursor = self._conn().execute('DELETE FROM secrets WHERE token = ?', (token,))
+        return cursor.rowcount > 0
+
+    def convert_records(self):
+        conn = self._conn()
+        rows = [
+            (encode_record(decode_record(data)), token)
+            for token, data in conn.execute('SELECT token, data FROM secrets') if is_legacy(data)
+        ]
+        with conn:
+            conn.execute('BEGIN')
+            conn.executemany('UPDATE secrets SET data = ? WHERE token = ?', rows)
+        return len(rows)
+
+    def sweep(self, now=None):
+        now = time.time() if now is None else now
+        conn = self._conn()
+        with conn:
+            conn.execute('BEGIN IMMEDIATE')
+            oldest = conn.execute('SELECT MIN(expires_at) FROM secrets WHERE expires_at < ?', (now,)).fetchone()[0]
+            cursor = conn.execute('DELETE FROM secrets WHERE expires_at < ?', (now,))
+        return cursor.rowcount, oldest
+
+    def iter_expiries(self):
+        yield from self._conn().execute('SELECT expires_at, token FROM secrets')
+
+    def stats(self):
+        return tuple(self._conn().execute(
+            'SELECT COUNT(*), COALESCE(SUM(LENGTH(data)), 0) FROM secrets'
+        ).fetchone())
+
+    def close(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None and self._local.pid == os.getpid():
+            conn.close()
+        self._local = threading.local()
+
+    def detach(self):
+        # Never carry a SQLite connection across fork(); see sqlite.org/howtocorrupt.html
+        self.close()
+
+
+class TieredStore(SecretStore):
+    """Short-TTL records in a shared-memory hot store, everything else on disk.
+
+    Records expiring within max_ttl seconds go to ``hot``; longer-lived ones,
+    and any that do not fit (too large, or the hot store is full), go to
+    ``cold``. Reads try the hot store first, since it costs no syscalls.
+    """
+    def __init__(self, hot, cold, max_ttl=600):
+        self.hot = hot
+        self.cold = cold
+        self.max_ttl = max_ttl
+        self.name = f'{hot.name}+{cold.name}'
+        self.indexed_expiry = cold.indexed_expiry
+        if cold.shared:
+            # Most secrets would only ever exist in this host's memory
+            raise ValueError(f'HOT_STORE cannot front the {cold.name} backend, which other nodes share')
+
+    def new_token(self, expires_at):
+        # Cold-store tokens (e.g. bucketed ones) are valid hot-store keys too
+        return self.cold.new_token(expires_at)
+
+    def _is_hot(self, record):
+        return record['expires_at'] - time.time() <= self.max_ttl
+
+    def put(self, token, record):
+        if self._is_hot(record):
+            try:
+                self.hot.put(token, record)
+                return
+            except OSError:
+                pass
+        self.cold.put(token, record)
+
+    def put_many(self, items):
+        results = [None] * len(items)
+        overflow = []
+        for i, (token, record) in enumerate(items):
+            if self._is_hot(record):
+                try:
+                    self.hot.put(token, record)
+                    results[i] = True
+                    continue
+                except Exception:
+                    pass
+            overflow.append(i)
+        if overflow:
+            try:
+                cold_results = self.cold.put_many([items[i] for i in overflow])
+            except Exception:
+                cold_results = [False] * len(overflow)
+            for i, ok in zip(overflow, cold_results):
+                results[i] = ok
+        return results
+
+    def get(self, token):
+        record = self.hot.get(token)
+        return record if record is not None else self.cold.get(token)
+
+    def take(self, token):
+        record = self.hot.take(token)
+        return record if record is not None else self.cold.take(token)
+
+    def delete(self, token):
+        return self.hot.delete(token) or self.cold.delete(token)
+
+    def sweep(self, now=None):
+        return merge_sweeps((self.hot.sweep(now), self.cold.sweep(now)))
+
+    def iter_expiries(self):
+        # Hot records are swept in memory (app.py registers hot.sweep with
+        # the reaper), so only the cold store's need tracking
+        return self.cold.iter_expiries()
+
+    def iter_unindexed_expiries(self):
+        return self.cold.iter_unindexed_expiries()
+
+    def stats(self):
+        hot, cold = self.hot.stats(), self.cold.stats()
+        return hot[0] + cold[0], hot[1] + cold[1]
+
+    def close(self):
+        self.hot.close()
+        self.cold.close()
+
+    def detach(self):
+        self.hot.detach()
+        self.cold.detach()
+
+    def convert_records(self):
+        # Each tier in place; put() here could move records between them
+        return self.hot.convert_records() + self.cold.convert_records()
+
+
+def open_store(secrets_dir, backend=None):
+    backend = backend or os.environ.get('STORAGE_BACKEND', 'file')
+    if backend == 'file':
+        store = FileStore(
+            secrets_dir,
+            os.environ.get('FILE_STORE_LAYOUT', 'sharded'),
+            int(os.environ.get('FILE_STORE_BUCKET_SECONDS', 60)),
+        )
+    elif backend == 'sqlite':
+        store = SQLiteStore(os.environ.get('SQLITE_PATH', os.path.join(secrets_dir, 'secrets.db')))
+    elif backend == 'segment':
+        from segment_store import SegmentStore
+        store = SegmentStore(
+            os.path.join(secrets_dir, SEGMENTS_DIR),
+            int(os.environ.get('SEGMENT_BYTES', 64 * 1024 * 1024)),
+            float(os.environ.get('SEGMENT_COMPACT_RATIO', 0.5)),
+        )
+    elif backend == 'redis':
+        from redis_store import RedisStore, pool_from_url
+        store = RedisStore(
+            pool_from_url(
+                os.environ.get('REDIS_URL', 'redis://localhost:6379/0'),
+                size=int(os.environ.get('REDIS_POOL_SIZE', 8)),
+                timeout=float(os.environ.get('REDIS_TIMEOUT', 5)),
+            ),
+            os.environ.get('REDIS_KEY_PREFIX', 'secret:'),
+        )
+    else:
+        raise ValueError(f'Unknown storage backend: {backend!r}')
+    if os.environ.get('HOT_STORE', '0') == '1':
+        from shm_store import SharedMemoryStore, default_arena_path
+        hot = SharedMemoryStore(
+            os.environ.get('HOT_STORE_PATH') or default_arena_path(secrets_dir),
+            slots=int(os.environ.get('HOT_STORE_SLOTS', 16384)),
+            slot_size=int(os.environ.get('HOT_STORE_SLOT_SIZE', 4096)),
+        )
+        store = TieredStore(hot, store, float(os.environ.get('HOT_STORE_MAX_TTL', 600)))
+    return store
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Secret store maintenance')
+    parser.add_argument('--secrets-dir', default=os.path.join(os.getcwd(), 'secrets'))
+    sub = parser.add_subparsers(dest='command', required=True)
+    migrate = sub.add_parser('migrate-shards', help='move flat-layout files into shard directories')
+    migrate.add_argument('--pause', type=float, default=0.0,
+                         help='seconds to sleep after every --batch-size moves')
+    migrate.add_argument('--batch-size', type=int, default=1000)
+    sub.add_parser('convert-records',
+                   help='rewrite JSON records in the binary format (STORAGE_BACKEND store; '
+                        'stop the app first)')
+    args = parser.parse_args(argv)
+
+    if args.command == 'migrate-shards':
+        moved = migrate_to_sharded(args.secrets_dir, args.pause, args.batch_size)
+        print(f'Moved {moved} record(s) into the sharded layout')
+    elif args.command == 'convert-records':
+        store = open_store(args.secrets_dir)
+        converted = store.convert_records()
+        store.close()
+        print(f'Converted {converted} record(s) to the binary format')
+
+
+if __name__ == '__main__':
+    main()
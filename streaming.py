@@ -0,0 +1,225 @@
+"""Streaming storage for large secrets.
+
+Large uploads are never held in memory: the request body is read in
+``chunk_size`` pieces, each piece is sealed with the AEAD engine as it
+arrives and appended to a stream file, and downloads decrypt the file chunk
+by chunk on the way out. Peak memory per request is about two chunks no
+matter how big the secret is.
+
+Stream files live under ``SECRETS_DIR/streams/<xx>/<token>.stream``:
+
+    header   magic, version, key id, expires_at, chunk size, nonce prefix, alg
+    chunks   4-byte ciphertext length followed by ciphertext+tag
+
+Each chunk's nonce is the per-stream random prefix plus the chunk index, and
+the index and a final-chunk flag are bound in as associated data, so
+reordered, dropped or truncated chunks fail authentication.
+
+Uploads are written to ``<token>.stream.tmp-*`` and downloads rename the file
+to ``<token>.stream.claimed-*`` before unlinking it. A worker that dies in
+between leaves those behind; ``sweep`` deletes any not modified for
+``orphan_seconds``, long after a live upload would have written to it.
+"""
+import hashlib
+import os
+import secrets
+import struct
+import time
+from secrets import token_bytes, token_hex
+
+from crypto_engine import AeadEngine, DecryptionError, get_engine
+from storage import is_valid_token
+
+MAGIC = b'SSTR'
+VERSION = 1
+HEADER = struct.Struct('>4sBIdI8sB')
+CHUNK_LENGTH = struct.Struct('>I')
+CHUNK_AAD = struct.Struct('>IB')
+STREAM_SUFFIX = '.stream'
+
+
+class StreamTooLarge(ValueError):
+    pass
+
+
+class StreamHeader:
+    __slots__ = ('key_id', 'expires_at', 'chunk_size', 'nonce_prefix', 'alg')
+
+    def __init__(self, key_id, expires_at, chunk_size, nonce_prefix, alg):
+        self.key_id = key_id
+        self.expires_at = expires_at
+        self.chunk_size = chunk_size
+        self.nonce_prefix = nonce_prefix
+        self.alg = alg
+
+    def pack(self):
+        alg = self.alg.encode()
+        return HEADER.pack(MAGIC, VERSION, self.key_id, self.expires_at,
+                           self.chunk_size, self.nonce_prefix, len(alg)) + alg
+
+    @classmethod
+    def read(cls, f):
+        raw = f.read(HEADER.size)
+        if len(raw) != HEADER.size:
+            raise DecryptionError('Truncated stream header')
+        magic, version, key_id, expires_at, chunk_size, nonce_prefix, alg_len = HEADER.unpack(raw)
+        if magic != MAGIC or version != VERSION:
+            raise DecryptionError('Not a secret stream file')
+        return cls(key_id, expires_at, chunk_size, nonce_prefix, f.read(alg_len).decode())
+
+
+def _nonce(prefix, index):
+    return prefix + struct.pack('>I', index)
+
+
+class StreamStore:
+    def __init__(self, root, chunk_size=64 * 1024, max_bytes=64 * 1024 * 1024, orphan_seconds=3600):
+        self.root = root
+        self.chunk_size = chunk_size
+        self.max_bytes = max_bytes
+        self.orphan_seconds = orphan_seconds
+        os.makedirs(root, exist_ok=True)
+
+    def new_token(self):
+        return secrets.token_urlsafe(16)
+
+    def _path(self, token):
+        shard = hashlib.sha256(token.encode()).hexdigest()[:2]
+        return os.path.join(self.root, shard, f'{token}{STREAM_SUFFIX}')
+
+    def write(self, token, read, key, engine, expires_at):
+        """Encrypt everything ``read(n)`` returns into a new stream; returns the plaintext size.
+
+        The file only becomes visible under its token once it is complete.
+        """
+        if not isinstance(engine, AeadEngine):
+            raise ValueError(f'Streaming needs an AEAD engine, not {engine.name!r}')
+        path = self._path(token)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f'{path}.tmp-{token_hex(4)}'
+        header = StreamHeader(key.key_id, expires_at, self.chunk_size, token_bytes(8), engine.name)
+        total = 0
+        try:
+            with open(tmp_path, 'wb') as f:
+                f.write(header.pack())
+                index = 0
+                # Read one chunk ahead so the last chunk can be flagged as final
+                chunk = read(self.chunk_size)
+                while True:
+                    next_chunk = read(self.chunk_size) if chunk else b''
+                    total += len(chunk)
+                    if total > self.max_bytes:
+                        raise StreamTooLarge(f'Stream exceeds {self.max_bytes} bytes')
+                    final = not next_chunk
+                    sealed = engine.seal(key, _nonce(header.nonce_prefix, index), chunk,
+                                         CHUNK_AAD.pack(index, final))
+                    f.write(CHUNK_LENGTH.pack(len(sealed)))
+                    f.write(sealed)
+                    if final:
+                        break
+                    chunk = next_chunk
+                    index += 1
+            if not total:
+                raise ValueError('Empty stream')
+            os.rename(tmp_path, path)
+        except BaseException:
+            try:
+                os.remove(tmp_path)
+            except FileNotFoundError:
+                pass
+            raise
+        return total
+
+    def take(self, token):
+        """Atomically claim a stream; returns an open ``StreamReader`` or None.
+
+        The file is unlinked as soon as it is opened, so the data disappears
+        from disk no later than when the reader is closed.
+        """
+        if not is_valid_token(token):
+            return None
+        path = self._path(token)
+        claimed = f'{path}.claimed-{token_hex(4)}'
+        try:
+            os.rename(path, claimed)
+        except FileNotFoundError:
+            return None
+        f = open(claimed, 'rb')
+        os.remove(claimed)
+        try:
+            return StreamReader(f)
+        except Exception:
+            f.close()
+            raise
+
+    def _stream_paths(self, orphans=None):
+        # orphans, if given, collects the paths of half-written and half-claimed files
+        for dirpath, dirnames, filenames in os.walk(self.root):
+            for name in filenames:
+                if name.endswith(STREAM_SUFFIX):
+                    yield os.path.join(dirpath, name)
+                elif orphans is not None and (f'{STREAM_SUFFIX}.tmp-' in name or f'{STREAM_SUFFIX}.claimed-' in name):
+                    orphans.append(os.path.join(dirpath, name))
+
+    def _remove_orphans(self, paths, now):
+        for path in paths:
+            try:
+                if now - os.stat(path).st_mtime > self.orphan_seconds:
+                    os.remove(path)
+            except FileNotFoundError:
+                continue
+
+    def sweep(self, now=None):
+        now = time.time() if now is None else now
+        removed, oldest = 0, None
+        orphans = []
+        for path in self._stream_paths(orphans):
+            try:
+                with open(path, 'rb') as f:
+                    header = StreamHeader.read(f)
+                if now > header.expires_at:
+                    os.remove(path)
+                    removed += 1
+                    oldest = header.expires_at if oldest is None else min(oldest, header.expires_at)
+            except (FileNotFoundError, DecryptionError):
+                continue
+        self._remove_orphans(orphans, now)
+        return removed, oldest
+
+
+class StreamReader:
+    def __init__(self, f):
+        self.f = f
+        self.header = StreamHeader.read(f)
+
+    def close(self):
+        self.f.close()
+
+    def iter_plaintext(self, key):
+        """Yield decrypted chunks; raises DecryptionError if the stream was tampered with."""
+        engine = get_engine(self.header.alg)
+        index = 0
+        try:
+            length = self._read_length()
+            while length is not None:
+                sealed = self.f.read(length)
+                if len(sealed) != length:
+                    raise DecryptionError('Truncated stream chunk')
+                next_length = self._read_length()
+                final = next_length is None
+                yield engine.open(key, _nonce(self.header.nonce_prefix, index), sealed,
+                                  CHUNK_AAD.pack(index, final))
+                length = next_length
+                index += 1
+            if index == 0:
+                raise DecryptionError('Empty stream')
+        finally:
+            self.close()
+
+    def _read_length(self):
+        raw = self.f.read(CHUNK_LENGTH.size)
+        if not raw:
+            return None
+        if len(raw) != CHUNK_LENGTH.size:
+            raise DecryptionError('Truncated stream chunk header')
+        return CHUNK_LENGTH.unpack(raw)[0]
@@ -0,0 +1,107 @@
+import os
+import sys
+import tempfile
+import time
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import segment_store  # noqa: E402
+from segment_store import ENTRY, SegmentStore  # noqa: E402
+
+
+def record(ttl=60):
+    return {'secret': b'ciphertext', 'key_id': 1, 'alg': 'aes-gcm', 'compression': None,
+            'expires_at': time.time() + ttl}
+
+
+class TornTailTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.root = self.tmp.name
+        self.store = SegmentStore(self.root)
+
+    def tearDown(self):
+        self.store.close()
+        self.tmp.cleanup()
+
+    def active_path(self):
+        return os.path.join(self.root, self.store._files[max(self.store._files)])
+
+    def test_append_after_torn_tail_is_visible(self):
+        self.store.put('a', record())
+        # A writer killed mid-append: half an entry header, after this
+        # store's __init__ (so only the writer path can repair it)
+        with open(self.active_path(), 'ab') as f:
+            f.write(ENTRY.pack(1, 1, 100, time.time() + 60, 0)[:7])
+
+        self.assertEqual(self.store.put_many([('c', record())]), [True])
+        self.assertIsNotNone(self.store.get('c'))
+        reopened = SegmentStore(self.root)
+        try:
+            self.assertIsNotNone(reopened.get('a'))
+            self.assertIsNotNone(reopened.take('c'))
+        finally:
+            reopened.close()
+        self.assertIsNone(self.store.get('c'))
+
+    def test_short_write_is_rolled_back_and_reported(self):
+        self.store.put('a', record())
+        size = os.path.getsize(self.active_path())
+        real_write = os.write
+
+        def short_write(fd, data):
+            return real_write(fd, data[:len(data) // 2])
+
+        with mock.patch.object(segment_store.os, 'write', short_write):
+            self.assertEqual(self.store.put_many([('b', record()), ('c', record())]), [False, False])
+            with self.assertRaises(OSError):
+                self.store.put('d', record())
+        self.assertEqual(os.path.getsize(self.active_path()), size)
+
+        self.assertEqual(self.store.put_many([('e', record())]), [True])
+        reopened = SegmentStore(self.root)
+        try:
+            self.assertEqual(sorted(token for _, token in reopened.iter_expiries()), ['a', 'e'])
+        finally:
+            reopened.close()
+
+
+class CompactionTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.root = self.tmp.name
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_consumed_records_stay_gone_after_tombstones_are_compacted(self):
+        start = time.time()
+        store = SegmentStore(self.root, segment_bytes=4096)
+        # Segment 1: mostly long-lived records, so it is never compacted
+        store.put_many([(f'keep{i}', record(3600)) for i in range(60)]
+                       + [(f'gone{i}', record(60)) for i in range(20)])
+        # Segment 2: only the tombstones of the consumed ones
+        for i in range(20):
+            self.assertTrue(store.delete(f'gone{i}'))
+        store.put('x' * 64, dict(record(3600), secret=b'.' * 4096))
+        store.put('last', record(3600))
+        self.assertGreaterEqual(len(store._files), 3)
+
+        later = start + 120
+        with mock.patch.object(segment_store.time, 'time', return_value=later):
+            self.assertEqual(store.compact(later), 2)
+            store.close()
+            reopened = SegmentStore(self.root, segment_bytes=4096)
+            try:
+                tokens = {token for _, token in reopened.iter_expiries()}
+                self.assertFalse(any(token.startswith('gone') for token in tokens))
+                self.assertIsNone(reopened.take('gone0'))
+                self.assertEqual(reopened.stats()[0], 62)
+            finally:
+                reopened.close()
+
+
+if __name__ == '__main__':
+    unittest.main()